@@ -1,6 +1,7 @@
 from pathlib import Path
 
-from main import process_files_raw, process_files_currated  # type: ignore
+from main import process_files_raw, process_files_curated
+from helpers import iter_sweep_files
 
 
 def run_raw_processing(base_dir: Path, save_path: Path, plot: bool = False) -> None:
@@ -13,8 +14,7 @@ def run_raw_processing(base_dir: Path, save_path: Path, plot: bool = False) -> N
     import main as v1_main
 
     v1_main.PLOT_GRAPHS = plot
-    txt_files = [f for f in base_dir.rglob('*.txt') if len(f.relative_to(base_dir).parts) == 6]
-    process_files_raw(txt_files, base_dir, save_path)
+    process_files_raw(iter_sweep_files(base_dir), base_dir, save_path)
 
 
 def run_curated_processing(base_dir: Path, save_path: Path, plot: bool = False) -> None:
@@ -22,7 +22,6 @@ def run_curated_processing(base_dir: Path, save_path: Path, plot: bool = False)
     import main as v1_main
 
     v1_main.PLOT_GRAPHS = plot
-    txt_files = [f for f in base_dir.rglob('*.txt') if len(f.relative_to(base_dir).parts) == 6]
-    process_files_currated(txt_files, base_dir, save_path)
+    process_files_curated(iter_sweep_files(base_dir), base_dir, save_path)
 
 
@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from file_processing import HDF5Writer, create_device_dataframe
+from hdf5_reader import HDF5Reader
+from helpers import COMPRESSION_PROFILES, PER_FILE_FORMAT, CONSOLIDATED_FORMAT, dataframe_to_structured_array, \
+    generate_hdf5_keys
+
+""" Write/read throughput and file size of each HDF5 compression profile, in both store layouts
+
+usage: python benchmarks/hdf5_profiles.py [store.h5]
+With a store every dataset in it is the corpus, otherwise a synthetic one of FILES sweeps is made.
+"""
+
+FILES = 300  # synthetic sweeps
+ROWS = 2000  # rows per synthetic sweep
+LAYOUTS = {'per file': PER_FILE_FORMAT, 'consolidated': CONSOLIDATED_FORMAT}
+
+
+def synthetic_corpus():
+    """ {key: structured array} with a raw_data and one row file_stats dataset per sweep """
+    rng = np.random.default_rng(0)
+    corpus = {}
+    for i in range(FILES):
+        v = np.round(np.sin(np.linspace(0, 6 * np.pi, ROWS)), 4)
+        c = 1e-6 * v + rng.normal(scale=1e-9, size=ROWS)
+        raw_data = create_device_dataframe(v, c)
+        raw_data['classification'] = 'Memristive'
+        stats = raw_data[['resistance', 'abs_current']].mean().to_frame().T
+        key_file_stats, key_raw_data = generate_hdf5_keys('PMMA', f'D{i // 100}', 'A Section', f'{i % 10} Device',
+                                                          f'{i}-FS.txt')
+        corpus[key_raw_data] = dataframe_to_structured_array(raw_data)
+        corpus[key_file_stats] = dataframe_to_structured_array(stats)
+    return corpus
+
+
+def store_corpus(store_path):
+    with HDF5Reader(store_path) as reader:
+        return {key: reader.read(key) for key in reader.keys()}
+
+
+def write_store(path, corpus, format_version, profile):
+    start = time.perf_counter()
+    with HDF5Writer(path, flush_interval=200, format_version=format_version, compression=profile) as writer:
+        for key, data in corpus.items():
+            writer.write(key, data)
+    return time.perf_counter() - start
+
+
+def read_store(path):
+    start = time.perf_counter()
+    with HDF5Reader(path) as reader:
+        for key in reader.keys():
+            reader.read(key)
+    return time.perf_counter() - start
+
+
+def main():
+    corpus = store_corpus(sys.argv[1]) if len(sys.argv) > 1 else synthetic_corpus()
+    megabytes = sum(data.nbytes for data in corpus.values()) / 1e6
+    print(f"{len(corpus)} datasets, {megabytes:.1f} MB uncompressed")
+    print(f"{'layout':<14}{'profile':<14}{'write MB/s':>11}{'read MB/s':>11}{'file MB':>9}{'ratio':>7}")
+    with tempfile.TemporaryDirectory() as folder:
+        for layout, format_version in LAYOUTS.items():
+            for profile in COMPRESSION_PROFILES:
+                path = Path(folder) / f'{format_version}_{profile}.h5'
+                write = write_store(path, corpus, format_version, profile)
+                read = read_store(path)
+                size = os.path.getsize(path) / 1e6
+                print(f"{layout:<14}{profile:<14}{megabytes / write:>11.1f}{megabytes / read:>11.1f}{size:>9.2f}"
+                      f"{megabytes / size:>7.1f}")
+                path.unlink()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from file_processing import read_sweep_file, read_file_to_dataframe
+
+""" Times file_processing.read_sweep_file against the previous pd.read_csv based reader on each header variant """
+
+ROWS = 2000  # rows per file, a typical multi loop sweep
+FILES = 200  # files per variant
+HEADERS = {
+    'voltage current': 'voltage\tcurrent',
+    'Voltage Current Time': 'Voltage Current Time',
+    'VSOURC/IMEAS': 'VSOURC - Plot 0\tIMEAS - Plot 0',
+    'no header': None,
+}
+
+
+def legacy_read_file_to_dataframe(file):
+    """ read_file_to_dataframe before read_sweep_file, kept here to compare against """
+    try:
+        df = pd.read_csv(file, sep=r'\s+', header=0)
+
+        # Normalize column names to lowercase for consistency
+        df.columns = [col.lower() for col in df.columns]
+
+        # Find the column that contains 'voltage' and 'current'
+        target_col = next((col for col in df.columns if 'voltage' in col and 'current' in col), None)
+
+        if target_col:
+            split_values = df[target_col].str.split(expand=True)
+
+            if "time" in target_col:
+                df[['voltage', 'current', 'time']] = split_values.iloc[:, :3]  # Extract first 3 columns
+            else:
+                df[['voltage', 'current']] = split_values.iloc[:, :2]  # Extract first 2 columns
+
+            df.drop(columns=[target_col], inplace=True)  # Drop the original combined column
+
+        # Ensure numeric dtypes for downstream computations
+        for col in ['voltage', 'current', 'time']:
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+
+        # Drop rows where voltage or current are NaN after conversion
+        if 'voltage' in df.columns and 'current' in df.columns:
+            df = df.dropna(subset=['voltage', 'current'])
+
+        return df
+
+    except Exception as e:
+        print(f"Error reading file {file}: {e}")
+        return None
+
+
+def write_files(folder, header, with_time):
+    rng = np.random.default_rng(0)
+    files = []
+    for i in range(FILES):
+        v = np.round(np.sin(np.linspace(0, 6 * np.pi, ROWS)), 4)
+        c = 1e-6 * v + rng.normal(scale=1e-9, size=ROWS)
+        columns = [v, c, np.arange(ROWS) * 0.1] if with_time else [v, c]
+        path = Path(folder) / f'{i}.txt'
+        np.savetxt(path, np.column_stack(columns), fmt='%.6E', delimiter='\t', header=header or '', comments='')
+        if header is None:
+            # savetxt writes an empty first line for an empty header
+            path.write_text(path.read_text().lstrip('\n'))
+        files.append(path)
+    return files
+
+
+def time_reader(reader, files):
+    start = time.perf_counter()
+    for file in files:
+        reader(file)
+    return (time.perf_counter() - start) / len(files) * 1e3
+
+
+def main():
+    print(f"{'header':<22}{'legacy ms/file':>16}{'read_sweep_file':>17}{'as DataFrame':>14}  same values")
+    with tempfile.TemporaryDirectory() as folder:
+        for label, header in HEADERS.items():
+            variant = Path(folder) / label.replace('/', '_').replace(' ', '_')
+            variant.mkdir()
+            files = write_files(variant, header, with_time='Time' in label)
+
+            legacy = time_reader(legacy_read_file_to_dataframe, files)
+            fast = time_reader(read_sweep_file, files)
+            frame = time_reader(read_file_to_dataframe, files)
+
+            # the legacy reader only understands named voltage/current headers
+            old, new = legacy_read_file_to_dataframe(files[0]), read_file_to_dataframe(files[0])
+            if 'voltage' in old.columns:
+                same = all(np.array_equal(old[col].to_numpy(), new[col].to_numpy()) for col in old.columns)
+            else:
+                same = f"n/a (legacy columns {list(old.columns)[:3]}...)"
+            print(f"{label:<22}{legacy:>16.3f}{fast:>17.3f}{frame:>14.3f}  {same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,40 @@
 import numpy as np
 
 # Equations for manipulating data_analyzer.py
+# All array equations take array-likes (lists, Series or ndarrays) and return float64 ndarrays.
+# Divisions by zero are masked out and give 0, matching zero_devision_check.
+
+
+def _as_float_array(data):
+    """ Returns the input as a float64 ndarray without copying when possible """
+    return np.asarray(data, dtype=np.float64)
+
+
+def _masked_divide(numerator, denominator, mask):
+    """ numerator / denominator where mask is True, 0 elsewhere """
+    out = np.zeros(np.broadcast(numerator, denominator).shape, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        np.divide(numerator, denominator, out=out, where=mask)
+    return out
+
 
 def absolute_val(col):
     """ Returns the absolute value of inputted value """
-    return [abs(x) for x in col]
+    return np.abs(_as_float_array(col))
 
 
 def filter_positive_values(v_data, c_data):
     """ Returns only positive values from voltage and current arrays """
-    result_voltage_ps, result_current_ps = [], []
-
-    for v, c in zip(v_data, c_data):
-        if v >= 0:
-            result_voltage_ps.append(v)
-            result_current_ps.append(c)
-        else:
-            result_voltage_ps.append(0)
-            result_current_ps.append(0)
-
-    return result_voltage_ps, result_current_ps
+    v_data, c_data = _as_float_array(v_data), _as_float_array(c_data)
+    mask = v_data >= 0
+    return np.where(mask, v_data, 0.0), np.where(mask, c_data, 0.0)
 
 
 def filter_negative_values(v_data, c_data):
     """ Returns only negative values from voltage and current arrays """
-    result_voltage_ng, result_current_ng = [], []
-    for v, c in zip(v_data, c_data):
-        if v <= 0:
-            result_voltage_ng.append(v)
-            result_current_ng.append(c)
-        else:
-            result_voltage_ng.append(0)
-            result_current_ng.append(0)
-
-    return absolute_val(result_voltage_ng), absolute_val(result_current_ng)
+    v_data, c_data = _as_float_array(v_data), _as_float_array(c_data)
+    mask = v_data <= 0
+    return np.abs(np.where(mask, v_data, 0.0)), np.abs(np.where(mask, c_data, 0.0))
 
 
 def zero_devision_check(x, y):
@@ -46,36 +47,141 @@ def zero_devision_check(x, y):
 
 def resistance(v_data, c_data):
     """ Calculate resistance from voltage and current arrays """
-    return [zero_devision_check(v, c) for v, c in zip(v_data, c_data)]
+    v_data, c_data = _as_float_array(v_data), _as_float_array(c_data)
+    return _masked_divide(v_data, c_data, c_data != 0)
+
+
+def low_bias_resistance(v_data, resistance_data, voltage_max):
+    """ Mean resistance over the points from 0 V up to voltage_max, NaN values left out (NaN when there are none) """
+    v_data, resistance_data = _as_float_array(v_data), _as_float_array(resistance_data)
+    values = resistance_data[(v_data >= 0) & (v_data <= voltage_max)]
+    valid = ~np.isnan(values)
+    count = np.count_nonzero(valid)
+    # summed with the NaN as 0, as pandas' Series.mean does
+    return np.where(valid, values, 0.0).sum() / count if count else np.nan
 
 
 def log_value(array):
     """ Logarithm of each element in the array, avoiding zero errors """
-    return [np.log(abs(x)) if x != 0 else 0 for x in array]
+    array = _as_float_array(array)
+    out = np.zeros(array.shape, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        np.log(np.abs(array), out=out, where=array != 0)
+    return out
 
 
 def current_density_eq(v_data, c_data, distance=100E-9, area=100E-6):
     """ Calculates current density using voltage and current arrays """
-    current_density = []
-    for v, c in zip(v_data, c_data):
-        if v == 0 or c == 0:
-            current_density.append(0)
-            continue
-        new_num = (distance / ((v / c) * area ** 2)) * (v / distance)
-        current_density.append(new_num)
-    return current_density
+    v_data, c_data = _as_float_array(v_data), _as_float_array(c_data)
+    mask = (v_data != 0) & (c_data != 0)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # same operation order as the scalar formula so results match bit for bit
+        current_density = (distance / ((v_data / c_data) * area ** 2)) * (v_data / distance)
+    return np.where(mask, current_density, 0.0)
 
 
 def electric_field_eq(v_data, distance=100E-9):
     """ Calculates electric field using voltage array """
-    return [v / distance if v != 0 else 0 for v in v_data]
+    v_data = _as_float_array(v_data)
+    return _masked_divide(v_data, distance, v_data != 0)
 
 
 def inverse_resistance_eq(v_data, c_data):
     """ Inverse of resistance (current/voltage) """
-    return [c / v if v != 0 and c != 0 else 0 for v, c in zip(v_data, c_data)]
+    v_data, c_data = _as_float_array(v_data), _as_float_array(c_data)
+    return _masked_divide(c_data, v_data, (v_data != 0) & (c_data != 0))
 
 
 def sqrt_array(value_array):
     """ Square root of an array """
-    return [v ** 0.5 for v in value_array]
+    # np.sqrt is correctly rounded, libm pow (used by v ** 0.5) can be 1 ulp off on rare values.
+    # Adding 0.0 turns sqrt(-0.0) into 0.0 like (-0.0) ** 0.5
+    with np.errstate(invalid='ignore'):
+        return np.sqrt(_as_float_array(value_array)) + 0.0
+
+
+# Column order of the per-file raw_data table, as built by derived_columns
+RAW_DATA_COLUMNS = (
+    'voltage', 'current', 'abs_current', 'resistance', 'voltage_ps', 'current_ps', 'voltage_ng', 'current_ng',
+    'log_Resistance', 'abs_Current_ps', 'abs_Current_ng', 'current_Density_ps', 'current_Density_ng',
+    'electric_field_ps', 'electric_field_ng', 'inverse_resistance_ps', 'inverse_resistance_ng',
+    'sqrt_Voltage_ps', 'sqrt_Voltage_ng',
+)
+
+
+def derived_columns(v_data, c_data, distance=100E-9, area=100E-6):
+    """
+    Fused kernel for every RAW_DATA_COLUMNS column.
+    v/c, c/v and v/distance are each computed once and the ps/ng variants are taken from them with masks
+    (for the ng side |v|/|c| == |v/c| exactly), so the values match the individual equations above.
+    :return: preallocated (len(RAW_DATA_COLUMNS), n) float64 block, one row per column
+    """
+    v, c = _as_float_array(v_data).ravel(), _as_float_array(c_data).ravel()
+    block = np.zeros((len(RAW_DATA_COLUMNS), v.size), dtype=np.float64)
+    (voltage, current, abs_current, res, v_ps, c_ps, v_ng, c_ng, log_res, abs_c_ps, abs_c_ng, cd_ps, cd_ng,
+     ef_ps, ef_ng, ir_ps, ir_ng, sqrt_v_ps, sqrt_v_ng) = block
+
+    ps = v >= 0
+    ng = v <= 0
+    non_zero = (v != 0) & (c != 0)
+
+    voltage[:] = v
+    current[:] = c
+    np.abs(c, out=abs_current)
+    np.copyto(v_ps, v, where=ps)
+    np.copyto(c_ps, c, where=ps)
+    np.abs(v, out=v_ng, where=ng)
+    np.abs(c, out=c_ng, where=ng)
+    np.abs(c, out=abs_c_ps, where=ps)
+    abs_c_ng[:] = c_ng
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        np.divide(v, c, out=res, where=c != 0)
+        np.abs(res, out=log_res)
+        np.log(log_res, out=log_res, where=res != 0)
+
+        # scratch rows: the ng results are the magnitudes of the ps ones
+        np.divide(v, distance, out=ef_ps, where=v != 0)
+        np.abs(ef_ps, out=ef_ng, where=ng)
+        ef_ps[~ps] = 0.0
+        np.divide(c, v, out=ir_ps, where=non_zero)
+        np.abs(ir_ps, out=ir_ng, where=ng)
+        ir_ps[~ps] = 0.0
+        np.multiply(distance / (res * area ** 2), ef_ps, out=cd_ps, where=non_zero & ps)
+        np.multiply(distance / (np.abs(res) * area ** 2), ef_ng, out=cd_ng, where=non_zero & ng)
+
+        np.sqrt(v_ps, out=sqrt_v_ps)
+        np.sqrt(v_ng, out=sqrt_v_ng)
+    # as in sqrt_array, turns -0.0 into 0.0
+    sqrt_v_ps += 0.0
+    sqrt_v_ng += 0.0
+    return block
+
+
+def _sides(v_data, c_data):
+    """ (v_ps, c_ps, v_ng, c_ng) as used by the ps/ng columns """
+    return filter_positive_values(v_data, c_data) + filter_negative_values(v_data, c_data)
+
+
+# Each RAW_DATA_COLUMNS column as a function of voltage and current, for computing one column on its own
+DERIVED_COLUMNS = {
+    'voltage': lambda v, c: _as_float_array(v),
+    'current': lambda v, c: _as_float_array(c),
+    'abs_current': lambda v, c: absolute_val(c),
+    'resistance': resistance,
+    'voltage_ps': lambda v, c: _sides(v, c)[0],
+    'current_ps': lambda v, c: _sides(v, c)[1],
+    'voltage_ng': lambda v, c: _sides(v, c)[2],
+    'current_ng': lambda v, c: _sides(v, c)[3],
+    'log_Resistance': lambda v, c: log_value(resistance(v, c)),
+    'abs_Current_ps': lambda v, c: absolute_val(_sides(v, c)[1]),
+    'abs_Current_ng': lambda v, c: absolute_val(_sides(v, c)[3]),
+    'current_Density_ps': lambda v, c: current_density_eq(*_sides(v, c)[:2]),
+    'current_Density_ng': lambda v, c: current_density_eq(*_sides(v, c)[2:]),
+    'electric_field_ps': lambda v, c: electric_field_eq(_sides(v, c)[0]),
+    'electric_field_ng': lambda v, c: electric_field_eq(_sides(v, c)[2]),
+    'inverse_resistance_ps': lambda v, c: inverse_resistance_eq(*_sides(v, c)[:2]),
+    'inverse_resistance_ng': lambda v, c: inverse_resistance_eq(*_sides(v, c)[2:]),
+    'sqrt_Voltage_ps': lambda v, c: sqrt_array(_sides(v, c)[0]),
+    'sqrt_Voltage_ng': lambda v, c: sqrt_array(_sides(v, c)[2]),
+}
@@ -8,6 +8,59 @@ import pandas as pd
 """ Any interacting with Excell goes here"""
 # add in other sheet
 
+# Sheets of the master workbook and the column each one is looked up by
+FABRICATION_SHEETS = {
+    'Memristor Devices': 'Device Full Name',
+    'Devices Overview': 'Device Full Name',
+    'Prepared Solutions': 'Solution Id',
+}
+
+# Loaded master workbooks: excel path -> (mtime, {sheet name: DataFrame indexed by its lookup column})
+_fabrication_registry = {}
+
+
+def load_fabrication_registry(excel_path, snapshot_path=None):
+    """
+    Loads the FABRICATION_SHEETS of the master workbook once, each indexed by its lookup column (first row wins, like
+    the row filters did). Kept in memory for the run and pickled to snapshot_path (default: next to the workbook)
+    together with the workbook mtime, so later runs skip openpyxl until the workbook changes.
+    :return: {sheet name: DataFrame}, rows fetched with sheet.loc[name]
+    """
+    excel_path = str(excel_path)
+    mtime = os.path.getmtime(excel_path)
+
+    cached = _fabrication_registry.get(excel_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    snapshot_path = Path(snapshot_path) if snapshot_path else Path(excel_path).with_suffix('.pkl')
+    registry = None
+    if snapshot_path.exists():
+        try:
+            with open(snapshot_path, 'rb') as file:
+                snapshot = pickle.load(file)
+            if snapshot.get('mtime') == mtime:
+                registry = snapshot['sheets']
+        except Exception as e:
+            print(f"Could not read fabrication snapshot {snapshot_path}: {e}")
+
+    if registry is None:
+        registry = {}
+        with pd.ExcelFile(excel_path, engine='openpyxl') as xls:
+            for sheet, column in FABRICATION_SHEETS.items():
+                df = pd.read_excel(xls, sheet_name=sheet)
+                df = df[df[column].notna()].drop_duplicates(subset=column, keep='first')
+                registry[sheet] = df.set_index(column, drop=False)
+        try:
+            with open(snapshot_path, 'wb') as file:
+                pickle.dump({'mtime': mtime, 'sheets': registry}, file)
+        except OSError as e:
+            print(f"Could not save fabrication snapshot {snapshot_path}: {e}")
+
+    _fabrication_registry[excel_path] = (mtime, registry)
+    return registry
+
+
 def save_info_from_solution_devices_excell(device_name, excel_path):
     '''
     Takes the device name looks up the information within the excel document given and returns all the information
@@ -19,98 +72,93 @@ def save_info_from_solution_devices_excell(device_name, excel_path):
     :return: Saves device parameters as a data_analyzer.py frame
     '''
     try:
-        # Read the Excel file into a DataFrame without modifying it
-        with pd.ExcelFile(excel_path, engine='openpyxl') as xls:
-            df = pd.read_excel(xls, sheet_name='Memristor Devices')
-            df_overview = pd.read_excel(xls, sheet_name='Devices Overview')
+        # All three sheets come from the registry, the workbook is only parsed when it changes
+        registry = load_fabrication_registry(excel_path)
+        df = registry['Memristor Devices']
+        df_overview = registry['Devices Overview']
 
         # Find the row with the given device name in the "Device Full Name" column
-        row = df[df['Device Full Name'] == device_name]
-
-        if not row.empty:
+        if device_name in df.index:
+            row = df.loc[device_name]
             # Extract information from the found row
             info_dict = {
-                'Device Full Name': row.iloc[0]['Device Full Name'],
-                'B-Electrode (nm)': row.iloc[0]['B-Electrode (nm)'],
-                'B-Material': row.iloc[0]['B-Material'],
-                'Solution 1 ID': row.iloc[0]['Solution 1 ID'],
-                'Solution 1 Spin Speed': row.iloc[0]['Solution 1 Spin Speed'],
-                'Solution 2 ID': row.iloc[0]['Solution 2 ID'],
-                'Solution 2 Spin Speed': row.iloc[0]['Solution 2 Spin Speed'],
-                'Solution 3 ID': row.iloc[0]['Solution 3 ID'],
-                'Solution 3 Spin Speed': row.iloc[0]['Solution 3 Spin Speed'],
-                'Solution 4 ID': row.iloc[0]['Solution 4 ID'],
-                'Solution 4 Spin Speed': row.iloc[0]['Solution 4 Spin Speed'],
-                'T-Electrode (nm)': row.iloc[0]['T-Electrode (nm)'],
-                'T-Material': row.iloc[0]['T-Material'],
-                '# Barrier': row.iloc[0]['# Barrier'],
-                'Layer 1': row.iloc[0]['Layer 1'],
-                'Layer 2': row.iloc[0]['Layer 2'],
-                'Layer 3': row.iloc[0]['Layer 3'],
-                'Layer 4': row.iloc[0]['Layer 4'],
-                'Np Type': row.iloc[0]['Np Type'],
-                'Np Concentraion': row.iloc[0]['Np Concentraion'], # this is spelt wrong
-                'Oz Clean Time': row.iloc[0]['Oz Clean Time'],
-                'Np Solution Id': row.iloc[0]['Np Solution Id'],
-                'Controll?': row.iloc[0]['Controll?'],
-                'Polymer': row.iloc[0]['Polymer'],
-                'Annealing': row.iloc[0]['Annealing'],
+                'Device Full Name': row['Device Full Name'],
+                'B-Electrode (nm)': row['B-Electrode (nm)'],
+                'B-Material': row['B-Material'],
+                'Solution 1 ID': row['Solution 1 ID'],
+                'Solution 1 Spin Speed': row['Solution 1 Spin Speed'],
+                'Solution 2 ID': row['Solution 2 ID'],
+                'Solution 2 Spin Speed': row['Solution 2 Spin Speed'],
+                'Solution 3 ID': row['Solution 3 ID'],
+                'Solution 3 Spin Speed': row['Solution 3 Spin Speed'],
+                'Solution 4 ID': row['Solution 4 ID'],
+                'Solution 4 Spin Speed': row['Solution 4 Spin Speed'],
+                'T-Electrode (nm)': row['T-Electrode (nm)'],
+                'T-Material': row['T-Material'],
+                '# Barrier': row['# Barrier'],
+                'Layer 1': row['Layer 1'],
+                'Layer 2': row['Layer 2'],
+                'Layer 3': row['Layer 3'],
+                'Layer 4': row['Layer 4'],
+                'Np Type': row['Np Type'],
+                'Np Concentraion': row['Np Concentraion'], # this is spelt wrong
+                'Oz Clean Time': row['Oz Clean Time'],
+                'Np Solution Id': row['Np Solution Id'],
+                'Controll?': row['Controll?'],
+                'Polymer': row['Polymer'],
+                'Annealing': row['Annealing'],
 
                 # Add more fields as needed
             }
             #print(info_dict)
 
             # Extract information from 'Devices Overview' sheet
-            row_overview = df_overview[df_overview['Device Full Name'] == device_name]
-
-            if not row_overview.empty:
+            if device_name in df_overview.index:
+                row_overview = df_overview.loc[device_name]
                 info_dict.update({
-                    'Volume Fraction': row_overview.iloc[0]['Volume fraction'],
-                    'Volume Fraction %': row_overview.iloc[0]['Volume fraction %'],
-                    'Weight Fraction': row_overview.iloc[0]['Weight Fraction'],
-                    '# Dots Volume 400μm': row_overview.iloc[0]['# Dots volume 400μm'],
-                    '# Dots in 200μm': row_overview.iloc[0]['# Dots in 200μm'],
-                    '# Dots in 100μm': row_overview.iloc[0]['# Dots in 100μm'],
-                    'Qd Spacing (nm)': row_overview.iloc[0]['Qd Spacing (nm)'],
-                    'Separation Distance': row_overview.iloc[0]['Seperation Distance']
+                    'Volume Fraction': row_overview['Volume fraction'],
+                    'Volume Fraction %': row_overview['Volume fraction %'],
+                    'Weight Fraction': row_overview['Weight Fraction'],
+                    '# Dots Volume 400μm': row_overview['# Dots volume 400μm'],
+                    '# Dots in 200μm': row_overview['# Dots in 200μm'],
+                    '# Dots in 100μm': row_overview['# Dots in 100μm'],
+                    'Qd Spacing (nm)': row_overview['Qd Spacing (nm)'],
+                    'Separation Distance': row_overview['Seperation Distance']
                 })
             else:
                 print(f"Warning: Device '{device_name}' not found in 'Devices Overview'.")
 
             solutions = ["Solution 1 ID", "Solution 2 ID", "Solution 3 ID", "Solution 4 ID"]
 
-            # Read the Excel file into a DataFrame without modifying it
-            with pd.ExcelFile(excel_path, engine='openpyxl') as xls:
-                df = pd.read_excel(xls, sheet_name='Prepared Solutions')
+            df = registry['Prepared Solutions']
 
             # Loop through solutions
             for solution in solutions:
-                df_solutions = df[df['Solution Id'] == info_dict.get(solution)]
-
                 if pd.notnull(info_dict.get(solution)):
-                    if not df_solutions.empty:
+                    if info_dict.get(solution) in df.index:
+                        df_solutions = df.loc[info_dict.get(solution)]
                         # extract information about solutions
-                        info_dict['Solution #'+ solution] = df_solutions.iloc[0]['Solution #']
-                        info_dict['Np Solution used ' + solution] = df_solutions.iloc[0]['Np Solution used']
-                        info_dict['Polymer 1 ' + solution] = df_solutions.iloc[0]['Polymer 1']
-                        info_dict['Polymer 2 ' + solution] = df_solutions.iloc[0]['Polymer 2']
-                        info_dict['Polymer % ' + solution] = df_solutions.iloc[0]['Polymer %']
-                        info_dict['Np solution mg/ml ' + solution] = df_solutions.iloc[0]['Np solution (mg/ml)']
-                        info_dict['Np Stock Solution Weight ' + solution] = df_solutions.iloc[0]['Np Stock Solution Weight (g)']
-                        info_dict['Polymer 1 Weight ' + solution] = df_solutions.iloc[0]['Polymer 1 Weight (g)']
-                        info_dict['Polymer 2 Weight ' + solution] = df_solutions.iloc[0]['Polymer 2 Weight (g)']
-                        info_dict['Solvent Weight ' + solution] = df_solutions.iloc[0]['Solvent Weight (g)']
-                        info_dict['Calculated polymer (%)' + solution] = df_solutions.iloc[0]['Calculated polymer (%)']
-                        info_dict['Polymer ratio % ' + solution] = df_solutions.iloc[0]['Polymer ratio %']
-                        info_dict['Solvent ' + solution] = df_solutions.iloc[0]['Solvent ']  # this has a space at end
-                        info_dict['Controll? ' + solution] = df_solutions.iloc[0]['Controll?']
-                        info_dict['Calculated mg/ml ' + solution] = df_solutions.iloc[0]['Calculated mg/ml']
-                        info_dict['Polymer Density ' + solution] = df_solutions.iloc[0]['Polymer Density (g/cm^3)']
-                        info_dict['Solvent Density ' + solution] = df_solutions.iloc[0]['Solvent Density (g/cm^3)']
-                        info_dict['Np Material ' + solution] = df_solutions.iloc[0]['Np Material']
-                        info_dict['Np Size (nm) ' + solution] = df_solutions.iloc[0]['Np Size (nm)']
-                        info_dict['Np weight (g) ' + solution] = df_solutions.iloc[0]['Np weight (g)']
-                        info_dict['Stock Np Solution Concentration ' + solution] = df_solutions.iloc[0]['Stock Np Solution Concentration (mg/ml)']
+                        info_dict['Solution #'+ solution] = df_solutions['Solution #']
+                        info_dict['Np Solution used ' + solution] = df_solutions['Np Solution used']
+                        info_dict['Polymer 1 ' + solution] = df_solutions['Polymer 1']
+                        info_dict['Polymer 2 ' + solution] = df_solutions['Polymer 2']
+                        info_dict['Polymer % ' + solution] = df_solutions['Polymer %']
+                        info_dict['Np solution mg/ml ' + solution] = df_solutions['Np solution (mg/ml)']
+                        info_dict['Np Stock Solution Weight ' + solution] = df_solutions['Np Stock Solution Weight (g)']
+                        info_dict['Polymer 1 Weight ' + solution] = df_solutions['Polymer 1 Weight (g)']
+                        info_dict['Polymer 2 Weight ' + solution] = df_solutions['Polymer 2 Weight (g)']
+                        info_dict['Solvent Weight ' + solution] = df_solutions['Solvent Weight (g)']
+                        info_dict['Calculated polymer (%)' + solution] = df_solutions['Calculated polymer (%)']
+                        info_dict['Polymer ratio % ' + solution] = df_solutions['Polymer ratio %']
+                        info_dict['Solvent ' + solution] = df_solutions['Solvent ']  # this has a space at end
+                        info_dict['Controll? ' + solution] = df_solutions['Controll?']
+                        info_dict['Calculated mg/ml ' + solution] = df_solutions['Calculated mg/ml']
+                        info_dict['Polymer Density ' + solution] = df_solutions['Polymer Density (g/cm^3)']
+                        info_dict['Solvent Density ' + solution] = df_solutions['Solvent Density (g/cm^3)']
+                        info_dict['Np Material ' + solution] = df_solutions['Np Material']
+                        info_dict['Np Size (nm) ' + solution] = df_solutions['Np Size (nm)']
+                        info_dict['Np weight (g) ' + solution] = df_solutions['Np weight (g)']
+                        info_dict['Stock Np Solution Concentration ' + solution] = df_solutions['Stock Np Solution Concentration (mg/ml)']
                     else:
                         print(f"Skipping search in 'Prepared Solutions' because Solution {solution} ID is blank or null.")
                         continue  # Skip the rest of the loop for this solution ID
@@ -228,4 +276,52 @@ def device_clasification(excell_dict, device_folder, section_folder, path):
         return (classification)
     except:
         print("please add xls too ", path)
-        return None
\ No newline at end of file
+        return None
+
+# Parsed per-sample workbooks: excel path -> (mtime, {section letter: {device #: classification}})
+_classification_cache = {}
+
+
+def load_device_classifications(device_name, device_fol_location):
+    """
+    Parses the sample's workbook once into {section letter: {device #: classification}} (first row wins, as in
+    device_clasification). Cached by workbook path and mtime, so it is only parsed again when the file changes.
+    Returns None if the workbook could not be read.
+    """
+    excel_path = str(Path(device_fol_location) / f"{device_name}.xlsx")
+    try:
+        mtime = os.path.getmtime(excel_path)
+    except OSError:
+        mtime = None
+
+    cached = _classification_cache.get(excel_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    section_dataframes = save_info_from_device_into_excell(device_name, device_fol_location)
+    lookup = None
+    try:
+        if section_dataframes is not None:
+            lookup = {}
+            for section, df in section_dataframes.items():
+                devices = lookup[section] = {}
+                for device_number, classification in zip(df["Device #"].values, df["Classification"].values):
+                    devices.setdefault(device_number, classification)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        lookup = None
+
+    _classification_cache[excel_path] = (mtime, lookup)
+    return lookup
+
+
+def cached_device_clasification(device_name, device_fol_location, device_folder, section_folder):
+    """ Same result as device_clasification, using the cached workbook lookup from load_device_classifications """
+    lookup = load_device_classifications(device_name, device_fol_location)
+    try:
+        # first letter of the section folder and first two digits of the device folder
+        devices = lookup[section_folder[0].upper()]
+        return devices.get(int(device_folder[:2]))
+    except:
+        print("please add xls too ", device_fol_location)
+        return None
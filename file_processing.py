@@ -1,12 +1,25 @@
+import io
+import os
+import json
+import queue
+import multiprocessing
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import warnings
 import pandas as pd
 import sys
 import h5py
-from equations import absolute_val, current_density_eq, resistance, electric_field_eq, inverse_resistance_eq, \
-    sqrt_array, zero_devision_check,log_value,filter_positive_values,filter_negative_values
+import numpy as np
+from equations import zero_devision_check, derived_columns, RAW_DATA_COLUMNS
 import equations as eq
 from metrics_calculation import calculate_metrics_for_loops, area_under_curves, on_off_values
 from plotting import plot_loop_data, plot_single_sweep_data
-from helpers import check_for_loops, extract_folder_names, check_if_folder_exists,split_iv_sweep,dataframe_to_structured_array
+from helpers import check_for_loops, extract_folder_names, check_if_folder_exists,split_iv_sweep,dataframe_to_structured_array, \
+    source_signature, file_hash, sniff_sweep_type, check_for_nan, generate_analysis_params, generate_hdf5_keys, \
+    split_hdf5_key, hdf5_key_metadata, METADATA_COLUMNS, FORMAT_VERSION_ATTR, PER_FILE_FORMAT, CONSOLIDATED_FORMAT, SAMPLE_INDEX, SAMPLE_SCHEMAS_ATTR, \
+    dataset_options, DEFAULT_COMPRESSION, UNKNOWN_CLASSIFICATION, DEFAULT_SUMMARY_VOLTAGES, HDF5_TABLES
+from hdf5_reader import INDEX_DTYPE, CATALOG_KEY, CATALOG_DTYPE, SUMMARY_KEY, SUMMARY_STATS_ATTR, store_format, \
+    load_sample_index, load_sample_schemas, sample_groups, dtype_code, catalog_entry, load_catalog, scan_catalog, \
+    column_fill, widen_dtype, low_bias_resistances, summary_array, load_summary, scan_summary
 
 
 def file_analysis(df, plot_graph, save_df, device_path, re_save_graph, short_name, long_name):
@@ -18,20 +31,15 @@ def file_analysis(df, plot_graph, save_df, device_path, re_save_graph, short_nam
     v_data = df['voltage']
     c_data = df['current']
 
-    v_data_ps, c_data_ps = filter_positive_values(v_data, c_data)
-    v_data_ng, c_data_ng = filter_negative_values(v_data, c_data)
-
-    # Step 2: Check for multiple sweeps
-    num_sweeps = check_for_loops(v_data)
-
-    # Step 3: Continue creating DataFrame with metrics
-    metrics_df = create_device_dataframe(v_data, c_data, v_data_ps, c_data_ps, v_data_ng, c_data_ng)
-
+    # Step 2: Continue creating DataFrame with metrics
+    metrics_df = create_device_dataframe(v_data, c_data)
 
+    # Step 3: Check for multiple sweeps, finding where each loop starts and stops
+    loop_bounds = check_for_loops(metrics_df['voltage'])
 
     # Step 4: Handle single or multiple sweeps
-    if num_sweeps > 1:
-        _, _, df_file_stats = handle_multiple_sweeps(metrics_df, num_sweeps, device_path, None, plot_graph,
+    if len(loop_bounds) > 1:
+        _, _, df_file_stats = handle_multiple_sweeps(metrics_df, loop_bounds, device_path, None, plot_graph,
                                                      re_save_graph)
     else:
         _, _, df_file_stats = handle_single_sweep(metrics_df, None, device_path, plot_graph, re_save_graph)
@@ -48,72 +56,71 @@ def file_analysis_retention():
     pass
 
 
-def create_device_dataframe(v_data, c_data, v_data_ps, c_data_ps, v_data_ng, c_data_ng):
-    """ Create a DataFrame with voltage, current, and other metrics. """
-    data = {
-        'voltage': v_data,
-        'current': c_data,
-        'abs_current': absolute_val(c_data),
-        'resistance': resistance(v_data, c_data),
-        'voltage_ps': v_data_ps,
-        'current_ps': c_data_ps,
-        'voltage_ng': v_data_ng,
-        'current_ng': c_data_ng,
-        'log_Resistance': log_value(resistance(v_data, c_data)),
-        'abs_Current_ps': absolute_val(c_data_ps),
-        'abs_Current_ng': absolute_val(c_data_ng),
-        'current_Density_ps': current_density_eq(v_data_ps, c_data_ps),
-        'current_Density_ng': current_density_eq(v_data_ng, c_data_ng),
-        'electric_field_ps': electric_field_eq(v_data_ps),
-        'electric_field_ng': electric_field_eq(v_data_ng),
-        'inverse_resistance_ps': inverse_resistance_eq(v_data_ps, c_data_ps),
-        'inverse_resistance_ng': inverse_resistance_eq(v_data_ng, c_data_ng),
-        'sqrt_Voltage_ps': sqrt_array(v_data_ps),
-        'sqrt_Voltage_ng': sqrt_array(v_data_ng),
-    }
-    df = pd.DataFrame(data).dropna()
+def create_device_dataframe(v_data, c_data):
+    """ Create a DataFrame with voltage, current, and other metrics.
+    All columns are filled by one fused kernel into a single float64 block, which the DataFrame wraps without copying
+    """
+    block = derived_columns(v_data, c_data)
+    index = v_data.index if isinstance(v_data, pd.Series) else None
+
+    # only drop rows when there is a NaN, dropna always copies
+    nan_rows = np.isnan(block).any(axis=0)
+    if nan_rows.any():
+        block = block[:, ~nan_rows]
+        index = index[~nan_rows] if index is not None else np.flatnonzero(~nan_rows)
+
+    # pandas stores a 2-D block transposed, so passing block.T keeps the (columns, rows) layout as is
+    df = pd.DataFrame(block.T, columns=list(RAW_DATA_COLUMNS), index=index, copy=False)
     return df
 
 
-def split_loops(v_data, c_data, num_loops):
-    """ Splits looped data_analyzer.py and outputs each sweep as another array """
-    total_length = len(v_data)  # Assuming both v_data and c_data have the same length
-    size = total_length // num_loops  # Calculate the size based on the number of loops
+# Columns kept by compact storage, the rest of RAW_DATA_COLUMNS are recomputed on read (hdf5_reader.SweepColumns)
+COMPACT_COLUMNS = ('voltage', 'current', 'time', 'classification')
+
 
-    # Convert size to integer
-    size = int(size)
+def compact_raw_data(df_raw_data, df):
+    """ The measured columns of df_raw_data, with time taken from the file data df when it has it """
+    compact = df_raw_data[['voltage', 'current']].copy()
+    if 'time' in df.columns:
+        # df_raw_data keeps the index of df for the rows it did not drop
+        compact['time'] = df['time']
+    if 'classification' in df_raw_data.columns:
+        compact['classification'] = df_raw_data['classification']
+    return compact
 
-    # Handle the case when the division leaves a remainder
-    if total_length % num_loops != 0:
-        size += 1
 
-    split_v_data = [v_data[i:i + size] for i in range(0, total_length, size)]
-    split_c_data = [c_data[i:i + size] for i in range(0, total_length, size)]
+def split_loops(v_data, c_data, loop_bounds):
+    """ Splits looped data_analyzer.py and outputs each sweep as another array
+    loop_bounds holds the [start, stop) indices of each loop, as returned by check_for_loops """
+    split_v_data = [v_data[start:stop] for start, stop in loop_bounds]
+    split_c_data = [c_data[start:stop] for start, stop in loop_bounds]
 
     return split_v_data, split_c_data
 
 
-def handle_multiple_sweeps(df, num_sweeps, device_path, file_info, plot_graph, re_save_graph):
+def handle_multiple_sweeps(df, loop_bounds, device_path, file_info, plot_graph, re_save_graph):
     """ Handle logic for multiple sweeps """
 
     # Split loop data_analyzer.py
-    split_v_data, split_c_data = split_loops(df['voltage'], df['current'], num_sweeps)
+    split_v_data, split_c_data = split_loops(df['voltage'], df['current'], loop_bounds)
 
-    # Calculate metrics for multiple sweeps
+    # Calculate metrics for all loops in one batched call, one value per loop
     ps_areas, ng_areas, areas, normalized_areas, ron, roff, von, voff = calculate_metrics_for_loops(split_v_data,
                                                                                                     split_c_data)
+    ron_avg, roff_avg = np.mean(ron), np.mean(roff)
 
     # Store metrics in DataFrame
     file_stats = {
-        'ps_area_avg': sum(ps_areas) / len(ps_areas),
-        'ng_area_avg': sum(ng_areas) / len(ng_areas),
-        'areas_avg': sum(areas) / len(areas),
-        'normalized_areas_avg': sum(normalized_areas) / len(normalized_areas),
-        'resistance_on_value': sum(ron) / len(ron),
-        'resistance_off_value': sum(roff) / len(roff),
-        'ON_OFF_Ratio': zero_devision_check(sum(ron) / len(ron), sum(roff) / len(roff)),
-        'voltage_on_value': sum(von) / len(von),
-        'voltage_off_value': sum(voff) / len(voff),
+        'ps_area_avg': np.mean(ps_areas),
+        'ng_area_avg': np.mean(ng_areas),
+        'areas_avg': np.mean(areas),
+        'normalized_areas_avg': np.mean(normalized_areas),
+        'resistance_on_value': ron_avg,
+        'resistance_off_value': roff_avg,
+        # 0 when no loop has a valid resistance (0 / 0 gives NaN for numpy floats instead of raising)
+        'ON_OFF_Ratio': float(np.divide(ron_avg, roff_avg, out=np.zeros(()), where=roff_avg != 0)),
+        'voltage_on_value': np.mean(von),
+        'voltage_off_value': np.mean(voff),
     }
     df_file_stats = pd.DataFrame([file_stats])
 
@@ -169,47 +176,125 @@ def handle_single_sweep(df, file_info, device_path, plot_graph, re_save_graph):
     #     print(f"Error reading file {file}: {e}")
     #     return None
 
-def read_file_to_dataframe(file):
+# Column names of a sweep file without a header, or with the 'VSOURC - Plot 0\tIMEAS - Plot 0' header
+SWEEP_COLUMNS = ('voltage', 'current', 'time')
+
+
+def _is_number(s):
     try:
-        df = pd.read_csv(file, sep='\s+', header=0)
+        float(s)
+        return True
+    except ValueError:
+        return False
 
-        # Normalize column names to lowercase for consistency
-        df.columns = [col.lower() for col in df.columns]
 
-        # Find the column that contains 'voltage' and 'current'
-        target_col = next((col for col in df.columns if 'voltage' in col and 'current' in col), None)
+def sweep_file_header(first_line):
+    """
+    Works out the layout of a sweep file from its first line.
+    :return: column names (lower case) and the number of header rows to skip
+    """
+    tokens = first_line.split()
+    # headerless, the file starts straight away with numbers
+    if all(_is_number(token) for token in tokens):
+        names = list(SWEEP_COLUMNS[:len(tokens)])
+        names += [f'column_{i}' for i in range(len(names), len(tokens))]
+        return names, 0
+    # 'VSOURC - Plot 0\tIMEAS - Plot 0', the tool's export header
+    if 'VSOURC' in first_line and 'IMEAS' in first_line:
+        return ['voltage', 'current'], 1
 
-        if target_col:
-            split_values = df[target_col].str.split(expand=True)
+    # one name per column, duplicates numbered like pandas does
+    names, seen = [], {}
+    for token in tokens:
+        name = token.lower()
+        names.append(f'{name}.{seen[name]}' if name in seen else name)
+        seen[name] = seen.get(name, 0) + 1
+    return names, 1
+
+
+def _read_text(file):
+    with open(file, 'r', encoding='utf-8-sig') as f:
+        return f.read()
 
-            if "time" in target_col:
-                df[['voltage', 'current', 'time']] = split_values.iloc[:, :3]  # Extract first 3 columns
-            else:
-                df[['voltage', 'current']] = split_values.iloc[:, :2]  # Extract first 2 columns
 
-            df.drop(columns=[target_col], inplace=True)  # Drop the original combined column
+def parse_sweep_text(text):
+    """
+    Parses the text of a sweep file into float64 arrays, one per column, with rows missing voltage or current dropped.
+    The header is read once to pick the column names, the body is parsed with np.loadtxt; text it cannot parse
+    (text in the body, ragged rows) falls back to pandas with values coerced to NaN.
+    :return: dict of column name -> float64 array
+    """
+    lines = text.split('\n')
+    if not lines[0].strip():
+        raise ValueError("No columns to parse from file")
+    names, header_rows = sweep_file_header(lines[0])
 
-        # Ensure numeric dtypes for downstream computations
-        for col in ['voltage', 'current', 'time']:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')  # header only files warn about empty input
+            data = np.loadtxt(lines, dtype=np.float64, skiprows=header_rows, usecols=range(len(names)), ndmin=2)
+    except ValueError:
+        df = pd.read_csv(io.StringIO(text), sep=r'\s+', header=None, skiprows=header_rows)
+        data = np.full((len(df), len(names)), np.nan)
+        for i in range(min(len(names), df.shape[1])):
+            data[:, i] = pd.to_numeric(df.iloc[:, i], errors='coerce')
 
-        # Drop rows where voltage or current are NaN after conversion
-        if 'voltage' in df.columns and 'current' in df.columns:
-            df = df.dropna(subset=['voltage', 'current'])
+    # one contiguous array per column
+    columns = dict(zip(names, np.ascontiguousarray(data.T)))
 
-        return df
+    # Drop rows where voltage or current are NaN after conversion
+    if 'voltage' in columns and 'current' in columns:
+        valid = ~(np.isnan(columns['voltage']) | np.isnan(columns['current']))
+        if not valid.all():
+            columns = {name: values[valid] for name, values in columns.items()}
+    return columns
 
+
+def read_sweep_file(file):
+    """
+    Reads a sweep file into float64 arrays, see parse_sweep_text
+    :return: dict of column name -> float64 array, None if the file cannot be read
+    """
+    try:
+        return parse_sweep_text(_read_text(file))
+    except Exception as e:
+        print(f"Error reading file {file}: {e}")
+        return None
+
+
+def read_sweep(file):
+    """
+    Opens a sweep file once: the sweep type is sniffed from the first lines and the body parsed from the same text.
+    :return: sweep type, columns (as read_sweep_file, None when skipped) and the skip reason (None if not skipped)
+    """
+    try:
+        text = _read_text(file)
     except Exception as e:
         print(f"Error reading file {file}: {e}")
+        return None, None, 'could not be read'
+
+    sweep_type, skip_reason = sniff_sweep_type(text.split('\n', 5)[:5])
+    if sweep_type is None:
+        return None, None, skip_reason
+
+    try:
+        columns = parse_sweep_text(text)
+    except Exception as e:
+        print(f"Error reading file {file}: {e}")
+        return sweep_type, None, 'could not be read'
+    return sweep_type, columns, None
+
+
+def read_file_to_dataframe(file):
+    """ read_sweep_file as a DataFrame """
+    columns = read_sweep_file(file)
+    if columns is None:
         return None
+    return pd.DataFrame(columns)
 
 def add_metadata(df, material, sample, section, device, filename):
-    df['Material'] = material
-    df['Sample'] = sample
-    df['Section'] = section
-    df['Device'] = device
-    df['Filename'] = filename
+    """ Records the file metadata in df.attrs (METADATA_COLUMNS), once rather than as a string column per row """
+    df.attrs.update(zip(METADATA_COLUMNS, (material, sample, section, device, filename)))
 
 
 # Analyze the file based on sweep type
@@ -224,29 +309,873 @@ def analyze_file(sweep_type, analysis_params):
         return None, None
 
 
+def process_raw_file(file, file_info, base_dir, classification, plot_graph=False, compact=False):
+    """
+    Reads and analyses one raw sweep file, the per file work of process_files_raw. Runs in worker processes in
+    parallel mode, so it only takes plain arguments and returns compact numeric results.
+    :param file_info: (nanoparticles, material, sample, section, device, filename) as from iter_sweep_files
+    :param classification: device classification added to the raw data
+    :param compact: keep only the COMPACT_COLUMNS of the raw data
+    :return: skip reason (None if analysed), file stats and raw data as structured arrays (None when skipped)
+    """
+    _, material, sample, section, device, filename = file_info
+
+    # One read of the file gives the sweep type ('Iv_sweep' ...) and the data, or why it is a dud
+    sweep_type, columns, skip_reason = read_sweep(file)
+    df = pd.DataFrame(columns) if columns is not None else None
+
+    #  Check for nan values and if so skip
+    if skip_reason is None and check_for_nan(df):
+        skip_reason = 'NaN values'
+    if skip_reason is not None:
+        return skip_reason, None, None
+
+    # adds all the file metadata too df
+    add_metadata(df, material, sample, section, device, filename)
+
+    # Generate the analysis parameters for this script
+    analysis_params = generate_analysis_params(df, filename, base_dir, device)
+    analysis_params['plot_graph'] = plot_graph
+
+    # Analyze the file based on its sweep type returning two dataframes
+    df_file_stats, df_raw_data = analyze_file(sweep_type, analysis_params)
+    if df_raw_data is None or df_file_stats is None:
+        print("metrics_df is None, cannot assign classification.")
+        print("check file,", file)
+        return f'No analysis results ({sweep_type})', None, None
+
+    df_raw_data['classification'] = classification
+    if compact:
+        df_raw_data = compact_raw_data(df_raw_data, df)
+    return None, dataframe_to_structured_array(df_file_stats), dataframe_to_structured_array(df_raw_data)
+
+
+# Dataset holding the source file of every dataset key, used for incremental runs.
+# Sources that were skipped (unreadable, wrong sweep type ...) are recorded at the keys they would have had with the
+# reason, so they are not read again until they change; skip_reason is empty for keys that hold data
+MANIFEST_KEY = '/_manifest'
+MANIFEST_DTYPE = np.dtype([
+    ('key', h5py.string_dtype(encoding='utf-8')),
+    ('source', h5py.string_dtype(encoding='utf-8')),
+    ('size', np.int64),
+    ('mtime', np.float64),
+    ('hash', h5py.string_dtype(encoding='utf-8')),
+    ('skip_reason', h5py.string_dtype(encoding='utf-8')),
+])
+
+
+def manifest_source_unchanged(manifest, key, source, with_hash=False):
+    """
+    Compares source with the manifest entry of key.
+    Size and mtime are compared first; when they differ only by mtime and with_hash is set, the contents are
+    hashed and a match refreshes the stored mtime (of every key from that source) instead of counting as a change.
+    :return: whether the source is unchanged, and the keys whose entry was refreshed
+    """
+    entry = manifest.get(key)
+    if entry is None or entry[0] != str(source):
+        return False, []
+
+    _, size, mtime, digest, _ = entry
+    stat = os.stat(source)
+    if stat.st_size != size:
+        return False, []
+    if stat.st_mtime == mtime:
+        return True, []
+    if not with_hash or not digest or file_hash(source) != digest:
+        return False, []
+
+    # same contents, only touched (e.g. by a sync client)
+    refreshed = [other_key for other_key, other in manifest.items() if other[0] == entry[0]]
+    for other_key in refreshed:
+        manifest[other_key] = (entry[0], size, stat.st_mtime, digest, manifest[other_key][4])
+    return True, refreshed
+
+
+class SampleTables:
+    """The tables of one sample group in a consolidated store.
+
+    Each table ('raw_data', 'file_stats') is a subgroup with one extendable, chunked dataset per column, all the
+    same length. Files are appended as row ranges and the index maps (section, device, filename) to them together
+    with the column list the file had, so its structured array can be rebuilt as saved. A file saved again with the
+    same number of rows is overwritten in place. Rows left behind by files saved again with another length, or
+    removed, are only dropped from the index until compact moves the remaining rows up over them.
+    """
+
+    def __init__(self, group, compression=DEFAULT_COMPRESSION):
+        self.group = group
+        self.compression = compression
+        self.index = load_sample_index(group)
+        self.schemas = load_sample_schemas(group)
+        self._changed = False
+
+    def rows(self, table):
+        if table not in self.group:
+            return 0
+        for column in self.group[table].values():
+            return column.shape[0]
+        return 0
+
+    def contains(self, file_key, table):
+        entry = self.index.get(file_key)
+        return entry is not None and entry[0 if table == 'raw_data' else 2] >= 0
+
+    def file_rows(self, file_key, table):
+        """(start, stop) rows of file_key in table, None when it has none"""
+        entry = self.index.get(file_key)
+        if entry is None:
+            return None
+        start, stop = (entry[0], entry[1]) if table == 'raw_data' else (entry[2], entry[2] + 1)
+        return (start, stop) if start >= 0 else None
+
+    def append(self, table, entries):
+        """
+        Write the structured arrays of [(file key, data), ...] to table. Files that already have as many rows are
+        overwritten in place, the others are appended at the end with one resize per column.
+        """
+        columns = self.group.require_group(table)
+        rows = self.rows(table)
+        stop = rows
+        starts = []
+        for file_key, data in entries:
+            old = self.file_rows(file_key, table)
+            if old is not None and old[1] - old[0] == len(data):
+                starts.append(old[0])
+            else:
+                starts.append(stop)
+                stop += len(data)
+
+        # entries landing on consecutive rows are written together, with one call per column and run
+        runs = []  # [start, stop, [data, ...]]
+        for start, (_, data) in sorted(zip(starts, entries), key=lambda placed: placed[0]):
+            if runs and runs[-1][1] == start:
+                runs[-1][1] += len(data)
+                runs[-1][2].append(data)
+            else:
+                runs.append([start, start + len(data), [data]])
+
+        names = {}
+        for _, data in entries:
+            for name in data.dtype.names:
+                names[name] = widen_dtype(names.get(name), data.dtype[name])
+        names.update((name, None) for name in list(columns) if name not in names)
+
+        # each column is filled in memory and written with one call per run, partial writes would recompress chunks
+        for name, dtype in names.items():
+            column = columns[name] if dtype is None else self._column(table, name, dtype, rows, stop - rows)
+            if stop > rows:
+                column.resize((stop,))
+            for run_start, run_stop, run in runs:
+                if dtype is None and run_start >= rows:
+                    continue  # appended rows of a column the entries lack already hold its fill value
+                block = np.full(run_stop - run_start, column_fill(column.dtype), dtype=column.dtype)
+                row = 0
+                for data in run:
+                    if name in data.dtype.names:
+                        block[row:row + len(data)] = data[name]
+                    row += len(data)
+                column[run_start:run_stop] = block
+
+        for start, (file_key, data) in zip(starts, entries):
+            entry = self.index.setdefault(file_key, [-1, -1, -1, -1, -1])
+            schema = self._schema_id(table, data.dtype)
+            if table == 'raw_data':
+                entry[0], entry[1], entry[3] = start, start + len(data), schema
+            else:
+                entry[2], entry[4] = start, schema
+        self._changed = True
+
+    def compact(self):
+        """
+        Drop the rows no file in the index points at, moving the rows after them up. Each column is read and written
+        back once, so it is done when the store is closed and only for tables that have such rows.
+        """
+        for table in HDF5_TABLES:
+            if table not in self.group:
+                continue
+            files = []  # ((start, stop), file key) of every file with rows in table, in row order
+            for file_key in self.index:
+                rows = self.file_rows(file_key, table)
+                if rows is not None:
+                    files.append((rows, file_key))
+            files.sort()
+            live = sum(stop - start for (start, stop), _ in files)
+            if live == self.rows(table):
+                continue
+            keep = np.concatenate([np.arange(start, stop) for (start, stop), _ in files] or [np.empty(0, np.int64)])
+            for column in self.group[table].values():
+                values = column[()][keep]
+                column.resize((live,))
+                column[:] = values
+
+            row = 0
+            for (start, stop), file_key in files:
+                entry = self.index[file_key]
+                if table == 'raw_data':
+                    entry[0], entry[1] = row, row + stop - start
+                else:
+                    entry[2] = row
+                row += stop - start
+            self._changed = True
+
+    def remove(self, file_key, table):
+        entry = self.index.get(file_key)
+        if entry is None:
+            return
+        if table == 'raw_data':
+            entry[0], entry[1], entry[3] = -1, -1, -1
+        else:
+            entry[2], entry[4] = -1, -1
+        if entry[0] < 0 and entry[2] < 0:
+            del self.index[file_key]
+        self._changed = True
+
+    def save(self):
+        """Write the index and schemas back to the group."""
+        if not self._changed:
+            return
+        index = np.array([file_key + tuple(entry) for file_key, entry in self.index.items()], dtype=INDEX_DTYPE)
+        if SAMPLE_INDEX in self.group:
+            del self.group[SAMPLE_INDEX]
+        self.group.create_dataset(SAMPLE_INDEX, data=index, dtype=INDEX_DTYPE)
+        self.group.attrs[SAMPLE_SCHEMAS_ATTR] = json.dumps(self.schemas)
+        self._changed = False
+
+    def _column(self, table, name, dtype, rows, new_rows):
+        """
+        Dataset of column name in table that can hold dtype values, created with rows fill values if it is new.
+        Chunks of a new column are sized from the rows it already has plus the new_rows about to be appended.
+        """
+        columns = self.group[table]
+        values = None
+        if name in columns:
+            column = columns[name]
+            dtype = widen_dtype(column.dtype, dtype)
+            if dtype == column.dtype:
+                return column
+            # an integer column meeting floats is rewritten with the wider type
+            values = column[:rows].astype(dtype)
+            del columns[name]
+
+        options = dataset_options(self.compression, rows + new_rows, dtype.itemsize, extendable=True)
+        if dtype.kind != 'O':
+            options['fillvalue'] = column_fill(dtype)
+        column = columns.create_dataset(name, shape=(rows,), maxshape=(None,), dtype=dtype, **options)
+        if values is not None:
+            column[:] = values
+        return column
+
+    def _schema_id(self, table, dtype):
+        schema = [[name, dtype_code(dtype[name])] for name in dtype.names]
+        schemas = self.schemas[table]
+        if schema not in schemas:
+            schemas.append(schema)
+        return schemas.index(schema)
+
+
+class HDF5Writer:
+    """Single writer for an HDF5 store that stays open for a whole processing run.
+
+    Datasets are buffered in memory and written in batches every `flush_interval`
+    datasets, followed by one HDF5 flush. Use it as a context manager so pending
+    datasets are written and the file is closed cleanly on errors or Ctrl-C.
+    Existing datasets at the same key are overwritten.
+
+    Membership checks on `_file_stats` keys use an in-memory index of the store,
+    built with a single traversal the first time it is needed.
+
+    The manifest (`MANIFEST_KEY`) records the source path, size, mtime and optional
+    sha1 of every dataset key so unchanged source files can be skipped. It is read on
+    open and written back on close. The catalog (`CATALOG_KEY`) is kept the same way:
+    one row per raw data key with its metadata, sweep number, row count and first
+    classification, for HDF5Reader.find. Stores saved without one are scanned once.
+    The summary table (`SUMMARY_KEY`) adds to each catalog row the low bias resistance
+    at each of `summary_voltages` and the file_stats columns, so analyses of the whole
+    store read one table (HDF5Reader.summary).
+
+    With `append_tables` the catalog and summary are neither loaded nor scanned on
+    open, the rows of the keys written are appended to them on close instead (the
+    readers keep the last row of a key). Stores without the tables are left without
+    them until a writer without `append_tables` builds them, see save_to_hdf5.
+
+    The file metadata is saved once per group as attributes (METADATA_COLUMNS): on the
+    device group in the per file layout, on the sample group in the consolidated one.
+
+    `compression` names one of helpers.COMPRESSION_PROFILES, chunk sizes follow the
+    row count of each dataset and datasets of a few rows are left uncompressed.
+
+    `format_version` picks the layout of a new store (PER_FILE_FORMAT when None), an
+    existing store keeps the one in its FORMAT_VERSION_ATTR attribute. In the
+    CONSOLIDATED_FORMAT layout the same keys are appended to the tables of their
+    sample group (see SampleTables) instead of becoming datasets of their own.
+    """
+
+    def __init__(self, store_path, flush_interval=200, format_version=None, compression=DEFAULT_COMPRESSION,
+                 summary_voltages=DEFAULT_SUMMARY_VOLTAGES, append_tables=False):
+        self.store_path = store_path
+        self.flush_interval = flush_interval
+        self.format_version = format_version
+        self.compression = compression
+        self.summary_voltages = tuple(summary_voltages)
+        self.append_tables = append_tables
+        dataset_options(compression, 0, 1)  # unknown profiles fail here rather than at the first flush
+        self._file = None
+        self._pending = {}  # key -> structured array waiting to be written
+        self._file_stats_keys = None  # existing '..._file_stats' keys, built on first use
+        self._samples = {}  # sample group path -> SampleTables, consolidated layout only
+        self._manifest = {}  # key -> (source, size, mtime, hash)
+        self._manifest_changed = False
+        self._catalog = {}  # raw data key -> catalog_entry
+        self._catalog_changed = False
+        self._summary = {}  # raw data key -> (low bias resistances, file_stats array or None)
+        self._summary_changed = False
+        self._new_store = False
+
+    def open(self):
+        if self._file is None:
+            self._file = h5py.File(self.store_path, 'a')
+            try:
+                self._new_store = not len(self._file)
+                self._set_format()
+                self._load_manifest()
+                if self.append_tables:
+                    # only the keys written this session, a new store has no others
+                    self._catalog, self._summary = {}, {}
+                else:
+                    self._load_catalog()
+                    self._load_summary()
+            except Exception:
+                self._file.close()
+                self._file = None
+                raise
+        return self
+
+    @property
+    def consolidated(self):
+        return self.format_version == CONSOLIDATED_FORMAT
+
+    def _set_format(self):
+        """Use the layout recorded in the file, a new file gets the requested one."""
+        if FORMAT_VERSION_ATTR in self._file.attrs or len(self._file):
+            stored = store_format(self._file)
+            if self.format_version not in (None, stored):
+                raise ValueError(f"{self.store_path} uses HDF5 format {stored}, not {self.format_version}. "
+                                 f"Write to a new file to change the layout")
+            self.format_version = stored
+        elif self.format_version is None:
+            self.format_version = PER_FILE_FORMAT
+        self._file.attrs[FORMAT_VERSION_ATTR] = self.format_version
+
+    def close(self):
+        """Write anything still buffered, save the manifest and close the file."""
+        if self._file is None:
+            return
+        try:
+            self.flush()
+            for tables in self._samples.values():
+                tables.compact()
+                tables.save()
+            self._save_manifest()
+            if self.append_tables and not self._new_store:
+                self._append_tables()
+            self._save_catalog()
+            self._save_summary()
+        finally:
+            self._file.close()
+            self._file = None
+            self._samples = {}
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __contains__(self, key):
+        if key in self._pending:
+            return True
+        if key.endswith('_file_stats'):
+            return '/' + key.lstrip('/') in self.file_stats_keys
+        if self.consolidated:
+            sample_path, file_key, table = split_hdf5_key(key)
+            return sample_path in self._file and self._sample_tables(sample_path).contains(file_key, table)
+        return key in self._file
+
+    @property
+    def file_stats_keys(self):
+        """Set of every `_file_stats` key in the store, loaded with one visit over the file (or its sample indexes)."""
+        if self._file_stats_keys is None:
+            keys = set()
+            if self.consolidated:
+                for material, sample, group in sample_groups(self._file):
+                    for file_key, entry in load_sample_index(group).items():
+                        if entry[2] >= 0:
+                            keys.add(generate_hdf5_keys(material, sample, *file_key)[0])
+            else:
+                def collect(name):
+                    if name.endswith('_file_stats'):
+                        keys.add('/' + name)
+
+                self._file.visit(collect)
+            self._file_stats_keys = keys
+        return self._file_stats_keys
+
+    def _sample_tables(self, sample_path):
+        if sample_path not in self._samples:
+            group = self._file.require_group(sample_path)
+            if 'Sample' not in group.attrs:
+                group.attrs.update(zip(METADATA_COLUMNS, sample_path.strip('/').split('/')))
+            self._samples[sample_path] = SampleTables(group, self.compression)
+        return self._samples[sample_path]
+
+    def write(self, key, data):
+        """Queue a structured array to be written at key."""
+        self._pending[key] = data
+        if key.endswith('_raw_data'):
+            first = data['classification'][0] if 'classification' in (data.dtype.names or ()) and len(data) \
+                else UNKNOWN_CLASSIFICATION
+            self._catalog[key] = catalog_entry(key, len(data), first)
+            self._catalog_changed = True
+            stats = self._summary.get(key, ({}, None))[1]
+            self._summary[key] = (low_bias_resistances(data, self.summary_voltages), stats)
+            self._summary_changed = True
+        elif key.endswith('_file_stats'):
+            key_raw_data = key[:-len('_file_stats')] + '_raw_data'
+            self._summary[key_raw_data] = (self._summary.get(key_raw_data, ({}, None))[0], data)
+            self._summary_changed = True
+        if len(self._pending) >= self.flush_interval:
+            self.flush()
+
+    def save(self, key_file_stats, key_raw_data, df_file_stats, df_raw_data):
+        """Queue the metrics and raw dataframes of one file."""
+        if df_raw_data is None or df_file_stats is None:
+            return
+
+        structured_raw_data = dataframe_to_structured_array(df_raw_data)
+        structured_file_stats = dataframe_to_structured_array(df_file_stats)
+        self.save_structured(key_file_stats, key_raw_data, structured_file_stats, structured_raw_data)
+
+    def save_structured(self, key_file_stats, key_raw_data, structured_file_stats, structured_raw_data):
+        """Queue the metrics and raw data of one file, already converted with dataframe_to_structured_array."""
+        if structured_raw_data is None or structured_file_stats is None:
+            return
+
+        self.write(key_raw_data, structured_raw_data)
+        self.write(key_file_stats, structured_file_stats)
+
+    def remove(self, key):
+        """Delete the dataset at key, whether buffered or already written, and its manifest, catalog and summary entries."""
+        if self.append_tables and not self._new_store:
+            self._load_tables_under_session()
+        self._pending.pop(key, None)
+        if self.consolidated:
+            sample_path, file_key, table = split_hdf5_key(key)
+            if sample_path in self._file:
+                self._sample_tables(sample_path).remove(file_key, table)
+        elif key in self._file:
+            del self._file[key]
+        if self._file_stats_keys is not None:
+            self._file_stats_keys.discard('/' + key.lstrip('/'))
+        if self._manifest.pop(key, None) is not None:
+            self._manifest_changed = True
+        if self._catalog.pop(key, None) is not None:
+            self._catalog_changed = True
+        if self._summary.pop(key, None) is not None:
+            self._summary_changed = True
+        key_raw_data = key[:-len('_file_stats')] + '_raw_data' if key.endswith('_file_stats') else None
+        if key_raw_data in self._summary:
+            self._summary[key_raw_data] = (self._summary[key_raw_data][0], None)
+            self._summary_changed = True
+
+    def record_source(self, keys, source, with_hash=False, skip_reason=''):
+        """
+        Record the current size, mtime (and sha1 when with_hash) of source for each dataset key.
+        Give the skip_reason of a source that was not saved, its keys are then recorded without holding data.
+        """
+        size, mtime, digest = source_signature(source, with_hash)
+        for key in keys:
+            self._manifest[key] = (str(source), size, mtime, digest, skip_reason)
+        self._manifest_changed = True
+
+    def source_unchanged(self, key, source, with_hash=False):
+        """
+        True when source matches the manifest entry of key and key is stored, or the source was skipped,
+        see manifest_source_unchanged.
+        """
+        entry = self._manifest.get(key)
+        if entry is None or not (entry[4] or key in self):
+            return False
+        unchanged, refreshed = manifest_source_unchanged(self._manifest, key, source, with_hash)
+        if refreshed:
+            self._manifest_changed = True
+        return unchanged
+
+    def prune_sources(self, sources):
+        """Delete every dataset whose recorded source is not in sources. Returns the removed dataset keys."""
+        sources = {str(source) for source in sources}
+        removed = [key for key, entry in self._manifest.items() if entry[0] not in sources]
+        stored = [key for key in removed if not self._manifest[key][4]]
+        for key in removed:
+            self.remove(key)
+        return stored
+
+    def _load_manifest(self):
+        self._manifest = {}
+        self._manifest_changed = False
+        if MANIFEST_KEY not in self._file:
+            return
+        for row in self._file[MANIFEST_KEY][()]:
+            values = [value.decode('utf-8') if isinstance(value, bytes) else value for value in row]
+            # manifests from before skip_reason only list saved keys
+            key, source, size, mtime, digest, skip_reason = values if len(values) == 6 else values + ['']
+            self._manifest[key] = (source, int(size), float(mtime), digest, skip_reason)
+
+    def _save_manifest(self):
+        if not self._manifest_changed:
+            return
+        manifest = np.array([(key,) + entry for key, entry in self._manifest.items()], dtype=MANIFEST_DTYPE)
+        if MANIFEST_KEY in self._file:
+            del self._file[MANIFEST_KEY]
+        # gzip needs chunking, which an empty dataset cannot have
+        compression = "gzip" if manifest.size else None
+        self._file.create_dataset(MANIFEST_KEY, data=manifest, compression=compression, dtype=MANIFEST_DTYPE)
+        self._file.flush()
+        self._manifest_changed = False
+
+    def _load_catalog(self):
+        self._catalog = load_catalog(self._file)
+        self._catalog_changed = self._catalog is None
+        if self._catalog is None:
+            self._catalog = scan_catalog(self._file)
+
+    def _save_catalog(self):
+        if not self._catalog_changed:
+            return
+        catalog = np.array([(key,) + entry for key, entry in sorted(self._catalog.items())], dtype=CATALOG_DTYPE)
+        if CATALOG_KEY in self._file:
+            del self._file[CATALOG_KEY]
+        # chunked and resizable so append_tables can add rows
+        self._file.create_dataset(CATALOG_KEY, data=catalog, compression="gzip", dtype=CATALOG_DTYPE,
+                                  chunks=True, maxshape=(None,))
+        self._file.flush()
+        self._catalog_changed = False
+
+    def _load_summary(self):
+        self._summary = load_summary(self._file)
+        self._summary_changed = self._summary is None
+        if self._summary is None:
+            self._summary = scan_summary(self._file, self.summary_voltages)
+
+    def _save_summary(self):
+        if not self._summary_changed:
+            return
+        summary, stats_columns = summary_array(self._catalog, self._summary)
+        if SUMMARY_KEY in self._file:
+            del self._file[SUMMARY_KEY]
+        dataset = self._file.create_dataset(SUMMARY_KEY, data=summary, compression="gzip", dtype=summary.dtype,
+                                            chunks=True, maxshape=(None,))
+        dataset.attrs[SUMMARY_STATS_ATTR] = json.dumps(stats_columns)
+        self._file.flush()
+        self._summary_changed = False
+
+    def _load_tables_under_session(self):
+        """
+        Leave append_tables mode: load the stored catalog and summary (scanning a store without them) and put the
+        entries written this session over them, so they are saved whole on close.
+        """
+        catalog, summary = self._catalog, self._summary
+        self._load_catalog()
+        self._load_summary()
+        self._catalog.update(catalog)
+        for key, (resistances, stats) in summary.items():
+            stored_resistances, stored_stats = self._summary.get(key, ({}, None))
+            self._summary[key] = (resistances or stored_resistances, stored_stats if stats is None else stats)
+        self._catalog_changed = self._catalog_changed or bool(catalog)
+        self._summary_changed = self._summary_changed or bool(summary)
+        self.append_tables = False
+
+    def _append_tables(self):
+        """
+        Append the catalog and summary rows of the keys written this session. Tables missing from the store stay
+        missing, when a row cannot be appended (a key without both its raw data and file_stats, a table of an older
+        layout or without room for the new columns) both tables are rewritten whole instead.
+        """
+        if not (self._catalog_changed or self._summary_changed):
+            return
+        if self._catalog.keys() == self._summary.keys() and all(stats is not None for _, stats in self._summary.values()):
+            catalog = np.array([(key,) + entry for key, entry in sorted(self._catalog.items())], dtype=CATALOG_DTYPE)
+            summary, stats_columns = summary_array(self._catalog, self._summary)
+            if self._append_rows(CATALOG_KEY, catalog, ()) and self._append_rows(SUMMARY_KEY, summary, stats_columns):
+                self._file.flush()
+                self._catalog_changed = self._summary_changed = False
+                return
+        self._load_tables_under_session()
+
+    def _append_rows(self, key, rows, stats_columns):
+        """Append rows to the table at key, converted to its dtype. False when the table cannot hold them."""
+        if key not in self._file:
+            return True
+        dataset = self._file[key]
+        stored_stats = json.loads(dataset.attrs.get(SUMMARY_STATS_ATTR, '[]'))
+        dtype = dataset.dtype
+        if dataset.maxshape[0] is not None or any(
+                name not in dtype.names or widen_dtype(dtype[name], rows.dtype[name]) != dtype[name]
+                or (name in stats_columns) != (name in stored_stats) for name in rows.dtype.names):
+            return False
+        data = np.empty(len(rows), dtype=dtype)
+        for name in dtype.names:
+            data[name] = rows[name] if name in rows.dtype.names else column_fill(dtype[name])
+        start = len(dataset)
+        dataset.resize((start + len(data),))
+        dataset[start:] = data
+        return True
+
+    def flush(self):
+        """Write all buffered datasets and flush the file to disk."""
+        if self.consolidated:
+            self._flush_consolidated()
+        else:
+            for key, data in self._pending.items():
+                if key in self._file:
+                    del self._file[key]
+                group_path = key.rsplit('/', 1)[0]
+                new_group = group_path not in self._file
+                self._file.create_dataset(key, data=data, dtype=data.dtype,
+                                          **dataset_options(self.compression, len(data), data.dtype.itemsize))
+                if new_group:
+                    metadata = hdf5_key_metadata(key)
+                    del metadata['Filename']
+                    self._file[group_path].attrs.update(metadata)
+        if self._file_stats_keys is not None:
+            self._file_stats_keys.update('/' + key.lstrip('/') for key in self._pending if key.endswith('_file_stats'))
+        self._pending.clear()
+        for tables in self._samples.values():
+            tables.save()
+        self._file.flush()
+
+    def _flush_consolidated(self):
+        """Append the buffered arrays to their sample tables, one append per sample and table."""
+        batches = {}  # (sample group path, table) -> [(file key, data), ...]
+        for key, data in self._pending.items():
+            sample_path, file_key, table = split_hdf5_key(key)
+            batches.setdefault((sample_path, table), []).append((file_key, data))
+        for (sample_path, table), entries in batches.items():
+            self._sample_tables(sample_path).append(table, entries)
+
+
+def hdf5_writer_process(store_path, flush_interval, format_version, compression, summary_voltages, messages):
+    """
+    Target of HDF5WriterProcess: applies (sequence number, [(method name, args), ...]) messages to an HDF5Writer in
+    sequence order until None arrives. Messages that arrive ahead of their turn wait in a buffer.
+    """
+    with HDF5Writer(store_path, flush_interval=flush_interval, format_version=format_version,
+                    compression=compression, summary_voltages=summary_voltages) as writer:
+        waiting = {}
+        next_sequence = 0
+        for sequence, calls in iter(messages.get, None):
+            waiting[sequence] = calls
+            while next_sequence in waiting:
+                for method, args in waiting.pop(next_sequence):
+                    getattr(writer, method)(*args)
+                next_sequence += 1
+        # a run stopped by an error can leave gaps, what did arrive is still written in order
+        for sequence in sorted(waiting):
+            for method, args in waiting[sequence]:
+                getattr(writer, method)(*args)
+
+
+def put_message(messages, stopped, message):
+    """Put a message on the bounded writer queue, waiting for room until the stopped event is set."""
+    while True:
+        try:
+            messages.put(message, timeout=1)
+            return
+        except queue.Full:
+            if stopped.is_set():
+                raise RuntimeError("HDF5 writer process stopped")
+
+
+_worker_writer = None  # (queue, stopped event) of the HDF5WriterProcess a pool worker sends its results to
+
+
+def connect_writer_worker(messages, stopped):
+    """Initializer of the pool workers of an HDF5WriterProcess, called with HDF5WriterProcess.worker_args()."""
+    global _worker_writer
+    _worker_writer = messages, stopped
+
+
+def process_raw_file_to_writer(sequence, keys, with_hash, file, file_info, base_dir, classification, plot_graph=False,
+                               compact=False):
+    """
+    process_raw_file in a pool worker connected with connect_writer_worker. The results are saved and the source
+    recorded (with the skip reason of a skipped file) by a message sent straight to the writer process, at the
+    sequence number taken for the file with HDF5WriterProcess.next_sequence. Only the skip reason is returned.
+    """
+    skip_reason, file_stats, raw_data = process_raw_file(file, file_info, base_dir, classification, plot_graph, compact)
+    calls = [('record_source', (tuple(keys), file, with_hash, skip_reason or ''))]
+    if skip_reason is None:
+        calls.insert(0, ('save_structured', (*keys, file_stats, raw_data)))
+    put_message(*_worker_writer, (sequence, calls))
+    return skip_reason
+
+
+class HDF5WriterProcess:
+    """HDF5Writer running in a process of its own, for runs where the analysis happens in worker processes.
+
+    save_structured, record_source and prune_sources are sent through a bounded queue, each under the next
+    sequence number, and applied in sequence order, so the store ends up exactly as an HDF5Writer would leave it.
+    Pool workers started with `initializer=connect_writer_worker, initargs=writer.worker_args()` put their results
+    on the same queue (process_raw_file_to_writer) under a number taken in file order with next_sequence, so
+    the arrays go from the worker to the writer process without passing through this one. `in` checks on
+    `_file_stats` keys and source_unchanged are answered from a copy of the keys and manifest taken before the
+    writer process opens the file. Closing waits for the queue to drain and raises if the writer process failed.
+    """
+
+    def __init__(self, store_path, flush_interval=200, queue_size=64, format_version=None,
+                 compression=DEFAULT_COMPRESSION, summary_voltages=DEFAULT_SUMMARY_VOLTAGES):
+        self.store_path = store_path
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.format_version = format_version
+        self.compression = compression
+        self.summary_voltages = tuple(summary_voltages)
+        dataset_options(compression, 0, 1)
+        self.file_stats_keys = set()
+        self._manifest = {}
+        self._messages = None
+        self._stopped = None  # set once the writer process is found dead, so pool workers stop waiting on the queue
+        self._process = None
+        self._sequence = 0
+
+    def open(self):
+        if self._process is not None:
+            return self
+
+        # copy what the skip checks need, the file has to be closed again before the writer process opens it
+        with HDF5Writer(self.store_path, format_version=self.format_version,
+                        summary_voltages=self.summary_voltages) as writer:
+            self.file_stats_keys = set(writer.file_stats_keys)
+            self._manifest = dict(writer._manifest)
+            self.format_version = writer.format_version
+
+        self._messages = multiprocessing.Queue(maxsize=self.queue_size)
+        self._stopped = multiprocessing.Event()
+        self._sequence = 0
+        self._process = multiprocessing.Process(target=hdf5_writer_process, name='hdf5-writer',
+                                                args=(self.store_path, self.flush_interval, self.format_version,
+                                                      self.compression, self.summary_voltages, self._messages))
+        self._process.start()
+        return self
+
+    def close(self):
+        """Let the writer process write everything queued, close the store and exit."""
+        if self._process is None:
+            return
+        try:
+            if self._process.is_alive():
+                self._send(None)
+            self._process.join()
+        finally:
+            exitcode = self._process.exitcode
+            self._process = None
+            self._messages.close()
+        if exitcode != 0:
+            raise RuntimeError(f"HDF5 writer process failed with exit code {exitcode}")
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.close()
+        except RuntimeError:
+            # don't hide the error that stopped the run
+            if exc_type is None:
+                raise
+        return False
+
+    def __contains__(self, key):
+        return '/' + key.lstrip('/') in self.file_stats_keys
+
+    def next_sequence(self):
+        """Sequence number of the next message, taken in file order for a file a pool worker analyses."""
+        self._sequence += 1
+        return self._sequence - 1
+
+    def worker_args(self):
+        """initargs of connect_writer_worker, for the pool workers sending their results here."""
+        return self._messages, self._stopped
+
+    def wait(self, future, key_file_stats):
+        """
+        Skip reason returned by the process_raw_file_to_writer future of key_file_stats, which counts as stored
+        when it is None. Raises if the writer process stops first, as the worker would wait on the queue forever.
+        """
+        while True:
+            try:
+                skip_reason = future.result(timeout=1)
+                break
+            except FutureTimeoutError:
+                self._check_alive()
+        if skip_reason is None:
+            self.file_stats_keys.add('/' + key_file_stats.lstrip('/'))
+        return skip_reason
+
+    def source_unchanged(self, key, source, with_hash=False):
+        """As HDF5Writer.source_unchanged, from the copy of the manifest."""
+        entry = self._manifest.get(key)
+        if entry is None or not (entry[4] or key in self):
+            return False
+        unchanged, refreshed = manifest_source_unchanged(self._manifest, key, source, with_hash)
+        if refreshed:
+            self._send(('record_source', (refreshed, source, with_hash, entry[4])))
+        return unchanged
+
+    def save_structured(self, key_file_stats, key_raw_data, structured_file_stats, structured_raw_data):
+        if structured_raw_data is None or structured_file_stats is None:
+            return
+        self.file_stats_keys.add('/' + key_file_stats.lstrip('/'))
+        self._send(('save_structured', (key_file_stats, key_raw_data, structured_file_stats, structured_raw_data)))
+
+    def record_source(self, keys, source, with_hash=False, skip_reason=''):
+        self._send(('record_source', (tuple(keys), source, with_hash, skip_reason)))
+
+    def prune_sources(self, sources):
+        """Deletes every dataset whose recorded source is not in sources. Returns the removed dataset keys."""
+        sources = {str(source) for source in sources}
+        removed = [key for key, entry in self._manifest.items() if entry[0] not in sources and not entry[4]]
+        self._send(('prune_sources', (sources,)))
+        return removed
+
+    def _send(self, message):
+        # the queue is bounded, wait for room but notice if the writer process has died
+        message = None if message is None else (self.next_sequence(), [message])
+        while True:
+            try:
+                self._messages.put(message, timeout=1)
+                return
+            except queue.Full:
+                self._check_alive()
+
+    def _check_alive(self):
+        if not self._process.is_alive():
+            self._stopped.set()
+            raise RuntimeError("HDF5 writer process stopped")
+
+
 def save_to_hdf5(store_path, key_file_stats, key_raw_data, df_file_stats, df_raw_data):
     """Save metrics and raw dataframes into HDF5 at the given keys.
 
-    If datasets already exist, they are overwritten.
+    If datasets already exist, they are overwritten. Opens and closes the file on
+    every call, keep an HDF5Writer open instead when saving many files. Only the rows
+    of this file are added to the catalog and summary tables (append_tables), a store
+    without them is not scanned and gets them from the next HDF5Writer session.
     """
     if df_raw_data is None or df_file_stats is None:
         return
 
-    structured_raw_data = dataframe_to_structured_array(df_raw_data)
-    structured_file_stats = dataframe_to_structured_array(df_file_stats)
-
-    if structured_raw_data is None or structured_file_stats is None:
-        return
-
-    with h5py.File(store_path, 'a') as f:
-        if key_raw_data in f:
-            del f[key_raw_data]
-        f.create_dataset(key_raw_data, data=structured_raw_data, compression="gzip", dtype=structured_raw_data.dtype)
-
-        if key_file_stats in f:
-            del f[key_file_stats]
-        f.create_dataset(key_file_stats, data=structured_file_stats, compression="gzip",
-                         dtype=structured_file_stats.dtype)
+    with HDF5Writer(store_path, append_tables=True) as writer:
+        writer.save(key_file_stats, key_raw_data, df_file_stats, df_raw_data)
 
 
 # Save raw data_analyzer.py and metrics to HDF5
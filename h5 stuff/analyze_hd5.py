@@ -4,7 +4,11 @@ import matplotlib.pyplot as plt
 import numpy as np
 import h5py
 import time
-import h5py
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from hdf5_reader import HDF5Reader, low_bias_column
 #l
 hdf5_file = '../memristor_data3.h5'
 #hdf5_file = '../memristor_data_backup.h5'
@@ -12,59 +16,25 @@ hdf5_file = '../memristor_data3.h5'
 # todo yield
 
 
-def analyze_hdf5_levels(hdf5_file):
+def analyze_hdf5_levels(hdf5_file, voltage_val=0.1):
 
     start = time.time()
 
-    with h5py.File(hdf5_file, "r") as store:
-
-        # Group keys by depth
-        grouped_keys = get_keys_at_depth(store, target_depth=5)
-        print(grouped_keys)
-
-        # Store the data_analyzer.py on the first sweeps of all devices
-        all_first_sweeps = []
-        all_second_sweeps = []
-        all_third_sweeps = []
-        all_four_sweeps = []
-        all_five_sweeps = []
-
-        # Extract base keys by removing suffixes and co
-        base_keys = sorted(set(k.rsplit('_', 2)[0] for k in grouped_keys))
-
-        # Analyze data_analyzer.py for each file!
-        for base_key in base_keys:
-            print(base_key)
-
-            # Retrieve both datasets at once
-            df_raw_data, df_file_stats,parts_key = return_data(base_key, store)
-            # parts_key = filename(parts[-1]) , device(parts[-2]) etc...
-
-
-            # store the first five sweeps of any device in a dataframe
-            if parts_key[-1].startswith('1-'):
-                all_first_sweeps.append((base_key,df_raw_data))
-            if parts_key[-1].startswith('2-'):
-                all_second_sweeps.append((base_key,df_raw_data))
-            if parts_key[-1].startswith('3-'):
-                all_third_sweeps.append((base_key,df_raw_data))
-            if parts_key[-1].startswith('4-'):
-                all_four_sweeps.append((base_key,df_raw_data))
-            if parts_key[-1].startswith('5-'):
-                all_five_sweeps.append((base_key,df_raw_data))
+    with HDF5Reader(hdf5_file) as store:
 
+        # One row per file with its low bias resistance, classification and file_stats, written with the store,
+        # so no sweep dataset has to be read
+        summary = store.summary(voltages=[voltage_val])
 
         middle = time.time()
 
-        print(all_first_sweeps)
         # First sweep data_analyzer.py
-        initial_resistance(all_first_sweeps)
-        store.close()
+        initial_resistance(summary[summary['sweep'] == 1], voltage_val)
 
     print("time to organise the data_analyzer.py before calling inisital first sweep ", middle - start)
 
-def initial_resistance(data,voltage_val = 0.1):
-    """ Finds the initial reseistance between 0-0.1 V for the list of values given
+def initial_resistance(summary,voltage_val = 0.1):
+    """ Finds the initial reseistance between 0-0.1 V for the files of the summary table given (HDF5Reader.summary)
         also filters for data_analyzer.py that's not within the list valid_classifications to remove unwanted data_analyzer.py
     """
 
@@ -74,10 +44,10 @@ def initial_resistance(data,voltage_val = 0.1):
     # Define valid classifications
     valid_classifications = ["Memristive", "Ohmic","Conductive","intermittent","Mem-Capacitance"]  # Add more classifications here as needed
     valid_classifications = ["Memristive"]
-    for key, value in data:
-        """value = all the data_analyzer.py (metrics_df)
+    for row in summary.to_dict('records'):
+        """row = the summary of one file
             key = folder structure"""
-        #print('value',value)
+        key = row['key'][:-len('_raw_data')].lstrip('/')
         # print(f"\nAnalyzing key: {key}")  # Debugging print for each key
         parts = key.strip('/').split('/')
         segments = parts[1].split("-")
@@ -94,9 +64,8 @@ def initial_resistance(data,voltage_val = 0.1):
               f"Bottom Electrode: {btm_e}, Polymer: {polymer}, Polymer Percent: {polymer_percent}, "
               f"Top Electrode: {top_e}")
 
-        try :
-            classification = value['classification'].iloc[0]
-        except:
+        classification = row['classification']
+        if pd.isna(classification):
             classification = 'Unknown'
             print(f"No classification found for key {key}")
 
@@ -104,9 +73,8 @@ def initial_resistance(data,voltage_val = 0.1):
         if classification in valid_classifications:
             # only work on data_analyzer.py that shows memristive or ohmic behaviour
             # Filter data_analyzer.py
-            # Calculate resistance between the values of V
-            resistance_data = value[(value['voltage'] >= 0) & (value['voltage'] <= voltage_val)]['resistance']
-            resistance = resistance_data.mean()
+            # Mean resistance between 0 and voltage_val V, computed at ingest
+            resistance = row[low_bias_column(voltage_val)]
 
             # calculate gradient of line for the data_analyzer.py to see difference
 
@@ -270,10 +238,14 @@ def get_keys_at_depth(store, target_depth=5):
 
 
 
-def return_data(base_key, store):
+def return_data(base_key, store, columns=None):
     """
-    Given the file key return the data_analyzer.py in a pd dataframe converting form numpy array
+    Given the file key return the data_analyzer.py in a pd dataframe, store is an open HDF5Reader (or h5py.File).
+    columns limits the raw data to the columns listed, only those are read from the file
     """
+    if not isinstance(store, HDF5Reader):
+        # an open h5py.File, HDF5Reader leaves it open
+        store = HDF5Reader(store).open()
     parts = base_key.strip('/').split('/')
     print(parts)
     filename = parts[-1]
@@ -283,24 +255,16 @@ def return_data(base_key, store):
     key_file_stats = base_key+"_file_stats"
     key_raw_data = base_key + "_raw_data"
 
-    data_file_stats = store[key_file_stats][()]
-    data_raw_data = store[key_raw_data][()]
-
-    #convert data_analyzer.py back to pd dataframe
-
-    column_names_raw_data = ['voltage', 'current', 'abs_current', 'resistance', 'voltage_ps', 'current_ps',
-                             'voltage_ng','current_ng', 'log_Resistance', 'abs_Current_ps', 'abs_Current_ng',
-                             'current_Density_ps', 'current_Density_ng', 'electric_field_ps', 'electric_field_ng',
-                             'inverse_resistance_ps','inverse_resistance_ng', 'sqrt_Voltage_ps', 'sqrt_Voltage_ng',
-                             'classification']
-
     column_names_file_stats = ['ps_area', 'ng_area', 'area', 'normalized_area', 'resistance_on_value',
                                'resistance_off_value', 'ON_OFF_Ratio', 'voltage_on_value', 'voltage_off_value']
 
-    # Convert numpy arrays to pd dataframes
-    df_file_stats = pd.DataFrame(data_file_stats, columns=column_names_file_stats)
-    df_raw_data_temp = pd.DataFrame(data_raw_data, columns=column_names_raw_data)
-    df_raw_data = map_numbers_to_classification(df_raw_data_temp)
+    # classifications come back as their names. Multi loop files store the *_avg columns instead of these,
+    # the ones a file does not have are NaN columns
+    stored = store.stored_columns(key_file_stats)
+    df_file_stats = store.read_frame(key_file_stats, metadata=False,
+                                     columns=[name for name in column_names_file_stats if name in stored])
+    df_file_stats = df_file_stats.reindex(columns=column_names_file_stats)
+    df_raw_data = store.read_frame(key_raw_data, metadata=False, columns=columns)
 
     #print(df_file_stats)
     #print(df_raw_data)
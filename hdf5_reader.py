@@ -0,0 +1,690 @@
+import json
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import h5py
+import numpy as np
+import pandas as pd
+from equations import DERIVED_COLUMNS, RAW_DATA_COLUMNS, low_bias_resistance
+from helpers import FORMAT_VERSION_ATTR, PER_FILE_FORMAT, CONSOLIDATED_FORMAT, HDF5_TABLES, SAMPLE_INDEX, \
+    SAMPLE_SCHEMAS_ATTR, METADATA_COLUMNS, CLASSIFICATION_DTYPE, UNKNOWN_CLASSIFICATION, DEFAULT_SUMMARY_VOLTAGES, \
+    generate_hdf5_keys, split_hdf5_key, hdf5_key_metadata, sweep_number
+
+# Reading HDF5 stores written by file_processing.HDF5Writer, in either layout (see helpers.FORMAT_VERSION_ATTR)
+
+# One row per file of a consolidated sample group. Row ranges are [start, stop), -1 when that table was not saved.
+# The schema fields index the column lists in the group's SAMPLE_SCHEMAS_ATTR attribute
+INDEX_DTYPE = np.dtype([
+    ('section', h5py.string_dtype(encoding='utf-8')),
+    ('device', h5py.string_dtype(encoding='utf-8')),
+    ('filename', h5py.string_dtype(encoding='utf-8')),
+    ('raw_start', np.int64),
+    ('raw_stop', np.int64),
+    ('stats_row', np.int64),
+    ('raw_schema', np.int16),
+    ('stats_schema', np.int16),
+])
+
+
+# One row per sweep file in the store, kept up to date by HDF5Writer so scripts can find files without walking the tree
+CATALOG_KEY = '/_catalog'
+CATALOG_DTYPE = np.dtype([
+    ('key', h5py.string_dtype(encoding='utf-8')),  # raw_data key
+    ('material', h5py.string_dtype(encoding='utf-8')),
+    ('sample', h5py.string_dtype(encoding='utf-8')),
+    ('section', h5py.string_dtype(encoding='utf-8')),
+    ('device', h5py.string_dtype(encoding='utf-8')),
+    ('filename', h5py.string_dtype(encoding='utf-8')),
+    ('sweep', np.int32),
+    ('rows', np.int64),
+    ('classification', CLASSIFICATION_DTYPE),
+])
+
+
+# One row per sweep file with the numbers most analyses start from: its catalog columns, the low bias resistance at
+# each of the writer's summary voltages and every file_stats column. Kept up to date by HDF5Writer
+SUMMARY_KEY = '/_summary'
+SUMMARY_STATS_ATTR = 'file_stats_columns'  # json list of the summary columns copied from file_stats
+LOW_BIAS_SOURCE_COLUMNS = ('voltage', 'current', 'resistance')
+
+
+def catalog_entry(key, rows, classification=UNKNOWN_CLASSIFICATION):
+    """ CATALOG_DTYPE row, without the key, of raw data saved at key, classification is its first stored value """
+    material, sample, section, device, filename = hdf5_key_metadata(key).values()
+    return material, sample, section, device, filename, sweep_number(filename), rows, \
+        _classification_code(classification)
+
+
+def _classification_code(value):
+    """ int code of a stored classification value, stores from before the enum type can hold NaN """
+    return int(value) if value == value else UNKNOWN_CLASSIFICATION
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def store_format(store):
+    """ Layout of an open store, PER_FILE_FORMAT or CONSOLIDATED_FORMAT """
+    return int(store.attrs.get(FORMAT_VERSION_ATTR, PER_FILE_FORMAT))
+
+
+def load_sample_index(group):
+    """ {(section, device, filename): [raw_start, raw_stop, stats_row, raw_schema, stats_schema]} of a sample group """
+    index = {}
+    if SAMPLE_INDEX not in group:
+        return index
+    for row in group[SAMPLE_INDEX][()]:
+        row = tuple(row)
+        index[tuple(_decode(value) for value in row[:3])] = [int(value) for value in row[3:]]
+    return index
+
+
+def dtype_code(dtype):
+    """ json-able description of a column dtype: its dtype str, or {'enum': mapping, 'base': str} for an enum """
+    enum = h5py.check_enum_dtype(dtype)
+    if enum is not None:
+        return {'enum': dict(enum), 'base': dtype.str}
+    return dtype.str
+
+
+def code_dtype(code):
+    """ dtype of a dtype_code """
+    if isinstance(code, dict):
+        return h5py.enum_dtype(code['enum'], basetype=code['base'])
+    return h5py.string_dtype(encoding='utf-8') if code == '|O' else np.dtype(code)
+
+
+def schema_dtype(schema):
+    """ Structured dtype of a saved column list, [[name, dtype_code], ...] """
+    return np.dtype([(name, code_dtype(code)) for name, code in schema])
+
+
+def decode_column(values):
+    """ Column of a stored array as it is used in a DataFrame: enums as categorical labels, fixed width bytes as str """
+    enum = h5py.check_enum_dtype(values.dtype)
+    if enum is not None:
+        # negative codes ('unknown') become NaN
+        names = {code: name for name, code in enum.items() if code >= 0}
+        categories = [names.get(code, str(code)) for code in range(max(names, default=-1) + 1)]
+        return pd.Categorical.from_codes(np.where(values < 0, -1, values), categories=categories)
+    if values.dtype.kind == 'S':
+        return np.char.decode(values, 'utf-8')
+    return values
+
+
+def column_fill(dtype):
+    """ Value of the rows a column has no data for """
+    if dtype.kind == 'O':
+        return ''
+    enum = h5py.check_enum_dtype(dtype)
+    if enum is not None:
+        return enum.get('unknown', 0)
+    return np.nan if dtype.kind == 'f' else 0
+
+
+def widen_dtype(current, dtype):
+    """ dtype a column needs to hold both current (None for a new column) and dtype values """
+    if current is None:
+        return dtype
+    if current == dtype:
+        # keeps the enum table, numpy compares enums as their base type
+        return current
+    if (current.kind in 'biuf' and dtype.kind in 'biuf') or current.kind == dtype.kind == 'S':
+        return np.promote_types(current, dtype)
+    return current
+
+
+def load_sample_schemas(group):
+    """ {table: [column list, ...]} of a sample group, the schema ids in its index point into these lists """
+    schemas = json.loads(group.attrs.get(SAMPLE_SCHEMAS_ATTR, '{}'))
+    return {table: schemas.get(table, []) for table in HDF5_TABLES}
+
+
+def load_catalog(store):
+    """ {raw_data key: catalog entry} from CATALOG_KEY, None for stores saved without one """
+    if CATALOG_KEY not in store:
+        return None
+    catalog = {}
+    for row in store[CATALOG_KEY][()]:
+        row = tuple(_decode(value) for value in row)
+        catalog[row[0]] = row[1:6] + tuple(int(value) for value in row[6:])
+    return catalog
+
+
+def scan_catalog(store):
+    """
+    {raw_data key: catalog entry} built by walking an open store, for stores saved without CATALOG_KEY.
+    Only the shape and first classification code of each raw data are read.
+    """
+    catalog = {}
+    if store_format(store) == CONSOLIDATED_FORMAT:
+        for material, sample, group in sample_groups(store):
+            column = group['raw_data/classification'] if 'raw_data/classification' in group else None
+            for file_key, (raw_start, raw_stop, *_) in load_sample_index(group).items():
+                if raw_start < 0:
+                    continue
+                key = generate_hdf5_keys(material, sample, *file_key)[1]
+                first = column[raw_start] if column is not None and raw_stop > raw_start else UNKNOWN_CLASSIFICATION
+                catalog[key] = catalog_entry(key, raw_stop - raw_start, first)
+        return catalog
+
+    def collect(name, obj):
+        if isinstance(obj, h5py.Dataset) and name.endswith('_raw_data'):
+            first = UNKNOWN_CLASSIFICATION
+            if 'classification' in (obj.dtype.names or ()) and obj.shape[0]:
+                first = obj.fields('classification')[0]
+            catalog['/' + name] = catalog_entry('/' + name, obj.shape[0], first)
+
+    store.visititems(collect)
+    return catalog
+
+
+def chunk_decoder(dataset):
+    """
+    Function turning the stored bytes of one chunk of dataset back into its rows, or None when its filters are not
+    plain gzip (optionally shuffled) or its type is not stored as it is in memory. Undoing gzip here instead of in
+    HDF5 lets threads decompress at the same time, zlib releases the GIL while h5py holds one lock for every call.
+    """
+    dtype = dataset.dtype
+    if dataset.chunks is None or dataset.compression != 'gzip' or dataset.fletcher32 or \
+            dataset.scaleoffset is not None or dtype.hasobject or not dtype.isnative or \
+            dataset.id.get_type().get_size() != dtype.itemsize:
+        return None
+    rows = dataset.chunks[0]
+
+    def decode(chunk):
+        data = np.frombuffer(zlib.decompress(chunk), dtype=np.uint8)
+        if dataset.shuffle:
+            # the shuffle filter stores byte i of every row together
+            data = data.reshape(dtype.itemsize, rows).T.copy()
+        return data.view(dtype).reshape(rows)
+    return decode
+
+
+def read_rows(dataset, start, stop, decoder=None, decoded=None, fields=None):
+    """
+    Rows [start, stop) of a 1d dataset. With its chunk_decoder the raw chunks are read and returned as a function
+    decoding them, to be called outside of h5py, otherwise the rows are read as usual (only the given fields of a
+    compound dataset). decoded is a {(dataset name, chunk offset): rows} cache shared by reads of neighbouring rows.
+    """
+    if decoder is None:
+        if fields and tuple(fields) != dataset.dtype.names:
+            return dataset.fields(list(fields))[start:stop]
+        return dataset[start:stop]
+    decoded = {} if decoded is None else decoded
+    rows = dataset.chunks[0]
+    first = start - start % rows
+    chunks = {}
+    for offset in range(first, stop, rows):
+        if (dataset.name, offset) not in decoded:
+            mask, chunks[offset] = dataset.id.read_direct_chunk((offset,))
+            if mask:
+                # a filter was skipped when this chunk was written
+                return dataset[start:stop]
+
+    def decode():
+        for offset, chunk in chunks.items():
+            decoded[(dataset.name, offset)] = decoder(chunk)
+        data = [decoded[(dataset.name, offset)] for offset in range(first, stop, rows)]
+        return np.concatenate(data)[start - first:stop - first]
+    return decode
+
+
+def low_bias_column(voltage):
+    """ Summary column of the low bias resistance up to voltage, e.g. resistance_0.1V """
+    return f'resistance_{voltage:g}V'
+
+
+def low_bias_resistances(data, voltages):
+    """ {low_bias_column: value} of a raw data array, resistance is computed from current when it was not stored """
+    names = data.dtype.names or ()
+    if 'voltage' not in names or ('resistance' not in names and 'current' not in names):
+        return {low_bias_column(voltage): np.nan for voltage in voltages}
+    sweep = SweepColumns(data)
+    return {low_bias_column(voltage): low_bias_resistance(sweep['voltage'], sweep['resistance'], voltage)
+            for voltage in voltages}
+
+
+def summary_array(catalog, summary):
+    """
+    Summary table as a structured array, one row per catalog entry, from the catalog and a
+    {raw data key: (low bias resistances, one row file_stats array or None)} dict. Also returns the file_stats columns.
+    """
+    keys = sorted(catalog)
+    entries = [summary.get(key, ({}, None)) for key in keys]
+    resistance_columns = list(dict.fromkeys(name for resistances, _ in entries for name in resistances))
+    stats_dtypes = {}
+    for _, stats in entries:
+        for name in stats.dtype.names if stats is not None else ():
+            if name not in CATALOG_DTYPE.names and name not in resistance_columns:
+                stats_dtypes[name] = widen_dtype(stats_dtypes.get(name), stats.dtype[name])
+
+    catalog_data = np.array([(key,) + catalog[key] for key in keys], dtype=CATALOG_DTYPE)
+    data = np.empty(len(keys), dtype=[(name, CATALOG_DTYPE[name]) for name in CATALOG_DTYPE.names]
+                    + [(name, np.float64) for name in resistance_columns] + list(stats_dtypes.items()))
+    for name in CATALOG_DTYPE.names:
+        data[name] = catalog_data[name]
+    for name in resistance_columns:
+        data[name] = [resistances.get(name, np.nan) for resistances, _ in entries]
+    for name, dtype in stats_dtypes.items():
+        data[name] = column_fill(dtype)
+        for row, (_, stats) in enumerate(entries):
+            if stats is not None and len(stats) and name in stats.dtype.names:
+                data[name][row] = stats[name][0]
+    return data, list(stats_dtypes)
+
+
+def load_summary(store):
+    """ {raw data key: (low bias resistances, one row file_stats array)} from SUMMARY_KEY, None for stores without one """
+    if SUMMARY_KEY not in store:
+        return None
+    dataset = store[SUMMARY_KEY]
+    data = dataset[()]
+    stats_columns = json.loads(dataset.attrs.get(SUMMARY_STATS_ATTR, '[]'))
+    resistance_columns = [name for name in data.dtype.names
+                          if name not in CATALOG_DTYPE.names and name not in stats_columns]
+    stats = np.empty(len(data), dtype=[(name, data.dtype[name]) for name in stats_columns])
+    for name in stats_columns:
+        stats[name] = data[name]
+    summary = {}
+    for row, key in enumerate(data['key']):
+        resistances = {name: float(data[name][row]) for name in resistance_columns}
+        summary[_decode(key)] = (resistances, stats[row:row + 1] if stats_columns else None)
+    return summary
+
+
+def read_low_bias_resistances(reader, key, voltages):
+    """ low_bias_resistances of the raw data at key, reading only the columns they need """
+    stored = reader.stored_columns(key)
+    return low_bias_resistances(reader.read(key, [name for name in LOW_BIAS_SOURCE_COLUMNS if name in stored]),
+                                voltages)
+
+
+def scan_summary(store, voltages=DEFAULT_SUMMARY_VOLTAGES):
+    """
+    Summary dict (see load_summary) of an open store saved without SUMMARY_KEY, built by reading the voltage and
+    resistance of every raw data and its file_stats
+    """
+    reader = HDF5Reader(store).open()
+    catalog = load_catalog(store)
+    summary = {}
+    for key in scan_catalog(store) if catalog is None else catalog:
+        key_file_stats = key[:-len('_raw_data')] + '_file_stats'
+        stats = reader.read(key_file_stats) if key_file_stats in reader else None
+        summary[key] = (read_low_bias_resistances(reader, key, voltages), stats)
+    return summary
+
+
+def sample_groups(store):
+    """ Yields (material, sample, group) for every consolidated sample group """
+    for material, material_group in store.items():
+        if not isinstance(material_group, h5py.Group):
+            continue
+        for sample, group in material_group.items():
+            if isinstance(group, h5py.Group) and SAMPLE_INDEX in group:
+                yield material, sample, group
+
+
+class SweepColumns:
+    """Columns of a raw_data array by name, whether they were stored or not.
+
+    Stores written with compact storage only hold voltage, current, time and classification. The other
+    RAW_DATA_COLUMNS are computed from voltage and current (equations.DERIVED_COLUMNS) the first time they are
+    asked for and kept, so only the columns an analysis uses are ever computed.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self._derived = {}
+
+    @property
+    def columns(self):
+        """ Stored columns followed by the ones that can be derived """
+        stored = self.data.dtype.names
+        return stored + tuple(name for name in RAW_DATA_COLUMNS if name not in stored)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        if name in self.data.dtype.names:
+            return self.data[name]
+        if name not in self._derived:
+            if name not in DERIVED_COLUMNS:
+                raise KeyError(name)
+            self._derived[name] = DERIVED_COLUMNS[name](self.data['voltage'], self.data['current'])
+        return self._derived[name]
+
+    def to_frame(self, columns=None):
+        """ DataFrame of columns (all of them when None) """
+        return pd.DataFrame({name: self[name] for name in (columns or self.columns)})
+
+
+class HDF5Reader:
+    """Read only access to an HDF5 store by the dataset keys of generate_hdf5_keys, whatever its layout.
+
+    `read` returns the structured array that was saved at a key. In a consolidated store it is rebuilt from the
+    sample's column datasets, the index and schemas of each sample are loaded once and kept while the file is open.
+    `read_frame` gives it as a DataFrame with the file metadata added back as columns, and `sweep_columns` gives
+    raw data with every RAW_DATA_COLUMNS column available, computing the ones compact storage left out.
+    `read_batch` loads many keys into one DataFrame. Each of these takes the list of columns to read, so a query
+    using three columns never reads or decompresses the others in the consolidated layout.
+
+    `catalog` and `find` answer which files are stored from the CATALOG_KEY table alone, without walking the
+    groups or opening any sweep dataset (stores saved without a catalog are walked once instead). `summary` gives
+    the SUMMARY_KEY table, the per file numbers (low bias resistance, file_stats) most analyses start from.
+
+    store_path may also be an h5py.File that is already open, it is then left open on close.
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.format_version = None
+        self._file = None
+        self._samples = {}  # sample group path -> (group, index, schemas)
+        self._columns = {}  # (sample group path, table) -> {column name: dataset}
+        self._catalog = None
+        self._summary = None
+
+    def open(self):
+        if self._file is None:
+            self._file = self.store_path if isinstance(self.store_path, h5py.File) else h5py.File(self.store_path, 'r')
+            self.format_version = store_format(self._file)
+        return self
+
+    def close(self):
+        if self._file is not None:
+            if self._file is not self.store_path:
+                self._file.close()
+            self._file = None
+            self._samples = {}
+            self._columns = {}
+            self._catalog = None
+            self._summary = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __contains__(self, key):
+        if self.format_version != CONSOLIDATED_FORMAT:
+            return key in self._file
+        try:
+            return self._locate(key) is not None
+        except ValueError:
+            return False
+
+    def keys(self):
+        """ Every `_file_stats` and `_raw_data` key in the store """
+        if self.format_version != CONSOLIDATED_FORMAT:
+            keys = []
+
+            def collect(name, obj):
+                if isinstance(obj, h5py.Dataset) and name.endswith(tuple('_' + table for table in HDF5_TABLES)):
+                    keys.append('/' + name)
+
+            self._file.visititems(collect)
+            return keys
+
+        keys = []
+        for material, sample, group in sample_groups(self._file):
+            for (section, device, filename), entry in load_sample_index(group).items():
+                key_file_stats, key_raw_data = generate_hdf5_keys(material, sample, section, device, filename)
+                if entry[2] >= 0:
+                    keys.append(key_file_stats)
+                if entry[0] >= 0:
+                    keys.append(key_raw_data)
+        return keys
+
+    def catalog(self):
+        """
+        DataFrame with one row per stored sweep file: its raw_data key, material, sample, section, device, filename,
+        sweep number, row count and classification label
+        """
+        if self._catalog is None:
+            data = np.array([(key,) + entry for key, entry in sorted(self._catalog_entries().items())],
+                            dtype=CATALOG_DTYPE)
+            self._catalog = pd.DataFrame({name: decode_column(data[name]) for name in CATALOG_DTYPE.names})
+        return self._catalog
+
+    def summary(self, voltages=()):
+        """
+        DataFrame of the summary table, one row per stored sweep file: the catalog columns, the low bias resistance
+        columns (low_bias_column) and every file_stats column. Low bias resistances at voltages the store was not
+        written with are computed from the raw data the first time they are asked for.
+        """
+        if self._summary is None:
+            entries = load_summary(self._file)
+            if entries is None:
+                entries = scan_summary(self._file)
+            data, _ = summary_array(self._catalog_entries(), entries)
+            self._summary = pd.DataFrame({name: decode_column(data[name]) for name in data.dtype.names})
+        missing = [voltage for voltage in voltages if low_bias_column(voltage) not in self._summary.columns]
+        if missing:
+            computed = [read_low_bias_resistances(self, key, missing) for key in self._summary['key']]
+            for voltage in missing:
+                self._summary[low_bias_column(voltage)] = [values[low_bias_column(voltage)] for values in computed]
+        return self._summary
+
+    def _catalog_entries(self):
+        entries = load_catalog(self._file)
+        return scan_catalog(self._file) if entries is None else entries
+
+    def find(self, **criteria):
+        """
+        raw_data keys of the files matching every criterion, a catalog column name with a value or list of values.
+        e.g. find(sample='D1', sweep=1, classification='Memristive') for the first sweeps of memristive devices in D1
+        """
+        catalog = self.catalog()
+        mask = np.ones(len(catalog), dtype=bool)
+        for column, values in criteria.items():
+            if column not in catalog.columns:
+                raise KeyError(f"Unknown catalog column {column!r}")
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            mask &= catalog[column].isin(values).to_numpy()
+        return catalog['key'][mask].tolist()
+
+    def stored_columns(self, key):
+        """ Names of the columns saved at key """
+        if self.format_version != CONSOLIDATED_FORMAT:
+            if key not in self._file:
+                raise KeyError(key)
+            return self._file[key].dtype.names
+        located = self._locate(key)
+        if located is None:
+            raise KeyError(key)
+        return located[3].names
+
+    def read(self, key, columns=None):
+        """
+        Structured array saved at key, of only the given columns when columns is a list of names. Only those are
+        read: their fields of the compound dataset, or their datasets in the consolidated layout.
+        """
+        parts = self._parts(key, self._projection(key, columns))
+        if not parts:
+            return np.empty(self._length(key), dtype=[])
+        if self.format_version != CONSOLIDATED_FORMAT:
+            dataset = parts[0][1]
+            return dataset[()] if columns is None else dataset.fields(list(parts[0][4].names))[()]
+
+        data = np.empty(parts[0][3] - parts[0][2], dtype=[(name, dtype) for name, _, _, _, dtype in parts])
+        for name, column, start, stop, _ in parts:
+            data[name] = column[start:stop]
+        return data
+
+    def read_batch(self, keys, threads=1, columns=None):
+        """
+        DataFrame of the data of every key one after the other, with a categorical `key` column. The columns are the
+        union of the keys' columns, rows of a key without one are filled (NaN for floats, unknown classification).
+        Each key is read straight into its slice of the preallocated columns, with threads > 1 several keys are
+        decompressed at the same time.
+
+        With a list of columns only those are read. Raw data columns a key did not store (compact storage) are
+        computed from its voltage and current, see equations.DERIVED_COLUMNS.
+        """
+        keys = list(dict.fromkeys(keys))
+        wanted = None if columns is None else list(dict.fromkeys(columns))
+        reads = []  # column names read for each key
+        derive = {}  # column -> indexes of the keys it is computed for
+        for i, key in enumerate(keys):
+            stored = self.stored_columns(key)
+            if wanted is None:
+                reads.append(list(stored))
+                continue
+            names = [name for name in wanted if name in stored]
+            derived = [name for name in wanted if name not in stored and name in DERIVED_COLUMNS
+                       and 'voltage' in stored and 'current' in stored]
+            for name in derived:
+                derive.setdefault(name, []).append(i)
+            reads.append(names + [name for name in ('voltage', 'current') if derived and name not in names])
+
+        parts = [self._parts(key, names) for key, names in zip(keys, reads)]
+        lengths = np.array([key_parts[0][3] - key_parts[0][2] if key_parts else self._length(key)
+                            for key, key_parts in zip(keys, parts)], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+        dtypes = {}
+        for key_parts in parts:
+            for name, _, _, _, dtype in key_parts:
+                for field in dtype.names or [name]:
+                    dtypes[field] = widen_dtype(dtypes.get(field), dtype[field] if dtype.names else dtype)
+        for name in derive:
+            dtypes.setdefault(name, np.dtype(np.float64))
+        if wanted is not None:
+            missing = [name for name in wanted if name not in dtypes]
+            if missing:
+                raise KeyError(f"No key has column {missing[0]!r}")
+        columns = {name: np.full(offsets[-1], column_fill(dtype), dtype=dtype) for name, dtype in dtypes.items()}
+        # consolidated keys share chunks, each is decompressed once per batch
+        decoded = {} if self.format_version == CONSOLIDATED_FORMAT else None
+
+        def load(i):
+            rows = slice(offsets[i], offsets[i + 1])
+            for name, dataset, start, stop, dtype in parts[i]:
+                values = read_rows(dataset, start, stop, chunk_decoder(dataset), decoded, dtype.names)
+                values = values() if callable(values) else values
+                if name is None:
+                    for field in dtype.names:
+                        columns[field][rows] = values[field]
+                else:
+                    columns[name][rows] = values
+
+        if threads > 1:
+            with ThreadPoolExecutor(threads) as pool:
+                list(pool.map(load, range(len(keys))))
+        else:
+            for i in range(len(keys)):
+                load(i)
+
+        for name, indexes in derive.items():
+            rows = np.zeros(offsets[-1], dtype=bool)
+            for i in indexes:
+                rows[offsets[i]:offsets[i + 1]] = True
+            columns[name][rows] = DERIVED_COLUMNS[name](columns['voltage'][rows], columns['current'][rows])
+
+        df = pd.DataFrame({'key': pd.Categorical.from_codes(np.repeat(np.arange(len(keys)), lengths), keys)})
+        for name in wanted or columns:
+            df[name] = decode_column(columns[name])
+        return df
+
+    def _projection(self, key, columns):
+        """ Column names of key to read, all of them when columns is None """
+        stored = self.stored_columns(key)
+        if columns is None:
+            return list(stored)
+        for name in columns:
+            if name not in stored:
+                raise KeyError(f"{key} has no column {name!r}")
+        return list(dict.fromkeys(columns))
+
+    def _length(self, key):
+        if self.format_version != CONSOLIDATED_FORMAT:
+            return self._file[key].shape[0]
+        rows = self._locate(key)[2]
+        return rows.stop - rows.start
+
+    def _parts(self, key, columns):
+        """
+        [(column name, dataset, start, stop, dtype), ...] holding the given stored columns of key. In the per file
+        layout it is the one compound dataset, with None as its name and the dtype of just those fields.
+        """
+        if self.format_version != CONSOLIDATED_FORMAT:
+            dataset = self._file[key]
+            if not columns:
+                return []
+            dtype = np.dtype([(name, dataset.dtype[name]) for name in columns])
+            return [(None, dataset, 0, dataset.shape[0], dtype)]
+
+        group, table, rows, dtype = self._locate(key)
+        datasets = self._columns.get((group.name, table))
+        if datasets is None:
+            datasets = self._columns[(group.name, table)] = dict(group[table].items())
+        return [(name, datasets[name], rows.start, rows.stop, dtype[name]) for name in columns]
+
+    def metadata(self, key):
+        """ {column: value} of METADATA_COLUMNS for key, from the group attributes they were saved in """
+        metadata = hdf5_key_metadata(key)
+        group_path = split_hdf5_key(key)[0] if self.format_version == CONSOLIDATED_FORMAT else key.rsplit('/', 1)[0]
+        if group_path in self._file:
+            attrs = self._file[group_path].attrs
+            metadata.update((name, _decode(attrs[name])) for name in METADATA_COLUMNS if name in attrs)
+        return metadata
+
+    def read_frame(self, key, metadata=True, columns=None):
+        """
+        DataFrame of the data saved at key (of only the given columns), with the METADATA_COLUMNS re-attached as
+        columns (and in df.attrs). Classification codes are given as their labels and text columns as str, see
+        decode_column.
+        """
+        data = self.read(key, columns)
+        df = pd.DataFrame({name: decode_column(data[name]) for name in data.dtype.names},
+                          index=pd.RangeIndex(len(data)))
+        if metadata:
+            df.attrs.update(self.metadata(key))
+            for name, value in df.attrs.items():
+                df[name] = value
+        return df
+
+    def sweep_columns(self, key, columns=None):
+        """
+        SweepColumns of the raw data at key. Given the columns an analysis needs, only those are read, plus voltage
+        and current when some of them have to be computed.
+        """
+        if columns is None:
+            return SweepColumns(self.read(key))
+        stored = self.stored_columns(key)
+        for name in columns:
+            if name not in stored and name not in DERIVED_COLUMNS:
+                raise KeyError(f"{key} has no column {name!r}")
+        names = [name for name in columns if name in stored]
+        if len(names) < len(columns):
+            names += ['voltage', 'current']
+        return SweepColumns(self.read(key, [name for name in dict.fromkeys(names)]))
+
+    def _locate(self, key):
+        """ (sample group, table, row slice, dtype) of a consolidated key, None when it is not stored """
+        sample_path, file_key, table = split_hdf5_key(key)
+        if sample_path not in self._samples:
+            if sample_path not in self._file:
+                return None
+            group = self._file[sample_path]
+            self._samples[sample_path] = (group, load_sample_index(group), load_sample_schemas(group))
+        group, index, schemas = self._samples[sample_path]
+
+        entry = index.get(file_key)
+        if entry is None:
+            return None
+        raw_start, raw_stop, stats_row, raw_schema, stats_schema = entry
+        if table == 'raw_data':
+            rows, schema = slice(raw_start, raw_stop), raw_schema
+        else:
+            rows, schema = slice(stats_row, stats_row + 1), stats_schema
+        if rows.start < 0:
+            return None
+        return group, table, rows, schema_dtype(schemas[table][schema])
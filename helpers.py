@@ -1,4 +1,6 @@
 import os
+import hashlib
+from pathlib import Path
 import numpy as np
 from equations import zero_devision_check
 import h5py
@@ -9,41 +11,51 @@ def split_iv_sweep(filepath):
     # Add your file reading logic here
     pass
 
-def check_for_loops(v_data):
+def check_for_loops(v_data, tolerance=1e-3):
     """
-    :param v_data:
-    :return: number of loops for given data_analyzer.py set
+    Finds the loops in a sweep from the turning points of the voltage waveform.
+    A loop holds two turning points (e.g. 0 -> +max -> 0 -> -max) and ends on the sample where the voltage gets back to
+    the start level heading the same way as at the start; a trailing part loop is kept as the last loop.
+    Loops joined by a single start level sample both hold it, a repeated one is left to the loop it closes.
+    :param v_data: voltage data
+    :param tolerance: fraction of the voltage span treated as no change, for steps and for the start level
+    :return: (n_loops, 2) int array of [start, stop) indices, one row per loop
     """
-    # looks at max voltage and min voltage if they are seen more than twice it classes it as a loop
-    # checks for the number of zeros 3 = single loop
-    num_max = 0
-    num_min = 0
-    num_zero = 0
-    max_v, min_v = bounds(v_data)
-    max_v_2 = max_v / 2
-    min_v_2 = min_v / 2
-
-    # 4 per sweep
-    for value in v_data:
-        if value == max_v_2:
-            num_max += 1
-        if value == min_v_2:
-            num_min += 1
-        if value == 0:
-            num_zero += 1
-    # print(num_min)
-
-    # print("num zero", num_zero)
-    if num_max + num_min == 4:
-        # print("single sweep")
-        return 1
-    if num_max + num_min == 2:
-        # print("half_sweep", num_max, num_min)
-        return 0.5
-    else:
-        # print("multiloop", (num_max + num_min) / 4)
-        loops = (num_max + num_min) / 4
-        return loops
+    v = np.asarray(v_data, dtype=np.float64)
+    single_loop = np.array([[0, v.size]], dtype=np.intp)
+    if v.size < 3:
+        return single_loop
+
+    tol = tolerance * (np.max(v) - np.min(v))
+    dv = np.diff(v)
+    steps = np.flatnonzero(np.abs(dv) > tol)
+    if steps.size == 0:
+        return single_loop
+
+    # turning points are the samples where the direction of the sweep flips
+    direction = np.sign(dv[steps])
+    turns = steps[np.flatnonzero(direction[1:] != direction[:-1]) + 1]
+    if turns.size < 3:
+        return single_loop
+
+    # samples at or past the start level, in the direction the sweep starts off in
+    at_start = np.flatnonzero((v - v[0]) * direction[0] >= -tol)
+
+    # loop k ends after its second turning point, once back at the start level, before the next loop turns
+    loop_ends = turns[1:-1:2]
+    next_turns = turns[2::2]
+    candidate = np.searchsorted(at_start, loop_ends)
+    found = candidate < at_start.size
+    boundaries = np.where(found, at_start[np.minimum(candidate, at_start.size - 1)], loop_ends)
+    boundaries = np.where(boundaries <= next_turns, boundaries, loop_ends)
+
+    # a loop closes on the sample back at the start level, the next loop starts after it when the next sample repeats
+    # that level and shares it otherwise
+    stops = boundaries + 1
+    repeated = np.abs(v[np.minimum(stops, v.size - 1)] - v[0]) <= tol
+    starts = np.concatenate(([0], np.where(repeated, stops, boundaries)))
+    stops = np.concatenate((stops, [v.size]))
+    return np.column_stack((starts, stops)).astype(np.intp)
 
 def extract_folder_names(filepath):
     """ Extract folder names or file metadata from the filepath. """
@@ -74,8 +86,25 @@ def bounds(data):
     min = np.min(data)
     return max, min
 
-def check_sweep_type(filepath, output_file):
-
+# Column headings expected on the first line of each type of sweep
+SWEEP_TYPES = {
+    'Iv_sweep': [
+        ['voltage', 'current'],
+        ['vOLTAGE', 'cURRENT'],
+        ['VSOURC - Plot 0', 'IMEAS - Plot 0'],
+        ['Voltage', 'Current', 'Time'],
+        ['VSOURC - Plot 0\tIMEAS - Plot 0'],
+    ],
+    'Endurance': ['Iteration #', 'Time (s)', 'Resistance (Set)', 'Set Voltage', 'Time (s)', 'Resistance (Reset)', 'Reset Voltage'],
+    'Retention': ['Iteration #', 'Time (s)', 'Current (Set)'],
+}
+
+
+def sniff_sweep_type(lines):
+    """
+    Works out the sweep type from the first lines of a file (at least 5 lines, or all of them for shorter files)
+    :return: sweep type and None, or None and the reason the file is skipped
+    """
     def is_number(s):
         """Check if a string represents a number."""
         try:
@@ -84,60 +113,55 @@ def check_sweep_type(filepath, output_file):
         except ValueError:
             return False
 
-    # Open the file at the given filepath
-    with open(filepath, 'r', encoding='utf-8') as file:
-        # Read the first line and remove any leading/trailing whitespace
-        first_line = file.readline().strip()
-
-        if not first_line:
-            print("No more lines after the first. Returning None.")
-            with open(output_file, 'a', encoding='utf-8') as out_file:
-                out_file.write(str(filepath) + '\n')  # Convert filepath to string
-            return None
-
-        second_line = file.readline().strip()
-
-        if not second_line:
-            with open(output_file, 'a', encoding='utf-8') as out_file:
-                out_file.write(str(filepath) + '\n')  # Convert filepath to string
-            return None
-
-        nan_check_lines = [file.readline().strip() for _ in range(3)]
-        if any('NaN' in line for line in nan_check_lines):
-            with open(output_file, 'a', encoding='utf-8') as out_file:
-                out_file.write(str(filepath) + '\n')  # Convert filepath to string
-            return None
-
-    # Define dictionaries for different types of sweeps and their expected column headings
-    sweep_types = {
-        'Iv_sweep': [
-            ['voltage', 'current'],
-            ['vOLTAGE', 'cURRENT'],
-            ['VSOURC - Plot 0', 'IMEAS - Plot 0'],
-            ['Voltage', 'Current', 'Time'],
-            ['VSOURC - Plot 0\tIMEAS - Plot 0'],
-        ],
-        'Endurance': ['Iteration #', 'Time (s)', 'Resistance (Set)', 'Set Voltage', 'Time (s)', 'Resistance (Reset)', 'Reset Voltage'],
-        'Retention': ['Iteration #', 'Time (s)', 'Current (Set)'],
-    }
+    lines = list(lines[:5]) + [''] * (5 - len(lines[:5]))
+    first_line = lines[0].strip()
 
-    for sweep_type, expected_patterns in sweep_types.items():
+    if not first_line:
+        print("No more lines after the first. Returning None.")
+        return None, 'empty file'
+
+    second_line = lines[1].strip()
+
+    if not second_line:
+        return None, 'no data after the first line'
+
+    if any('NaN' in line for line in lines[2:5]):
+        return None, 'NaN in the first rows'
+
+    for sweep_type, expected_patterns in SWEEP_TYPES.items():
         for pattern in expected_patterns:
             if all(heading in first_line for heading in pattern):
                 if pattern == ['VSOURC - Plot 0', 'IMEAS - Plot 0']:
                     print("Warning: Pattern 3 matched for Iv_sweep. Check data_analyzer.py and format.")
-                return sweep_type
+                return sweep_type, None
 
     first_line_values = first_line.split()
     second_line_values = second_line.split()
     if len(first_line_values) == 2 and len(second_line_values) == 2:
         if is_number(first_line_values[0]) and is_number(first_line_values[1]) and is_number(second_line_values[0]) and is_number(second_line_values[1]):
-            return 'Iv_sweep'
+            return 'Iv_sweep', None
 
-    with open(output_file, 'a', encoding='utf-8') as out_file:
-        out_file.write(str(filepath) + '\n')  # Convert filepath to string
+    return None, 'unknown sweep type'
 
-    return None
+
+def check_sweep_type(filepath, output_file):
+    """ Sweep type of a file on its own, appending the file to output_file when it is skipped """
+    # Open the file at the given filepath
+    with open(filepath, 'r', encoding='utf-8') as file:
+        lines = [file.readline() for _ in range(5)]
+
+    sweep_type, skip_reason = sniff_sweep_type(lines)
+    if sweep_type is None:
+        write_skipped_files([(filepath, skip_reason)], output_file)
+    return sweep_type
+
+
+def write_skipped_files(skipped_files, output_file):
+    """ Appends (file, reason) pairs to output_file in one go, one tab separated line per file """
+    if not skipped_files:
+        return
+    with open(output_file, 'a', encoding='utf-8') as out_file:
+        out_file.writelines(f"{filepath}\t{reason}\n" for filepath, reason in skipped_files)
 
 def check_for_nan(df):
     if df.isna().values.any():
@@ -156,6 +180,27 @@ def generate_analysis_params(df, filename, base_dir, device):
         'long_name': f"{filename}.csv"
     }
 
+def iter_sweep_files(base_dir, depth=6, skip_dirs=('plots_combined',)):
+    """
+    Walks base_dir with os.scandir and lazily yields every .txt file exactly `depth` levels down, sorted per folder.
+    Folders deeper than that or named in skip_dirs are never entered, so processing can start before the walk ends.
+    :return: generator of (path, (nanoparticles, material, sample, section, device, filename))
+    """
+    def walk(directory, parts):
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            return
+        for entry in entries:
+            if len(parts) == depth - 1:
+                if entry.name.lower().endswith('.txt') and entry.is_file():
+                    yield Path(entry.path), parts + (entry.name,)
+            elif entry.name not in skip_dirs and entry.is_dir():
+                yield from walk(entry.path, parts + (entry.name,))
+
+    yield from walk(os.fspath(base_dir), ())
+
 def extract_file_info(relative_path):
     filename = relative_path.parts[-1]
     device = relative_path.parts[4]
@@ -164,9 +209,12 @@ def extract_file_info(relative_path):
     material = relative_path.parts[1]
     return filename, device, section, sample, material
 
-# Print progress every X files
+# Print progress every X files, total_files is None while files are still being discovered
 def print_progress(processed_files, total_files, interval):
     if processed_files % interval == 0:
+        if total_files is None:
+            print(f"Processed {processed_files} files.")
+            return
         percent_completed = (zero_devision_check(processed_files, total_files)) * 100
         print(f"Processed {processed_files}/{total_files} files. {percent_completed:.2f}% done.")
 
@@ -180,6 +228,22 @@ def check_if_file_exists(store_path, key):
             return False
 
 
+# Size, mtime and optional content hash of a source file, as recorded in the HDF5 manifest
+def source_signature(filepath, with_hash=False):
+    stat = os.stat(filepath)
+    digest = file_hash(filepath) if with_hash else ''
+    return stat.st_size, stat.st_mtime, digest
+
+
+def file_hash(filepath, block_size=1 << 20):
+    """ sha1 of the file contents """
+    sha1 = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
 # Generate HDF5 keys for storing data_analyzer.py
 def generate_hdf5_keys(material, sample, section, device, filename):
     key_info = f'/{material}/{sample}/{section}/{device}/{filename}_file_stats'
@@ -187,6 +251,74 @@ def generate_hdf5_keys(material, sample, section, device, filename):
     return key_info, key_metrics
 
 
+# Layout of an HDF5 store, saved in the FORMAT_VERSION_ATTR attribute of its root group.
+# Stores written before the attribute existed are per file stores
+FORMAT_VERSION_ATTR = 'format_version'
+PER_FILE_FORMAT = 1  # two datasets per sweep file, at the keys from generate_hdf5_keys
+CONSOLIDATED_FORMAT = 2  # one group per sample, holding an extendable dataset per column and an index of each file's rows
+HDF5_TABLES = ('file_stats', 'raw_data')
+SAMPLE_INDEX = '_index'  # dataset in each consolidated sample group mapping (section, device, filename) to rows
+SAMPLE_SCHEMAS_ATTR = 'schemas'  # json of the column lists the files of a consolidated sample group were saved with
+
+# Compression profiles for the sweep datasets, as h5py create_dataset options. gzip-4 is h5py's default gzip level
+COMPRESSION_PROFILES = {
+    'none': {},
+    'lzf': {'compression': 'lzf'},
+    **{f'gzip-{level}': {'compression': 'gzip', 'compression_opts': level} for level in range(1, 10)},
+    'shuffle-gzip': {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True},
+}
+DEFAULT_COMPRESSION = 'gzip-4'
+# Voltages of the low bias resistance columns of the summary table, mean resistance from 0 V up to each one
+DEFAULT_SUMMARY_VOLTAGES = (0.1,)
+MIN_COMPRESSED_ROWS = 64  # below this a dataset is stored contiguous and uncompressed, filters would only add overhead
+CHUNK_BYTES = 64 * 1024  # uncompressed size a chunk is aimed at
+MIN_TABLE_CHUNK_ROWS = 256  # extendable consolidated columns
+
+
+def dataset_options(profile, rows, itemsize, extendable=False):
+    """
+    create_dataset options (chunks and filters) for a dataset of rows rows of itemsize bytes each.
+    Chunks hold about CHUNK_BYTES; an extendable dataset is sized from the rows it starts with and always chunked.
+    """
+    if profile not in COMPRESSION_PROFILES:
+        raise ValueError(f"Unknown compression profile {profile!r}, use one of {', '.join(COMPRESSION_PROFILES)}")
+    max_chunk_rows = max(1, CHUNK_BYTES // itemsize)
+    if extendable:
+        chunk_rows = min(max(rows, MIN_TABLE_CHUNK_ROWS), max_chunk_rows)
+    elif rows < MIN_COMPRESSED_ROWS or profile == 'none':
+        return {}
+    else:
+        chunk_rows = min(rows, max_chunk_rows)
+    return dict(COMPRESSION_PROFILES[profile], chunks=(chunk_rows,))
+
+
+def split_hdf5_key(key):
+    """ Splits a key from generate_hdf5_keys into the sample group, (section, device, filename) and the table name """
+    parts = key.strip('/').split('/')
+    if len(parts) == 5:
+        material, sample, section, device, name = parts
+        for table in HDF5_TABLES:
+            if name.endswith('_' + table):
+                return f'/{material}/{sample}', (section, device, name[:-len(table) - 1]), table
+    raise ValueError(f"Not a sweep file key: {key}")
+
+
+# File metadata, kept in df.attrs by file_processing.add_metadata and saved as HDF5 group attributes, not per row
+METADATA_COLUMNS = ('Material', 'Sample', 'Section', 'Device', 'Filename')
+
+
+def sweep_number(filename):
+    """ Sweep number from the leading '<n>-' of a filename ('3-FS-1v...txt' -> 3), -1 when it has none """
+    number = filename.split('-', 1)[0]
+    return int(number) if number.isdigit() else -1
+
+
+def hdf5_key_metadata(key):
+    """ METADATA_COLUMNS values encoded in a key from generate_hdf5_keys """
+    sample_path, file_key, _ = split_hdf5_key(key)
+    return dict(zip(METADATA_COLUMNS, tuple(sample_path.strip('/').split('/')) + file_key))
+
+
 # def dataframe_to_structured_array(df):
 #     """Convert a Pandas DataFrame to a structured NumPy array with HDF5-compatible dtypes."""
 #     # Define HDF5-compatible string dtype
@@ -200,48 +332,79 @@ def generate_hdf5_keys(material, sample, section, device, filename):
 #     # Convert DataFrame to structured NumPy array
 #     return np.array(df.to_records(index=False))
 
+# The classification and string encoding below, down to encode_strings, is copied in v2.0_errors_not_sure_why/helpers.py
+# (v2 runs as its own top level modules and cannot import this one). Change both, tests/test_hdf5_store.py checks
+# that they match
+# Device classifications in the order of their stored codes, anything else is saved as UNKNOWN_CLASSIFICATION
+CLASSIFICATIONS = ('Memristive', 'Capacitive', 'Conductive', 'Intermittent', 'Mem-Capacitance', 'Ohmic', 'Non-Conductive')
+UNKNOWN_CLASSIFICATION = -1
+# HDF5 enum type of the classification column, the code -> name table is saved once as part of the type
+CLASSIFICATION_DTYPE = h5py.enum_dtype(
+    {'unknown': UNKNOWN_CLASSIFICATION, **{name: code for code, name in enumerate(CLASSIFICATIONS)}}, basetype='i1')
+FIXED_STRING_MAX_BYTES = 256  # longer text columns are saved as variable length strings
+
+
+def encode_classification(values):
+    """ int8 codes of classification labels, UNKNOWN_CLASSIFICATION for None and unknown labels """
+    return pd.Categorical(values, categories=CLASSIFICATIONS).codes.astype(np.int8)
+
+
+def classification_codes(values):
+    """ int8 codes of a classification column of labels or of numeric codes.
+    NaN (a blank classification cell), non integer and out of range codes become UNKNOWN_CLASSIFICATION """
+    if not pd.api.types.is_numeric_dtype(values):
+        return encode_classification(values)
+    codes = np.asarray(values, dtype=np.float64)
+    valid = (codes >= 0) & (codes < len(CLASSIFICATIONS)) & (codes == np.floor(codes))
+    return np.where(valid, codes, UNKNOWN_CLASSIFICATION).astype(np.int8)
+
+
+def decode_classification(codes):
+    """ Categorical of the labels of classification codes, NaN for unknown """
+    return pd.Categorical.from_codes(np.asarray(codes, dtype=np.int8), categories=CLASSIFICATIONS)
+
+
 def map_classification_to_numbers(df):
-    # Only apply the mapping if the 'classification' column exists in the dataframe
-    if 'classification' in df.columns:
-        classification_map = {
-            'Memristive': 0,
-            'Capacitive': 1,
-            'Conductive': 2,
-            'Intermittent': 3,
-            'Mem-Capacitance': 4,
-            'Ohmic': 5,
-            'Non-Conductive': 6
-        }
-        df['classification'] = df['classification'].map(classification_map)
+    # Only apply the mapping if the 'classification' column holds labels
+    if 'classification' in df.columns and not pd.api.types.is_numeric_dtype(df['classification']):
+        df['classification'] = encode_classification(df['classification'])
     return df
 
+
+def encode_strings(series):
+    """ UTF-8 fixed width bytes of a text column, variable length strings if the longest is over FIXED_STRING_MAX_BYTES """
+    encoded = np.char.encode(series.astype(str).to_numpy(dtype=str), 'utf-8')
+    if encoded.dtype.itemsize <= FIXED_STRING_MAX_BYTES:
+        return encoded
+    return encoded.astype(object).astype(h5py.string_dtype(encoding='utf-8'))
+
+
 def dataframe_to_structured_array(df: pd.DataFrame):
     """Convert a Pandas DataFrame to an HDF5-friendly structured NumPy array.
 
-    Creates a compound dtype with UTF-8 variable-length strings for text columns
-    and preserves numeric columns. Returns a NumPy structured array suitable
-    for h5py.create_dataset(data=..., dtype=...).
+    Numeric columns keep their dtype, classification becomes CLASSIFICATION_DTYPE
+    codes and other text columns UTF-8 fixed width strings (see encode_strings).
+    Every column is converted whole, never row by row. Returns a NumPy structured
+    array suitable for h5py.create_dataset(data=..., dtype=...).
+    METADATA_COLUMNS are left out, they are saved once as attributes instead.
     """
     if df is None or df.empty:
         return None
 
-    df = map_classification_to_numbers(df.copy())
-
-    string_dt = h5py.string_dtype(encoding='utf-8')
-    dtype_fields = []
+    columns = {}
     for col in df.columns:
+        if col in METADATA_COLUMNS:
+            continue
         series = df[col]
-        if series.dtype == object:
-            dtype_fields.append((col, string_dt))
+        if col == 'classification':
+            columns[col] = classification_codes(series).view(CLASSIFICATION_DTYPE)
+        elif pd.api.types.is_numeric_dtype(series):
+            columns[col] = series.to_numpy()
         else:
-            dtype_fields.append((col, series.dtype))
+            columns[col] = encode_strings(series)
 
-    structured = np.empty(len(df), dtype=dtype_fields)
-    for col in df.columns:
-        series = df[col]
-        if series.dtype == object:
-            structured[col] = np.asarray(series.astype(str))
-        else:
-            structured[col] = np.asarray(series)
+    structured = np.empty(len(df), dtype=[(col, values.dtype) for col, values in columns.items()])
+    for col, values in columns.items():
+        structured[col] = values
 
-    return structured
\ No newline at end of file
+    return structured
@@ -1,17 +1,22 @@
 import os.path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import datetime
 import excell
-from helpers import generate_analysis_params, check_if_file_exists, print_progress, check_for_nan, \
-    generate_hdf5_keys, check_sweep_type
-from file_processing import read_file_to_dataframe, add_metadata, analyze_file, save_to_hdf5
+import pandas as pd
+from helpers import generate_analysis_params, print_progress, check_for_nan, \
+    generate_hdf5_keys, iter_sweep_files, write_skipped_files, PER_FILE_FORMAT, CONSOLIDATED_FORMAT, DEFAULT_COMPRESSION, \
+    DEFAULT_SUMMARY_VOLTAGES
+from file_processing import read_sweep, add_metadata, analyze_file, process_raw_file, compact_raw_data, HDF5Writer, \
+    HDF5WriterProcess, process_raw_file_to_writer, connect_writer_worker
 from metrics_calculation import update_device_metrics_summary, write_device_summary
 try:
     from tables import NaturalNameWarning
 except Exception:  # pragma: no cover - optional dependency
     class NaturalNameWarning(Warning):
         pass
-from excell import save_info_from_solution_devices_excell, save_info_from_device_into_excell
+from excell import save_info_from_solution_devices_excell
 import warnings
 
 # Entry script to process raw or curated text files into HDF5 datasets
@@ -24,7 +29,30 @@ PLOT_GRAPHS = False
 
 # Constants for configuration
 FORCE_RECALCULATE = True  # Set to True to force recalculation and overwrite existing data in HDF5
+# Incremental mode: only new or changed source files are analysed and datasets whose source file is gone are deleted.
+# Writes to an undated HDF5 file so each run updates the same store, and takes precedence over FORCE_RECALCULATE
+INCREMENTAL = False
+HASH_SOURCES = False  # Also record a sha1 of each source, so files only touched by a sync (new mtime) are not redone
 PRINT_INTERVAL = 10  # Number of files after which progress is printed
+FLUSH_INTERVAL = 200  # Number of datasets buffered before they are written to the HDF5 file
+# Parallel mode: number of processes analysing raw files, 1 runs everything in this process.
+# The HDF5 file is then written by one extra process that the workers send their results to, it writes them in file
+# order so the output matches a sequential run
+WORKERS = 1
+IN_FLIGHT_PER_WORKER = 4  # Files submitted per worker ahead of the one being written, bounds memory
+WRITER_QUEUE_SIZE = 64  # Results waiting for the writer process before the workers are held back
+# Layout of new HDF5 files: PER_FILE_FORMAT (two datasets per sweep file) or CONSOLIDATED_FORMAT (one set of
+# extendable tables per sample, far fewer HDF5 objects). Read either back with hdf5_reader.HDF5Reader
+STORE_FORMAT = PER_FILE_FORMAT
+# Compact storage: raw_data keeps only voltage, current, time and classification, about a tenth of the size.
+# The derived columns are computed when read, see hdf5_reader.HDF5Reader.sweep_columns
+COMPACT_STORAGE = False
+# Compression of the sweep datasets, one of helpers.COMPRESSION_PROFILES: 'none', 'lzf', 'gzip-1' ... 'gzip-9' or
+# 'shuffle-gzip'. benchmarks/hdf5_profiles.py compares them on size and write/read speed
+COMPRESSION = DEFAULT_COMPRESSION
+# The /_summary table written with the store has, for each file, the mean resistance from 0 V up to each of these
+# voltages next to its file_stats. Analyses of the whole store read it instead of every dataset (HDF5Reader.summary)
+SUMMARY_VOLTAGES = DEFAULT_SUMMARY_VOLTAGES
 OUTPUT_FILE = "skipped_files.txt"  # File to store skipped files or unknown sweep types
 SUMMARY_FILE = "device_metrics_summary.txt"  # File to store the device-level summary
 OUTPUT_FILE_CURATED = "skipped_files_curated.txt"  # File to store skipped curated files
@@ -50,31 +78,31 @@ save_location = user_dir / Path("OneDrive - The University of Nottingham\Documen
 solution_devices_excell_path = user_dir / Path("OneDrive - The University of Nottingham/Documents/Phd/solutions and devices.xlsx")
 
 warnings.filterwarnings('ignore', category=NaturalNameWarning)
-skipped_files2 = []
-skipped_files_curated = []
 
-def process_files_raw(txt_files, base_dir, store_path):
-    processed_files = 0
+def plan_raw_files(txt_files, base_dir, writer, counts, sources):
+    """
+    Walks the discovered raw files in order doing everything that needs the store or happens once per sample:
+    skip checks, the fabrication lookup and the device classification.
+    Yields (file, file_info, key_file_stats, key_raw_data, classification) for every file that needs analysing.
+    """
     current_sample = None
-    device_file_stats_summary = {}  # Track metrics for each device
-    device_file_counts = {}  # Dictionary to store_path file counts per device
-
-    for i, file in enumerate(txt_files, 1):
-        relative_path = file.relative_to(base_dir)
-        depth = len(relative_path.parts)
-
-        if depth != 6:
-            continue
-        #print(file, i)
-        #print(relative_path)
-        # Extract file information
-        filename, device, section, sample, material, nano_particles = extract_file_info_with_nanoparticles(relative_path)
+    for file, file_info in txt_files:
+        counts['discovered'] += 1
+        sources.append(file)
+        #print(file)
+        # File information from the folder structure
+        nano_particles, material, sample, section, device, filename = file_info
 
         # Generate keys for HDF5 storage, returns as _info and _metrics
         key_file_stats, key_raw_data = generate_hdf5_keys(material, sample, section, device, filename)
 
+        # In incremental mode skip files whose source has not changed since it was stored
+        if INCREMENTAL and writer.source_unchanged(key_file_stats, file, HASH_SOURCES):
+            counts['unchanged'] += 1
+            continue
+
         # Check if the file exists in HDF5 and skip if necessary
-        if not FORCE_RECALCULATE and check_if_file_exists(store_path, key_file_stats):
+        if not FORCE_RECALCULATE and key_file_stats in writer:
             print(f"File {filename} already exists in HDF5. Skipping...")
             continue
 
@@ -88,87 +116,120 @@ def process_files_raw(txt_files, base_dir, store_path):
             # calculate yield here
             key_device_yield = f'/{material}/{sample}_yield'
             #df_yield =
-        if device == 'plots_combined':
-            continue
-
-        # Check if the sweep type is known and/or if the file is a dud
-        # returns 'iv_sweep' or None
-        sweep_type = check_sweep_type(file, OUTPUT_FILE)
-
-        #  Check for nan values and if so skip
-        df = read_file_to_dataframe(file)
-        if df is None or check_for_nan(df) or sweep_type is None:
-            skipped_files2.append(file)
-            continue
 
-        # adds all the file metadata too df
-        add_metadata(df, material, sample, section, device, filename)
-
-        # Generate the analysis parameters for this script
-        analysis_params = generate_analysis_params(df, filename, base_dir, device)
-
-        # Respect plotting preference
-        analysis_params['plot_graph'] = PLOT_GRAPHS
-        # Analyze the file based on its sweep type returning two dataframes
-        df_file_stats, df_raw_data = analyze_file(sweep_type, analysis_params)
-        # metrics_df is all the data_analyzer.py I,V,R etc...
-        # df_file_stats is the info on the sweep ie on off value etc...
-
-        # Track the number of files per device
-        device_key = (material, sample, section, device)  # Identify each unique device
-        if device_key not in device_file_counts:
-            device_file_counts[device_key] = 0
-        device_file_counts[device_key] += 1  # Increment file count for this device
-
-
-        # pull the info from the device finding the classification
-        if df_raw_data is not None:
-            # finds the classification within the excell file and adds it to the end of the dataframe
-            Sample_location = os.path.join(base_dir, nano_particles, material, sample)
-            result = save_info_from_device_into_excell(sample, Sample_location)
-            classification = excell.device_clasification(result, device, section, Sample_location)
-            classification = classification
-            df_raw_data['classification'] = classification
-        else:
-            print("metrics_df is None, cannot assign classification.")
-            print("check file,", key_file_stats )
+        # finds the classification within the excell file, it is added to the end of the raw data
+        Sample_location = os.path.join(base_dir, nano_particles, material, sample)
+        # the workbook is parsed once per sample and reparsed only if it changes
+        classification = excell.cached_device_clasification(sample, Sample_location, device, section)
 
         # TODO do the same again for the quantum dot spacing as well from another excell document
-        key_df_sample_information = []
-        df_sample_information = []
 
-        # # Update device_file_stats_summary
-        #update_device_metrics_summary(device_file_stats_summary, filename, device, section, sample, material, df_file_stats)
-
-        # Save raw data_analyzer.py and metrics to HDF5
-        # key_file_stats and key_metircs are the keys for the dataframes
-        save_to_hdf5(store_path, key_file_stats, key_raw_data, df_file_stats, df_raw_data)
+        yield file, file_info, key_file_stats, key_raw_data, classification
+
+
+def analyse_and_save(planned_files, base_dir, writer, workers):
+    """
+    Runs process_raw_file on every planned file, saves the results and records the sources with writer, and yields
+    (planned file, skip reason) in the order the files were planned.
+    With more than one worker writer is an HDF5WriterProcess and the files are analysed in a process pool whose
+    workers send their results straight to it (process_raw_file_to_writer), numbered in plan order so they are
+    written in that order. At most IN_FLIGHT_PER_WORKER files per worker are submitted ahead of the one being waited
+    on so memory stays bounded.
+    """
+    if workers <= 1:
+        for planned in planned_files:
+            file, file_info, key_file_stats, key_raw_data, classification = planned
+            skip_reason, file_stats, raw_data = process_raw_file(file, file_info, base_dir, classification,
+                                                                 PLOT_GRAPHS, COMPACT_STORAGE)
+            if skip_reason is None:
+                writer.save_structured(key_file_stats, key_raw_data, file_stats, raw_data)
+            # skipped files are recorded with the reason, so incremental runs do not read them again until they change
+            writer.record_source((key_file_stats, key_raw_data), file, HASH_SOURCES, skip_reason or '')
+            yield planned, skip_reason
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=connect_writer_worker,
+                             initargs=writer.worker_args()) as pool:
+        in_flight = deque()
+        for planned in planned_files:
+            file, file_info, key_file_stats, key_raw_data, classification = planned
+            in_flight.append((planned, pool.submit(process_raw_file_to_writer, writer.next_sequence(),
+                                                   (key_file_stats, key_raw_data), HASH_SOURCES, file, file_info,
+                                                   base_dir, classification, PLOT_GRAPHS, COMPACT_STORAGE)))
+            if len(in_flight) >= workers * IN_FLIGHT_PER_WORKER:
+                planned, future = in_flight.popleft()
+                yield planned, writer.wait(future, planned[2])
+        while in_flight:
+            planned, future = in_flight.popleft()
+            yield planned, writer.wait(future, planned[2])
+
+
+def process_files_raw(txt_files, base_dir, store_path, workers=None):
+    """
+    txt_files: (path, file info) pairs as yielded by helpers.iter_sweep_files, consumed as they are found
+    workers: analysis processes, WORKERS when None. With more than one, files are analysed in parallel and written
+    in order by a dedicated writer process, giving the same HDF5 file as a sequential run
+    """
+    workers = WORKERS if workers is None else workers
+    processed_files = 0
+    counts = {'discovered': 0, 'unchanged': 0}
+    device_file_stats_summary = {}  # Track metrics for each device
 
-        # todo add in yield to the document me
-        # todo find whats in the updated metrics summary
-        #print("a")
-        #print(list(device_file_stats_summary["1"]))
-        #print(device_file_stats_summary)
-        # Track progress and print it
-        processed_files += 1
-        print_progress(processed_files, len(txt_files), PRINT_INTERVAL)
+    sources = []  # every discovered file, used to prune datasets of deleted files
+    skipped_files = []  # (file, reason), written to the skipped files log once at the end
+
+    # One writer keeps the HDF5 file open for the whole run, it is closed cleanly on errors or Ctrl-C.
+    # In parallel mode it runs in its own process, fed by the workers through a bounded queue
+    if workers > 1:
+        writer = HDF5WriterProcess(store_path, flush_interval=FLUSH_INTERVAL, queue_size=WRITER_QUEUE_SIZE,
+                                   format_version=STORE_FORMAT, compression=COMPRESSION,
+                                   summary_voltages=SUMMARY_VOLTAGES)
+    else:
+        writer = HDF5Writer(store_path, flush_interval=FLUSH_INTERVAL, format_version=STORE_FORMAT,
+                            compression=COMPRESSION, summary_voltages=SUMMARY_VOLTAGES)
+
+    with writer:
+        planned_files = plan_raw_files(txt_files, base_dir, writer, counts, sources)
+        # Raw data_analyzer.py and metrics are saved to HDF5 as each file is analysed
+        for planned, skip_reason in analyse_and_save(planned_files, base_dir, writer, workers):
+            file = planned[0]
+            if skip_reason is not None:
+                skipped_files.append((file, skip_reason))
+                continue
+
+            # # Update device_file_stats_summary
+            #update_device_metrics_summary(device_file_stats_summary, filename, device, section, sample, material, df_file_stats)
+
+            # todo add in yield to the document me
+            # Track progress and print it
+            processed_files += 1
+            print_progress(processed_files, None, PRINT_INTERVAL)
+
+        # Remove datasets whose source file no longer exists
+        if INCREMENTAL:
+            removed = writer.prune_sources(sources)
+            print(f"Incremental run: {counts['unchanged']} files unchanged, {len(removed)} datasets removed")
 
     # Write the device-level summary after all files are processed
     # this currently saves at the location of the code!!
     #write_device_summary(device_file_stats_summary, SUMMARY_FILE)
 
-    misssing_number = len(txt_files) - processed_files
-
+    misssing_number = counts['discovered'] - processed_files - counts['unchanged']
 
+    # Log every skipped file in one write
+    write_skipped_files(skipped_files, OUTPUT_FILE)
 
     print(
-        f"Processing complete: {processed_files}/{len(txt_files)} files processed, with {misssing_number} files missing:")
+        f"Processing complete: {processed_files}/{counts['discovered']} files processed, with {misssing_number} files missing:")
     print(" ")
-    for file in skipped_files2:
-        print(file)
+    for file, reason in skipped_files:
+        print(f"{file} ({reason})")
 
 def process_files_curated(txt_files, base_dir, store_path):
+    """ txt_files: (path, file info) pairs as yielded by helpers.iter_sweep_files, consumed as they are found """
+    discovered_files = 0
     processed_files = 0
+    unchanged_files = 0
     current_sample = None
     device_metrics_summary = {}  # Track metrics for each device
 
@@ -180,102 +241,117 @@ def process_files_curated(txt_files, base_dir, store_path):
     # with folder structure like this
     # output_folder2 = os.path.join(self.output_folder, self.material, self.polymer, self.sample_name
 
-    for i, file in enumerate(txt_files, 1):
-        relative_path = file.relative_to(base_dir)
-        depth = len(relative_path.parts)
-
-        if depth != 6:
-            continue
-
-
-        # Extract file information
-        filename, device, section, sample, material, _ = extract_file_info_with_nanoparticles(relative_path)
-
-        # Generate keys for HDF5 storage
-        key_file_stats, key_raw_data = generate_hdf5_keys(material, sample, section, device, filename)
-
-        # Check if the file exists in HDF5 and skip if necessary
-        if not FORCE_RECALCULATE and check_if_file_exists(store_path, key_file_stats):
-            print(f"File {filename} already exists in HDF5. Skipping...")
-            continue
-
-        # Moving on to a new sample
-        if sample != current_sample:
-            current_sample = sample
-            print(f"Moving on to new sample: {sample}")
-
-        # Read the file and process it
-        #  Check for nan values
-        df = read_file_to_dataframe(file)
-        if df is None or check_for_nan(df):
-            skipped_files_curated.append(file)
-            continue
-
-        add_metadata(df, material, sample, section, device, filename)
-
-        # Generate the analysis parameters
-        analysis_params = generate_analysis_params(df, filename, base_dir, device)
-        analysis_params['plot_graph'] = PLOT_GRAPHS
-
-
-        # Analyze the file based on its sweep type
-        sweep_type = check_sweep_type(file, OUTPUT_FILE_CURATED)
-
-        df_file_stats, metrics_df = analyze_file(sweep_type, analysis_params)
-
-        # look at excell file here
-        # check the file and load it in before doing the bellow passing the dataframe to it
-        #save_info_from_solution_devices_excell(device_name, excel_path)
-        # append the classification given to the end of the dataframe for the device
-
-        # Save dataframes to HDF5
-        save_to_hdf5(store_path, key_file_stats, key_raw_data, df_file_stats, metrics_df)
-        #print(key_raw)
-
-        # Update the device metrics summary with new metrics
-        update_device_metrics_summary(device_metrics_summary, filename, device, section, sample, material, metrics_df)
-
-        # Track progress and print it
-        processed_files += 1
-        print_progress(processed_files, len(txt_files), PRINT_INTERVAL)
+    sources = []  # every discovered file, used to prune datasets of deleted files
+    skipped_files = []  # (file, reason), written to the skipped files log once at the end
+
+    with HDF5Writer(store_path, flush_interval=FLUSH_INTERVAL, format_version=STORE_FORMAT,
+                    compression=COMPRESSION, summary_voltages=SUMMARY_VOLTAGES) as writer:
+        for file, file_info in txt_files:
+            discovered_files += 1
+            sources.append(file)
+
+            # File information from the folder structure
+            _, material, sample, section, device, filename = file_info
+
+            # Generate keys for HDF5 storage
+            key_file_stats, key_raw_data = generate_hdf5_keys(material, sample, section, device, filename)
+
+            # In incremental mode skip files whose source has not changed since it was stored
+            if INCREMENTAL and writer.source_unchanged(key_file_stats, file, HASH_SOURCES):
+                unchanged_files += 1
+                continue
+
+            # Check if the file exists in HDF5 and skip if necessary
+            if not FORCE_RECALCULATE and key_file_stats in writer:
+                print(f"File {filename} already exists in HDF5. Skipping...")
+                continue
+
+            # Moving on to a new sample
+            if sample != current_sample:
+                current_sample = sample
+                print(f"Moving on to new sample: {sample}")
+
+            # Read the file and process it, one read gives the sweep type and the data
+            sweep_type, columns, skip_reason = read_sweep(file)
+            df = pd.DataFrame(columns) if columns is not None else None
+
+            #  Check for nan values
+            if skip_reason is None and check_for_nan(df):
+                skip_reason = 'NaN values'
+            if skip_reason is not None:
+                skipped_files.append((file, skip_reason))
+                # recorded with the reason, so incremental runs do not read the file again until it changes
+                writer.record_source((key_file_stats, key_raw_data), file, HASH_SOURCES, skip_reason)
+                continue
+
+            add_metadata(df, material, sample, section, device, filename)
+
+            # Generate the analysis parameters
+            analysis_params = generate_analysis_params(df, filename, base_dir, device)
+            analysis_params['plot_graph'] = PLOT_GRAPHS
+
+            # Analyze the file based on its sweep type
+            df_file_stats, metrics_df = analyze_file(sweep_type, analysis_params)
+            if df_file_stats is None or metrics_df is None:
+                skip_reason = f'No analysis results ({sweep_type})'
+                skipped_files.append((file, skip_reason))
+                writer.record_source((key_file_stats, key_raw_data), file, HASH_SOURCES, skip_reason)
+                continue
+
+            # look at excell file here
+            # check the file and load it in before doing the bellow passing the dataframe to it
+            #save_info_from_solution_devices_excell(device_name, excel_path)
+            # append the classification given to the end of the dataframe for the device
+
+            # Save dataframes to HDF5
+            raw_data = compact_raw_data(metrics_df, df) if COMPACT_STORAGE and metrics_df is not None else metrics_df
+            writer.save(key_file_stats, key_raw_data, df_file_stats, raw_data)
+            writer.record_source((key_file_stats, key_raw_data), file, HASH_SOURCES)
+            #print(key_raw)
+
+            # Update the device metrics summary with new metrics
+            update_device_metrics_summary(device_metrics_summary, filename, device, section, sample, material, metrics_df)
+
+            # Track progress and print it
+            processed_files += 1
+            print_progress(processed_files, None, PRINT_INTERVAL)
+
+        # Remove datasets whose source file no longer exists
+        if INCREMENTAL:
+            removed = writer.prune_sources(sources)
+            print(f"Incremental run: {unchanged_files} files unchanged, {len(removed)} datasets removed")
 
     # Write the device-level summary after all files are processed
     write_device_summary(device_metrics_summary, SUMMARY_FILE_CURATED)
 
-    misssing_number = len(txt_files) - processed_files
+    misssing_number = discovered_files - processed_files - unchanged_files
+
+    # Log every skipped file in one write
+    write_skipped_files(skipped_files, OUTPUT_FILE_CURATED)
 
     print(
-        f"Processing complete: {processed_files}/{len(txt_files)} files processed, with {misssing_number} files missing:")
+        f"Processing complete: {processed_files}/{discovered_files} files processed, with {misssing_number} files missing:")
     print("")
-    for file in skipped_files_curated:
-        print(file)
-
-# Extract file info (expects depth 6): returns filename, device, section, sample, material, nanoparticles
-def extract_file_info_with_nanoparticles(relative_path: Path):
-    filename = relative_path.parts[-1]
-    device = relative_path.parts[4]
-    section = relative_path.parts[3]
-    sample = relative_path.parts[2]
-    material = relative_path.parts[1]
-    nanoparticles = relative_path.parts[0]
-    return filename, device, section, sample, material, nanoparticles
-
+    for file, reason in skipped_files:
+        print(f"{file} ({reason})")
 
 def main(base_dir, base_curated, calculate_raw, calculate_curated, save_location):
-    # Discover files at expected depth
-    txt_files_base = [f for f in base_dir.rglob('*.txt') if len(f.relative_to(base_dir).parts) == 6]
-    txt_files_curated = [f for f in base_curated.rglob('*.txt') if len(f.relative_to(base_curated).parts) == 6]
+    # Discover files at the expected depth, lazily so processing starts while the tree is still being walked
+    txt_files_base = iter_sweep_files(base_dir)
+    txt_files_curated = iter_sweep_files(base_curated)
 
     timestamp = datetime.now().strftime('%Y%m%d')
+    # incremental runs keep updating one store instead of starting a new dated file
+    suffix = '' if INCREMENTAL else f'_{timestamp}'
 
     if calculate_raw:
         # Process all raw files
-        path = save_location / f'Memristor_data_{timestamp}.h5'
+        path = save_location / f'Memristor_data{suffix}.h5'
         process_files_raw(txt_files_base, base_dir, path)
 
     if calculate_curated:
         # Process curated files
-        path = save_location / f'Curated_data_{timestamp}.h5'
+        path = save_location / f'Curated_data{suffix}.h5'
         process_files_curated(txt_files_curated, base_curated, path)
 
 
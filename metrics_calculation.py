@@ -9,68 +9,148 @@ def calculate_metrics_for_loops(split_v_data, split_c_data):
     '''
     Calculate various metrics for each split array of voltage and current data_analyzer.py.
     anything that needs completing on loops added in here
+    The loops are padded into one (n_loops, n_points) matrix and every metric is computed in one batched call.
 
     Parameters:
     - split_v_data (list of lists): List containing split voltage arrays
     - split_c_data (list of lists): List containing split current arrays
 
-    Returns:
-    - ps_areas (list): List of PS areas for each split array
-    - ng_areas (list): List of NG areas for each split array
-    - areas (list): List of total areas for each split array
-    - normalized_areas (list): List of normalized areas for each split array
+    Returns (one value per loop, as arrays):
+    - ps_areas: PS areas for each split array
+    - ng_areas: NG areas for each split array
+    - areas: total areas for each split array
+    - normalized_areas: normalized areas for each split array
+    - ron, roff, von, voff: on/off resistances and voltages for each split array
     '''
+    v_matrix, c_matrix, lengths = stack_loops(split_v_data, split_c_data)
 
-    # Initialize lists to store_path the values for each metric
-    ps_areas = []
-    ng_areas = []
-    areas = []
-    normalized_areas = []
-    ron = []
-    roff = []
-    von = []
-    voff = []
-
-    # Loop through each split array
-    for idx in range(len(split_v_data)):
-        sub_v_array = split_v_data[idx]
-        sub_c_array = split_c_data[idx]
-
-        #print(sub_v_array)
-
-        # Call the area_under_curves function for the current split arrays
-        ps_area, ng_area, area, norm_area = area_under_curves(sub_v_array, sub_c_array)
-
-        # Append the values to their respective lists
-        ps_areas.append(ps_area)
-        ng_areas.append(ng_area)
-        areas.append(area)
-        normalized_areas.append(norm_area)
-
-        r_on, r_off, v_on, v_off = on_off_values(sub_v_array, sub_c_array)
-
-        ron.append(r_on)
-        roff.append(r_off)
-        von.append(v_on)
-        voff.append(v_off)
-
-        # Print the values for the current split array
-        # print(f"Metrics for split array {idx + 1}:")
-        # print(f"PS Area Enclosed: {ps_area}")
-        # print(f"NG Area Enclosed: {ng_area}")
-        # print(f"Total Area Enclosed: {area}")
-        # print(f"Normalized Area Enclosed: {norm_area}")
-        # print("------")
-
-    # Print the lists of values
-    # print("\nList of PS Areas:", ps_areas)
-    # print("List of NG Areas:", ng_areas)
-    # print("List of Total Areas:", areas)
-    # print("List of Normalized Areas:", normalized_areas)
+    ps_areas, ng_areas, areas, normalized_areas = area_under_curves_batch(v_matrix, c_matrix, lengths)
+    ron, roff, von, voff = on_off_values_batch(v_matrix, c_matrix, lengths)
 
     # Return the calculated metrics
     return ps_areas, ng_areas, areas, normalized_areas, ron, roff, von, voff
 
+
+def stack_loops(split_v_data, split_c_data):
+    '''
+    Pads a list of loops into (n_loops, n_points) float64 matrices, NaN after the end of each loop
+    :return: v_matrix, c_matrix, lengths
+    '''
+    lengths = np.array([len(v) for v in split_v_data], dtype=np.intp)
+    width = lengths.max() if lengths.size else 0
+    valid = np.arange(width) < lengths[:, None]
+
+    v_matrix = np.full((lengths.size, width), np.nan)
+    c_matrix = np.full((lengths.size, width), np.nan)
+    if lengths.size:
+        v_matrix[valid] = np.concatenate([np.asarray(v, dtype=np.float64) for v in split_v_data])
+        c_matrix[valid] = np.concatenate([np.asarray(c, dtype=np.float64) for c in split_c_data])
+    return v_matrix, c_matrix, lengths
+
+
+def _compact_rows(mask, *matrices):
+    '''
+    Moves the masked points of each row to the front, keeping their order.
+    :return: number of masked points per row, then the compacted matrices
+    '''
+    order = np.argsort(~mask, axis=1, kind='stable')
+    return (mask.sum(axis=1),) + tuple(np.take_along_axis(matrix, order, axis=1) for matrix in matrices)
+
+
+def _split_trapz(v_section, c_section, count, half):
+    '''
+    Trapezoid areas of the first half points and of the rest, for compacted rows of count points each.
+    Same as np.trapz on the two halves, the padded repeats of area_under_curves add nothing
+    '''
+    with np.errstate(invalid='ignore'):
+        terms = np.diff(v_section, axis=1) * (c_section[:, 1:] + c_section[:, :-1]) / 2.0
+    pair = np.arange(terms.shape[1])
+    first = pair + 1 < np.minimum(half, count)[:, None]
+    second = (pair >= half[:, None]) & (pair + 1 < count[:, None])
+    return np.where(first, terms, 0.0).sum(axis=1), np.where(second, terms, 0.0).sum(axis=1)
+
+
+def area_under_curves_batch(v_matrix, c_matrix, lengths):
+    '''
+    area_under_curves for every row of a loop matrix from stack_loops
+    :return: ps_area_enclosed, ng_area_enclosed, total_area_enclosed, normalized_area_enclosed (one per loop)
+    '''
+    valid = np.arange(v_matrix.shape[1]) < lengths[:, None]
+    v_max = np.max(v_matrix, axis=1, where=valid, initial=-np.inf)
+    v_min = np.min(v_matrix, axis=1, where=valid, initial=np.inf)
+
+    with np.errstate(invalid='ignore'):
+        positive = valid & (0 <= v_matrix) & (v_matrix <= v_max[:, None])
+        negative = valid & (v_min[:, None] <= v_matrix) & (v_matrix <= 0)
+    n_positive, v_positive, c_positive = _compact_rows(positive, v_matrix, c_matrix)
+    n_negative, v_negative, c_negative = _compact_rows(negative, v_matrix, c_matrix)
+
+    # Split both sections in two at half the longest one, as split_data_in_sect does
+    half = np.maximum(n_positive, n_negative) // 2
+    sect1_area, sect2_area = _split_trapz(v_positive, c_positive, n_positive, half)
+    sect3_area, sect4_area = _split_trapz(v_negative, c_negative, n_negative, half)
+
+    ps_area_enclosed = np.abs(sect1_area) - np.abs(sect2_area)
+    ng_area_enclosed = np.abs(sect4_area) - np.abs(sect3_area)
+    area_enclosed = ps_area_enclosed + ng_area_enclosed
+    with np.errstate(divide='ignore', invalid='ignore'):
+        norm_area_enclosed = area_enclosed / (np.abs(v_max) + np.abs(v_min))
+
+    # added nan check as causes issues later if not a value
+    return tuple(np.where(np.isnan(values), 0.0, values) for values in (ps_area_enclosed, ng_area_enclosed, area_enclosed, norm_area_enclosed))
+
+
+def on_off_values_batch(v_matrix, c_matrix, lengths):
+    '''
+    on_off_values for every row of a loop matrix from stack_loops, with the same last-match-wins tie breaking
+    :return: resistance_on_value, resistance_off_value, voltage_on_value, voltage_off_value (one per loop)
+    '''
+    n_loops, width = v_matrix.shape
+    rows = np.arange(n_loops)
+    valid = np.arange(width) < lengths[:, None]
+
+    # Get the maximum voltage value, or the minimum for negative only sweeps
+    max_voltage = np.round(np.max(v_matrix, axis=1, where=valid, initial=-np.inf), 1)
+    min_voltage = np.round(np.min(v_matrix, axis=1, where=valid, initial=np.inf), 1)
+    max_voltage = np.where(max_voltage == 0, np.abs(min_voltage), max_voltage)
+    threshold = np.round(0.2 * max_voltage, 2)[:, None]
+
+    # Resistance magnitudes of the non-zero points within the threshold
+    with np.errstate(invalid='ignore', divide='ignore'):
+        window = valid & (-threshold < v_matrix) & (v_matrix < threshold) & (v_matrix != 0) & (c_matrix != 0)
+        resistance_magnitudes = np.abs(v_matrix / c_matrix)
+    has_resistance = window.any(axis=1)
+    if not has_resistance.all():
+        print(f"Error: No valid resistance values found in {np.count_nonzero(~has_resistance)} loop(s).")
+    resistance_on_value = np.max(resistance_magnitudes, axis=1, where=window, initial=-np.inf)
+    resistance_off_value = np.min(resistance_magnitudes, axis=1, where=window, initial=np.inf)
+
+    # Gradients between neighbouring points of each loop, skipping steps with no change in voltage
+    dv = np.diff(v_matrix, axis=1)
+    dc = np.diff(c_matrix, axis=1)
+    step = valid[:, 1:] & (dv != 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gradients = dc / dv
+    # position of each gradient in the per-loop list of gradients
+    rank = np.cumsum(step, axis=1) - 1
+    n_gradients = step.sum(axis=1)
+    first_half = step & (rank < (n_gradients // 2)[:, None])
+    if np.any(has_resistance & ~first_half.any(axis=1)):
+        raise ValueError("max() arg is an empty sequence: not enough points in a loop to find the gradients")
+
+    max_gradient = np.max(gradients, axis=1, where=first_half, initial=-np.inf)
+    min_gradient = np.min(gradients, axis=1, where=step, initial=np.inf)
+
+    # The last matching gradient wins and its position in the gradient list indexes the voltage of the loop
+    off_rank = np.max(rank, axis=1, where=step & (gradients == max_gradient[:, None]), initial=-1)
+    on_rank = np.max(rank, axis=1, where=step & (gradients == min_gradient[:, None]), initial=-1)
+    voltage_off_value = np.where(off_rank >= 0, v_matrix[rows, np.maximum(off_rank, 0)], 0.0)
+    voltage_on_value = np.where(on_rank >= 0, v_matrix[rows, np.maximum(on_rank, 0)], 0.0)
+
+    # Loops without a valid resistance return zeros for everything
+    return tuple(np.where(has_resistance, values, 0.0)
+                 for values in (resistance_on_value, resistance_off_value, voltage_on_value, voltage_off_value))
+
 def area_under_curves(v_data, c_data):
     """
     only run this for an individual sweep
@@ -79,20 +159,20 @@ def area_under_curves(v_data, c_data):
     # finds v max and min
     v_max, v_min = bounds(v_data)
 
-    # creates dataframe of the sweep in sections
-    df_sections = split_data_in_sect(v_data, c_data, v_max, v_min)
+    # splits the sweep into sections
+    sections = split_data_in_sect(v_data, c_data, v_max, v_min)
 
     # calculate the area under the curve for each section
-    sect1_area = abs(area_under_curve(df_sections.get('voltage_ps_sect1'), df_sections.get('current_ps_sect1')))
-    sect2_area = abs(area_under_curve(df_sections.get('voltage_ps_sect2'), df_sections.get('current_ps_sect2')))
-    sect3_area = abs(area_under_curve(df_sections.get('voltage_ng_sect1'), df_sections.get('current_ng_sect1')))
-    sect4_area = abs(area_under_curve(df_sections.get('voltage_ng_sect2'), df_sections.get('current_ng_sect2')))
+    sect1_area = abs(area_under_curve(sections.get('voltage_ps_sect1'), sections.get('current_ps_sect1')))
+    sect2_area = abs(area_under_curve(sections.get('voltage_ps_sect2'), sections.get('current_ps_sect2')))
+    sect3_area = abs(area_under_curve(sections.get('voltage_ng_sect1'), sections.get('current_ng_sect1')))
+    sect4_area = abs(area_under_curve(sections.get('voltage_ng_sect2'), sections.get('current_ng_sect2')))
 
     # plot to show where each section is on the hysteresis
-    # plt.plot(df_sections.get('voltage_ps_sect1'), df_sections.get('current_ps_sect1'),color="blue" )
-    # plt.plot(df_sections.get('voltage_ps_sect2'), df_sections.get('current_ps_sect2'),color="green")
-    # plt.plot(df_sections.get('voltage_ng_sect1'), df_sections.get('current_ng_sect1'),color="red")
-    # plt.plot(df_sections.get('voltage_ng_sect2'), df_sections.get('current_ng_sect2'),color="yellow")
+    # plt.plot(sections.get('voltage_ps_sect1'), sections.get('current_ps_sect1'),color="blue" )
+    # plt.plot(sections.get('voltage_ps_sect2'), sections.get('current_ps_sect2'),color="green")
+    # plt.plot(sections.get('voltage_ng_sect1'), sections.get('current_ng_sect1'),color="red")
+    # plt.plot(sections.get('voltage_ng_sect2'), sections.get('current_ng_sect2'),color="yellow")
     # #plt.legend()
     # plt.show()
     # plt.pause(0.1)
@@ -121,133 +201,93 @@ def on_off_values(voltage_data, current_data):
     """
     Calculates r on off and v on off values for an individual device
     """
-    # Convert DataFrame columns to lists
-    voltage_data = voltage_data.to_numpy()
-    current_data = current_data.to_numpy()
-    # Initialize lists to store_path Ron and Roff values
-    resistance_on_value = []
-    resistance_off_value = []
+    # Accepts Series or arrays
+    voltage_data = np.asarray(voltage_data)
+    current_data = np.asarray(current_data)
     # Initialize default values for on and off voltages
     voltage_on_value = 0
     voltage_off_value = 0
 
     # Get the maximum voltage value
-    max_voltage = round(max(voltage_data), 1)
+    max_voltage = round(np.max(voltage_data), 1)
     # Catch edge case for just negative sweep only
     if max_voltage == 0:
-        max_voltage = abs(round(min(voltage_data), 1))
+        max_voltage = abs(round(np.min(voltage_data), 1))
 
     # Set the threshold value to 0.2 times the maximum voltage
     threshold = round(0.2 * max_voltage, 2)
-    # print("threshold,max_voltage")
-    # print(threshold,max_voltage)
-    # print(len(voltage_data))
-    # print(voltage_data)
-
-    # Filter the voltage and current data_analyzer.py to include values within the threshold
-    filtered_voltage = []
-    filtered_current = []
-    for index in range(len(voltage_data)):
-        #print(index)
-        if -threshold < voltage_data[index] < threshold:
-            filtered_voltage.append(voltage_data[index])
-            filtered_current.append(current_data[index])
-    # print(filtered_voltage)
-
-    resistance_magnitudes = []
-    for idx in range(len(filtered_voltage)):
-        if filtered_voltage[idx] != 0 and filtered_current[idx] != 0:
-            resistance_magnitudes.append(abs(filtered_voltage[idx] / filtered_current[idx]))
-
-    if not resistance_magnitudes:
+
+    # Resistance magnitudes of the non-zero points within the threshold
+    in_window = (-threshold < voltage_data) & (voltage_data < threshold)
+    valid = in_window & (voltage_data != 0) & (current_data != 0)
+    resistance_magnitudes = np.abs(voltage_data[valid] / current_data[valid])
+
+    if resistance_magnitudes.size == 0:
         # Handle the case when the list is empty, e.g., set default values or raise an exception.
         print("Error: No valid resistance values found.")
         return 0, 0, 0, 0
 
-    # # Calculate the resistance magnitude for each filtered data_analyzer.py point
-    # resistance_magnitudes = []
-    # for idx in range(len(filtered_voltage)):
-    #     if filtered_voltage[idx] != 0:
-    #         resistance_magnitudes.append(abs(filtered_voltage[idx] / filtered_current[idx]))
-    # print(resistance_magnitudes)
     # Store the minimum and maximum resistance values
-    resistance_off_value = min(resistance_magnitudes)
-    resistance_on_value = max(resistance_magnitudes)
+    resistance_off_value = np.min(resistance_magnitudes)
+    resistance_on_value = np.max(resistance_magnitudes)
 
-    # Calculate the gradients for each data_analyzer.py point
-    gradients = []
-    for idx in range(len(voltage_data)):
-        if idx != len(voltage_data) - 1:
-            if voltage_data[idx + 1] - voltage_data[idx] != 0:
-                gradients.append(
-                    (current_data[idx + 1] - current_data[idx]) / (voltage_data[idx + 1] - voltage_data[idx]))
+    # Gradients between neighbouring points, skipping steps with no change in voltage
+    dv = np.diff(voltage_data)
+    dc = np.diff(current_data)
+    step = dv != 0
+    gradients = dc[step] / dv[step]
 
     # Find the maximum and minimum gradient values
-    max_gradient = max(gradients[:(int(len(gradients) / 2))])
-    min_gradient = min(gradients)
-
-    # Use the maximum and minimum gradient values to determine the on and off voltages
-    for idx in range(len(gradients)):
-        if gradients[idx] == max_gradient:
-            voltage_off_value = voltage_data[idx]
-        if gradients[idx] == min_gradient:
-            voltage_on_value = voltage_data[idx]
+    max_gradient = np.max(gradients[:gradients.size // 2])
+    min_gradient = np.min(gradients)
+
+    # Use the maximum and minimum gradient values to determine the on and off voltages.
+    # The last matching gradient wins and, as before, its position in the gradient list indexes voltage_data
+    max_matches = np.flatnonzero(gradients == max_gradient)
+    if max_matches.size:
+        voltage_off_value = voltage_data[max_matches[-1]]
+    min_matches = np.flatnonzero(gradients == min_gradient)
+    if min_matches.size:
+        voltage_on_value = voltage_data[min_matches[-1]]
 
     # Return the calculated Ron and Roff values and on and off voltages
     return resistance_on_value, resistance_off_value, voltage_on_value, voltage_off_value
 
-def split_data_in_sect(voltage, current, v_max, v_min):
-    # splits the data_analyzer.py into sections and clculates the area under the curve for how "memeristive" a device is.
-    zipped_data = list(zip(voltage, current))
-
-    positive = [(v, c) for v, c in zipped_data if 0 <= v <= v_max]
-    negative = [(v, c) for v, c in zipped_data if v_min <= v <= 0]
-
-    # Find the maximum length among the four sections
-    max_len = max(len(positive), len(negative))
-
-    # Split positive section into two equal parts
-    positive1 = positive[:max_len // 2]
-    positive2 = positive[max_len // 2:]
+def _pad_section(section, length):
+    """ Pads a section up to length by repeating its last value, or with zeros if it is empty """
+    if section.size == length:
+        return section
+    fill = section[-1] if section.size else 0
+    return np.concatenate((section, np.full(length - section.size, fill, dtype=section.dtype)))
 
-    # Split negative section into two equal parts
-    negative3 = negative[:max_len // 2]
-    negative4 = negative[max_len // 2:]
 
-    # Find the maximum length among the four sections
-    max_len = max(len(positive1), len(positive2), len(negative3), len(negative4))
-
-    # Calculate the required padding for each section
-    pad_positive1 = max_len - len(positive1)
-    pad_positive2 = max_len - len(positive2)
-    pad_negative3 = max_len - len(negative3)
-    pad_negative4 = max_len - len(negative4)
-
-    # Limit the padding to the length of the last value for each section
-    last_positive1 = positive1[-1] if positive1 else (0, 0)
-    last_positive2 = positive2[-1] if positive2 else (0, 0)
-    last_negative3 = negative3[-1] if negative3 else (0, 0)
-    last_negative4 = negative4[-1] if negative4 else (0, 0)
+def split_data_in_sect(voltage, current, v_max, v_min):
+    # splits the data_analyzer.py into sections and clculates the area under the curve for how "memeristive" a device is.
+    # Works on array slices, the sections are views into the positive/negative points until they need padding
+    voltage = np.asarray(voltage, dtype=np.float64)
+    current = np.asarray(current, dtype=np.float64)
 
-    positive1 += [last_positive1] * pad_positive1
-    positive2 += [last_positive2] * pad_positive2
-    negative3 += [last_negative3] * pad_negative3
-    negative4 += [last_negative4] * pad_negative4
+    positive = (0 <= voltage) & (voltage <= v_max)
+    negative = (v_min <= voltage) & (voltage <= 0)
+    v_positive, c_positive = voltage[positive], current[positive]
+    v_negative, c_negative = voltage[negative], current[negative]
 
-    # Create DataFrame for device
+    # Split both sections in two at half the longest one
+    half = max(v_positive.size, v_negative.size) // 2
     sections = {
-        'voltage_ps_sect1': [v for v, _ in positive1],
-        'current_ps_sect1': [c for _, c in positive1],
-        'voltage_ps_sect2': [v for v, _ in positive2],
-        'current_ps_sect2': [c for _, c in positive2],
-        'voltage_ng_sect1': [v for v, _ in negative3],
-        'current_ng_sect1': [c for _, c in negative3],
-        'voltage_ng_sect2': [v for v, _ in negative4],
-        'current_ng_sect2': [c for _, c in negative4],
+        'voltage_ps_sect1': v_positive[:half],
+        'current_ps_sect1': c_positive[:half],
+        'voltage_ps_sect2': v_positive[half:],
+        'current_ps_sect2': c_positive[half:],
+        'voltage_ng_sect1': v_negative[:half],
+        'current_ng_sect1': c_negative[:half],
+        'voltage_ng_sect2': v_negative[half:],
+        'current_ng_sect2': c_negative[half:],
     }
 
-    df_sections = pd.DataFrame(sections)
-    return df_sections
+    # Pad every section to the longest one by repeating its last point, (0, 0) for an empty section
+    max_len = max(section.size for section in sections.values())
+    return {name: _pad_section(section, max_len) for name, section in sections.items()}
 
 def area_under_curve(voltage, current):
     """
@@ -255,8 +295,8 @@ def area_under_curve(voltage, current):
     """
 
     # print(voltage,current)
-    voltage = np.array(voltage)
-    current = np.array(current)
+    voltage = np.asarray(voltage)
+    current = np.asarray(current)
     # Calculate the area under the curve using the trapezoidal rule
     area = np.trapz(current, voltage)
     # which ever is in np.trapz(y,x), Using a decreasing x corresponds to integrating in reverse: ie negative value?
@@ -0,0 +1,200 @@
+import numpy as np
+import pytest
+
+import equations
+from equations import RAW_DATA_COLUMNS, DERIVED_COLUMNS, derived_columns
+
+""" Parity of the vectorized equations with the list based implementations they replaced """
+
+
+# Reference implementations, as they were before vectorization
+
+def ref_absolute_val(col):
+    return [abs(x) for x in col]
+
+
+def ref_filter_positive_values(v_data, c_data):
+    result_voltage_ps, result_current_ps = [], []
+    for v, c in zip(v_data, c_data):
+        if v >= 0:
+            result_voltage_ps.append(v)
+            result_current_ps.append(c)
+        else:
+            result_voltage_ps.append(0)
+            result_current_ps.append(0)
+    return result_voltage_ps, result_current_ps
+
+
+def ref_filter_negative_values(v_data, c_data):
+    result_voltage_ng, result_current_ng = [], []
+    for v, c in zip(v_data, c_data):
+        if v <= 0:
+            result_voltage_ng.append(v)
+            result_current_ng.append(c)
+        else:
+            result_voltage_ng.append(0)
+            result_current_ng.append(0)
+    return ref_absolute_val(result_voltage_ng), ref_absolute_val(result_current_ng)
+
+
+def ref_zero_devision_check(x, y):
+    try:
+        return x / y
+    except ZeroDivisionError:
+        return 0
+
+
+def ref_resistance(v_data, c_data):
+    return [ref_zero_devision_check(v, c) for v, c in zip(v_data, c_data)]
+
+
+def ref_log_value(array):
+    return [np.log(abs(x)) if x != 0 else 0 for x in array]
+
+
+def ref_current_density_eq(v_data, c_data, distance=100E-9, area=100E-6):
+    current_density = []
+    for v, c in zip(v_data, c_data):
+        if v == 0 or c == 0:
+            current_density.append(0)
+            continue
+        new_num = (distance / ((v / c) * area ** 2)) * (v / distance)
+        current_density.append(new_num)
+    return current_density
+
+
+def ref_electric_field_eq(v_data, distance=100E-9):
+    return [v / distance if v != 0 else 0 for v in v_data]
+
+
+def ref_inverse_resistance_eq(v_data, c_data):
+    return [c / v if v != 0 and c != 0 else 0 for v, c in zip(v_data, c_data)]
+
+
+def ref_sqrt_array(value_array):
+    return [v ** 0.5 for v in value_array]
+
+
+def ref_raw_data_columns(v_data, c_data):
+    """ The raw_data columns as create_device_dataframe built them from the functions above """
+    v_data_ps, c_data_ps = ref_filter_positive_values(v_data, c_data)
+    v_data_ng, c_data_ng = ref_filter_negative_values(v_data, c_data)
+    return {
+        'voltage': v_data,
+        'current': c_data,
+        'abs_current': ref_absolute_val(c_data),
+        'resistance': ref_resistance(v_data, c_data),
+        'voltage_ps': v_data_ps,
+        'current_ps': c_data_ps,
+        'voltage_ng': v_data_ng,
+        'current_ng': c_data_ng,
+        'log_Resistance': ref_log_value(ref_resistance(v_data, c_data)),
+        'abs_Current_ps': ref_absolute_val(c_data_ps),
+        'abs_Current_ng': ref_absolute_val(c_data_ng),
+        'current_Density_ps': ref_current_density_eq(v_data_ps, c_data_ps),
+        'current_Density_ng': ref_current_density_eq(v_data_ng, c_data_ng),
+        'electric_field_ps': ref_electric_field_eq(v_data_ps),
+        'electric_field_ng': ref_electric_field_eq(v_data_ng),
+        'inverse_resistance_ps': ref_inverse_resistance_eq(v_data_ps, c_data_ps),
+        'inverse_resistance_ng': ref_inverse_resistance_eq(v_data_ng, c_data_ng),
+        'sqrt_Voltage_ps': ref_sqrt_array(v_data_ps),
+        'sqrt_Voltage_ng': ref_sqrt_array(v_data_ng),
+    }
+
+
+def sweep(points=401, seed=0):
+    """ Triangle sweep 0 -> 1 -> -1 -> 0 V with noisy currents, zero current points and a 0 V point with current """
+    rng = np.random.default_rng(seed)
+    v = np.round(np.concatenate((np.linspace(0, 1, points // 4), np.linspace(1, -1, points // 2),
+                                 np.linspace(-1, 0, points - points // 4 - points // 2))), 3)
+    c = 1e-6 * v + rng.normal(scale=1e-8, size=v.size)
+    c[::17] = 0.0
+    c[0] = 0.0
+    c[v.size // 2] = 3e-9
+    return v.tolist(), c.tolist()
+
+
+CASES = {
+    'sweep': sweep(),
+    'zero voltage': ([0.0, 0.0, -0.0, 0.0], [1e-6, -2e-6, 3e-9, 0.0]),
+    'zero current': ([0.5, -0.5, 0.0, 1.0], [0.0, 0.0, 0.0, -0.0]),
+    'mixed': ([0.0, 0.1, -0.1, 0.2, -0.0, 3.0, -3.0], [0.0, 1e-7, 0.0, -2e-7, 5e-7, 1e-3, -1e-3]),
+    'empty': ([], []),
+}
+
+
+def assert_parity(actual, expected):
+    actual = np.asarray(actual)
+    assert actual.dtype == np.float64
+    np.testing.assert_array_equal(actual, np.asarray(expected, dtype=np.float64))
+
+
+@pytest.fixture(params=list(CASES))
+def data(request):
+    return CASES[request.param]
+
+
+def test_absolute_val(data):
+    assert_parity(equations.absolute_val(data[1]), ref_absolute_val(data[1]))
+
+
+def test_filter_positive_values(data):
+    for actual, expected in zip(equations.filter_positive_values(*data), ref_filter_positive_values(*data)):
+        assert_parity(actual, expected)
+
+
+def test_filter_negative_values(data):
+    for actual, expected in zip(equations.filter_negative_values(*data), ref_filter_negative_values(*data)):
+        assert_parity(actual, expected)
+
+
+def test_resistance(data):
+    assert_parity(equations.resistance(*data), ref_resistance(*data))
+
+
+def test_log_value(data):
+    values = ref_resistance(*data)
+    assert_parity(equations.log_value(values), ref_log_value(values))
+
+
+def test_current_density_eq(data):
+    for side in (ref_filter_positive_values(*data), ref_filter_negative_values(*data)):
+        assert_parity(equations.current_density_eq(*side), ref_current_density_eq(*side))
+
+
+def test_electric_field_eq(data):
+    assert_parity(equations.electric_field_eq(data[0]), ref_electric_field_eq(data[0]))
+
+
+def test_inverse_resistance_eq(data):
+    for side in (data, ref_filter_positive_values(*data), ref_filter_negative_values(*data)):
+        assert_parity(equations.inverse_resistance_eq(*side), ref_inverse_resistance_eq(*side))
+
+
+def test_sqrt_array(data):
+    for side in (ref_filter_positive_values(*data), ref_filter_negative_values(*data)):
+        assert_parity(equations.sqrt_array(side[0]), ref_sqrt_array(side[0]))
+
+
+def test_inputs_are_not_modified():
+    v, c = np.array(CASES['mixed'][0]), np.array(CASES['mixed'][1])
+    v_copy, c_copy = v.copy(), c.copy()
+    derived_columns(v, c)
+    equations.filter_negative_values(v, c)
+    np.testing.assert_array_equal(v, v_copy)
+    np.testing.assert_array_equal(c, c_copy)
+
+
+def test_derived_columns(data):
+    block = derived_columns(*data)
+    expected = ref_raw_data_columns(*data)
+    assert block.shape == (len(RAW_DATA_COLUMNS), len(data[0]))
+    for row, name in zip(block, RAW_DATA_COLUMNS):
+        assert_parity(row, expected[name])
+
+
+def test_derived_columns_one_by_one(data):
+    expected = ref_raw_data_columns(*data)
+    assert list(DERIVED_COLUMNS) == list(RAW_DATA_COLUMNS)
+    for name, column in DERIVED_COLUMNS.items():
+        assert_parity(column(*data), expected[name])
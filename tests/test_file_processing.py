@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from file_processing import create_device_dataframe, handle_multiple_sweeps, file_analysis, parse_sweep_text, \
+    read_sweep
+
+# one 0 -> 1 -> -1 -> 0 V loop
+LOOP = np.round(np.concatenate((np.linspace(0, 1, 11), np.linspace(0.9, -1, 20), np.linspace(-0.9, 0, 10))), 2)
+
+# file_stats column of a multi-loop file -> the column of a single sweep it averages
+AVERAGED_COLUMNS = {'ps_area_avg': 'ps_area', 'ng_area_avg': 'ng_area', 'areas_avg': 'area',
+                    'normalized_areas_avg': 'normalized_area', 'resistance_on_value': 'resistance_on_value',
+                    'resistance_off_value': 'resistance_off_value', 'ON_OFF_Ratio': 'ON_OFF_Ratio',
+                    'voltage_on_value': 'voltage_on_value', 'voltage_off_value': 'voltage_off_value'}
+
+
+def loops(currents):
+    """ Two 0 -> 1 -> -1 -> 0 V loops with the given current function, and their loop bounds """
+    v = np.concatenate((LOOP, LOOP))
+    df = create_device_dataframe(pd.Series(v), pd.Series(currents(v)))
+    return df, np.array([[0, v.size // 2], [v.size // 2, v.size]])
+
+
+def test_multiple_sweeps_on_off_ratio():
+    df, loop_bounds = loops(lambda v: 1e-6 * v)
+    file_stats, _, df_file_stats = handle_multiple_sweeps(df, loop_bounds, None, None, False, False)
+    assert file_stats['ON_OFF_Ratio'] == file_stats['resistance_on_value'] / file_stats['resistance_off_value']
+
+
+def test_multiple_sweeps_without_valid_resistance():
+    # no current below the threshold voltage: every loop has zero on/off resistances, the ratio is 0 not NaN
+    df, loop_bounds = loops(lambda v: np.where(np.abs(v) < 0.2, 0.0, 1e-6 * v))
+    file_stats, _, df_file_stats = handle_multiple_sweeps(df, loop_bounds, None, None, False, False)
+    assert file_stats['resistance_off_value'] == 0
+    assert file_stats['ON_OFF_Ratio'] == 0
+    assert df_file_stats['ON_OFF_Ratio'].tolist() == [0.0]
+
+
+def analyse(v):
+    """ file_stats of a sweep file with the given voltages, through loop detection as main.py runs it """
+    # more current on the way up, so the loops have an area
+    i = 1e-6 * v * np.where(np.gradient(v) > 0, 2.0, 1.0)
+    df_file_stats, _ = file_analysis(pd.DataFrame({'voltage': v, 'current': i}), False, False, None, False, None, None)
+    return df_file_stats.iloc[0]
+
+
+@pytest.mark.parametrize('n_loops', [2, 3, 5])
+def test_identical_loops_average_to_single_sweep(n_loops):
+    single = analyse(LOOP)
+    stats = analyse(np.tile(LOOP, n_loops))
+    for column, single_column in AVERAGED_COLUMNS.items():
+        assert stats[column] == pytest.approx(single[single_column], rel=1e-12), column
+
+
+# the same five point sweep in each layout a sweep file comes in
+SWEEP_V = [0.0, 0.1, 0.2, 0.1, 0.0]
+SWEEP_I = [0.0, 1e-6, 2e-6, 1e-6, 0.0]
+SWEEP_ROWS = [f'{v} {i}' for v, i in zip(SWEEP_V, SWEEP_I)]
+SWEEP_FILES = {
+    'named header': ('voltage current', SWEEP_ROWS, ['voltage', 'current']),
+    'named header with time': ('Voltage Current Time', [f'{row} {t}' for t, row in enumerate(SWEEP_ROWS)],
+                               ['voltage', 'current', 'time']),
+    'tool export header': ('VSOURC - Plot 0\tIMEAS - Plot 0', [row.replace(' ', '\t') for row in SWEEP_ROWS],
+                           ['voltage', 'current']),
+    'no header': (None, SWEEP_ROWS, ['voltage', 'current']),
+    'no header with time': (None, [f'{row} {t}' for t, row in enumerate(SWEEP_ROWS)], ['voltage', 'current', 'time']),
+}
+
+
+def sweep_text(header, rows):
+    return '\n'.join(([header] if header else []) + rows) + '\n'
+
+
+@pytest.mark.parametrize('header, rows, names', SWEEP_FILES.values(), ids=SWEEP_FILES.keys())
+def test_parse_sweep_text(header, rows, names):
+    columns = parse_sweep_text(sweep_text(header, rows))
+    assert list(columns) == names
+    assert columns['voltage'].tolist() == SWEEP_V
+    assert columns['current'].tolist() == SWEEP_I
+    assert all(values.dtype == np.float64 for values in columns.values())
+
+
+@pytest.mark.parametrize('header, rows, names', SWEEP_FILES.values(), ids=SWEEP_FILES.keys())
+def test_read_sweep(tmp_path, header, rows, names):
+    path = tmp_path / 'sweep.txt'
+    path.write_text(sweep_text(header, rows))
+    sweep_type, columns, skip_reason = read_sweep(path)
+    if header is None and len(names) > 2:
+        # headerless files are only taken for IV sweeps with two columns
+        assert (sweep_type, columns, skip_reason) == (None, None, 'unknown sweep type')
+    else:
+        assert (sweep_type, list(columns), skip_reason) == ('Iv_sweep', names, None)
+
+
+def test_parse_sweep_text_unparseable_rows():
+    # text in the body and a row without a current value send the file to pandas, those rows are dropped
+    rows = SWEEP_ROWS[:2] + ['0.15 oops', '0.25'] + SWEEP_ROWS[2:]
+    columns = parse_sweep_text(sweep_text('voltage current', rows))
+    assert list(columns) == ['voltage', 'current']
+    assert columns['voltage'].tolist() == SWEEP_V
+    assert columns['current'].tolist() == SWEEP_I
+
+    # and a body of nothing but text leaves no rows
+    columns = parse_sweep_text(sweep_text('voltage current', ['a b', 'c d']))
+    assert [values.size for values in columns.values()] == [0, 0]
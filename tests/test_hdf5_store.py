@@ -0,0 +1,217 @@
+import importlib.util
+import inspect
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+
+import file_processing
+import helpers as v1_helpers
+from file_processing import HDF5Writer, HDF5WriterProcess, create_device_dataframe, save_to_hdf5, put_message
+from hdf5_reader import HDF5Reader, CATALOG_KEY, SUMMARY_KEY
+from helpers import UNKNOWN_CLASSIFICATION, PER_FILE_FORMAT, CONSOLIDATED_FORMAT, dataframe_to_structured_array, \
+    generate_hdf5_keys
+
+""" Round trips through HDF5Writer and HDF5Reader """
+
+LAYOUTS = [PER_FILE_FORMAT, CONSOLIDATED_FORMAT]
+
+
+def v2_helpers():
+    """ helpers.py of the v2 folder, which is not a package """
+    path = Path(__file__).resolve().parents[1] / 'v2.0_errors_not_sure_why' / 'helpers.py'
+    spec = importlib.util.spec_from_file_location('v2_helpers', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def sweep(filename, classification, points=50):
+    """ keys, file_stats and raw_data DataFrames of one sweep file, as file_analysis and main.py build them """
+    v = pd.Series(np.round(np.sin(np.linspace(0, 2 * np.pi, points)), 3))
+    df_raw_data = create_device_dataframe(v, 1e-6 * v)
+    df_raw_data['classification'] = classification
+    df_file_stats = pd.DataFrame([{'resistance_on_value': 2.0, 'resistance_off_value': 1.0}])
+    key_file_stats, key_raw_data = generate_hdf5_keys('PMMA', 'D1', 'A', '1', filename)
+    return key_file_stats, key_raw_data, df_file_stats, df_raw_data
+
+
+def test_v2_encoding_matches_v1():
+    # v2 keeps its own copy of the classification and string encoding, which must store the same codes and types
+    v2 = v2_helpers()
+    for name in ('CLASSIFICATIONS', 'UNKNOWN_CLASSIFICATION', 'FIXED_STRING_MAX_BYTES'):
+        assert getattr(v2, name) == getattr(v1_helpers, name), name
+    assert h5py.check_enum_dtype(v2.CLASSIFICATION_DTYPE) == h5py.check_enum_dtype(v1_helpers.CLASSIFICATION_DTYPE)
+    for name in ('encode_classification', 'classification_codes', 'decode_classification', 'encode_strings'):
+        assert inspect.getsource(getattr(v2, name)) == inspect.getsource(getattr(v1_helpers, name)), name
+
+
+@pytest.mark.parametrize('helpers', [pytest.param(None, id='v1'), pytest.param(v2_helpers(), id='v2')])
+def test_classification_codes(helpers):
+    convert = helpers.dataframe_to_structured_array if helpers else dataframe_to_structured_array
+    # a blank Excel cell gives a NaN classification, which must not become code 0 (Memristive)
+    numeric = pd.DataFrame({'classification': [np.nan, 0.0, 5.0, 7.0, -2.0, 1.5]})
+    labels = pd.DataFrame({'classification': ['Ohmic', None, np.nan, 'Memristive', 'nonsense']})
+    assert convert(numeric)['classification'].view(np.int8).tolist() == [-1, 0, 5, -1, -1, -1]
+    assert convert(labels)['classification'].view(np.int8).tolist() == [5, -1, -1, 0, -1]
+
+
+@pytest.mark.parametrize('format_version', LAYOUTS)
+def test_nan_classification_round_trip(tmp_path, format_version):
+    path = tmp_path / 'store.h5'
+    unclassified = sweep('1-FS.txt', np.nan)
+    memristive = sweep('2-FS.txt', 'Memristive')
+    with HDF5Writer(path, format_version=format_version) as writer:
+        writer.save(*unclassified)
+        writer.save(*memristive)
+
+    with HDF5Reader(path) as store:
+        assert (store.read(unclassified[1])['classification'].view(np.int8) == UNKNOWN_CLASSIFICATION).all()
+        assert store.read_frame(unclassified[1])['classification'].isna().all()
+        assert (store.read_frame(memristive[1])['classification'] == 'Memristive').all()
+        assert store.find(classification='Memristive') == [memristive[1]]
+        assert store.catalog().set_index('key').loc[unclassified[1], 'classification'] != 'Memristive'
+
+
+@pytest.mark.parametrize('format_version', LAYOUTS)
+def test_read_frame_columns(tmp_path, format_version):
+    path = tmp_path / 'store.h5'
+    key_file_stats, key_raw_data, df_file_stats, df_raw_data = sweep('1-FS.txt', 'Ohmic')
+    with HDF5Writer(path, format_version=format_version) as writer:
+        writer.save(key_file_stats, key_raw_data, df_file_stats, df_raw_data)
+
+    with HDF5Reader(path) as store:
+        frame = store.read_frame(key_raw_data, metadata=False, columns=['resistance', 'voltage'])
+        assert list(frame) == ['resistance', 'voltage']
+        np.testing.assert_array_equal(frame['resistance'], df_raw_data['resistance'])
+        # no columns still gives the rows of the key
+        assert store.read_frame(key_file_stats, metadata=False, columns=[]).shape == (1, 0)
+        with pytest.raises(KeyError):
+            store.read_frame(key_file_stats, columns=['ps_area'])
+
+
+def test_manifest_records_skipped_sources(tmp_path):
+    path = tmp_path / 'store.h5'
+    stored, skipped = tmp_path / '1-FS.txt', tmp_path / '2-FS.txt'
+    stored.write_text('1 2\n')
+    skipped.write_text('not a sweep\n')
+    key_file_stats, key_raw_data, df_file_stats, df_raw_data = sweep(stored.name, 'Ohmic')
+    skipped_keys = generate_hdf5_keys('PMMA', 'D1', 'A', '1', skipped.name)
+    with HDF5Writer(path) as writer:
+        writer.save(key_file_stats, key_raw_data, df_file_stats, df_raw_data)
+        writer.record_source((key_file_stats, key_raw_data), stored)
+        writer.record_source(skipped_keys, skipped, skip_reason='Unknown sweep type')
+
+    with HDF5Writer(path) as writer:
+        assert writer.source_unchanged(key_file_stats, stored)
+        # skipped sources count as up to date without holding any data
+        assert writer.source_unchanged(skipped_keys[0], skipped)
+        assert skipped_keys[0] not in writer
+        skipped.write_text('1 2\n3 4\n')
+        assert not writer.source_unchanged(skipped_keys[0], skipped)
+        # only the keys that held data are reported as removed
+        assert writer.prune_sources([]) == [key_file_stats, key_raw_data]
+        assert not writer.source_unchanged(skipped_keys[0], skipped)
+
+
+def table_rows(path, table='raw_data'):
+    with h5py.File(path, 'r') as f:
+        return {column.shape[0] for column in f[f'/PMMA/D1/{table}'].values()}.pop()
+
+
+def test_consolidated_rewrite_does_not_grow_tables(tmp_path):
+    path = tmp_path / 'store.h5'
+    first, second = sweep('1-FS.txt', 'Ohmic'), sweep('2-FS.txt', 'Ohmic', points=80)
+    with HDF5Writer(path, format_version=CONSOLIDATED_FORMAT) as writer:
+        writer.save(*first)
+        writer.save(*second)
+    rows = table_rows(path), table_rows(path, 'file_stats')
+
+    # the same keys saved again, as a FORCE_RECALCULATE run does, overwrite their rows
+    changed = sweep('1-FS.txt', 'Memristive')
+    for _ in range(3):
+        with HDF5Writer(path, format_version=CONSOLIDATED_FORMAT) as writer:
+            writer.save(*changed)
+            writer.save(*second)
+        assert (table_rows(path), table_rows(path, 'file_stats')) == rows
+    with HDF5Reader(path) as store:
+        np.testing.assert_array_equal(store.read(changed[1]), dataframe_to_structured_array(changed[3]))
+
+    # another length, and removed keys, leave rows behind that are dropped on close
+    longer = sweep('1-FS.txt', 'Capacitive', points=120)
+    with HDF5Writer(path, format_version=CONSOLIDATED_FORMAT) as writer:
+        writer.save(*longer)
+    assert table_rows(path) == 120 + 80
+    with HDF5Writer(path, format_version=CONSOLIDATED_FORMAT) as writer:
+        writer.remove(longer[0])
+        writer.remove(longer[1])
+    assert (table_rows(path), table_rows(path, 'file_stats')) == (80, 1)
+
+    with HDF5Reader(path) as store:
+        assert sorted(store.keys()) == sorted(second[:2])
+        np.testing.assert_array_equal(store.read(second[1]), dataframe_to_structured_array(second[3]))
+        np.testing.assert_array_equal(store.read(second[0]), dataframe_to_structured_array(second[2]))
+
+
+def tables(path):
+    with HDF5Reader(path) as store:
+        return store.catalog().set_index('key'), store.summary().set_index('key')
+
+
+@pytest.mark.parametrize('format_version', LAYOUTS)
+def test_save_to_hdf5_appends_table_rows(tmp_path, format_version, monkeypatch):
+    path, expected = tmp_path / 'store.h5', tmp_path / 'expected.h5'
+    first, second, third = sweep('1-FS.txt', 'Ohmic'), sweep('2-FS.txt', 'Memristive'), sweep('3-FS.txt', 'Capacitive')
+    rewritten = sweep('2-FS.txt', 'Ohmic', points=80)
+    with HDF5Writer(path, format_version=format_version) as writer:
+        writer.save(*first)
+        writer.save(*second)
+    with HDF5Writer(expected, format_version=format_version) as writer:
+        for saved in (first, rewritten, third):
+            writer.save(*saved)
+
+    # each call only adds the rows of its file, the stored tables are never read or scanned
+    monkeypatch.setattr(file_processing, 'load_summary', None)
+    monkeypatch.setattr(file_processing, 'scan_summary', None)
+    save_to_hdf5(path, *third)
+    save_to_hdf5(path, *rewritten)
+    with h5py.File(path, 'r') as store:
+        assert len(store[CATALOG_KEY]) == len(store[SUMMARY_KEY]) == 4
+    for table, expected_table in zip(tables(path), tables(expected)):
+        pd.testing.assert_frame_equal(table.sort_index(), expected_table.sort_index())
+
+    # a store saved without the tables is left without them, the next writer session builds them once
+    with h5py.File(path, 'a') as store:
+        del store[CATALOG_KEY], store[SUMMARY_KEY]
+    save_to_hdf5(path, *first)
+    with h5py.File(path, 'r') as store:
+        assert CATALOG_KEY not in store and SUMMARY_KEY not in store
+    monkeypatch.undo()
+    with HDF5Writer(path):
+        pass
+    with h5py.File(path, 'r') as store:
+        assert len(store[CATALOG_KEY]) == len(store[SUMMARY_KEY]) == 3
+    for table, expected_table in zip(tables(path), tables(expected)):
+        pd.testing.assert_frame_equal(table.sort_index(), expected_table.sort_index())
+
+
+def test_writer_process_restores_sequence_order(tmp_path):
+    path, expected = tmp_path / 'store.h5', tmp_path / 'expected.h5'
+    # the last file rewrites the key of the first, so the order they are applied in shows in the store
+    saved = [sweep(f'{n}-FS.txt', 'Ohmic', points=40 + n) for n in range(3)] + [sweep('0-FS.txt', 'Memristive')]
+    with HDF5Writer(expected) as writer:
+        for keys_and_frames in saved:
+            writer.save(*keys_and_frames)
+
+    with HDF5WriterProcess(path) as writer:
+        sequences = [writer.next_sequence() for _ in saved]
+        # workers finishing in reverse order, each sending its own results
+        for sequence, keys_and_frames in reversed(list(zip(sequences, saved))):
+            put_message(*writer.worker_args(), (sequence, [('save', keys_and_frames)]))
+
+    with HDF5Reader(path) as store, HDF5Reader(expected) as expected_store:
+        assert sorted(store.keys()) == sorted(expected_store.keys())
+        for key in expected_store.keys():
+            np.testing.assert_array_equal(store.read(key), expected_store.read(key))
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from file_processing import file_analysis, split_loops
+from helpers import check_for_loops
+from metrics_calculation import area_under_curves, on_off_values, calculate_metrics_for_loops
+
+""" Loop detection of check_for_loops, checked through the metrics file_analysis stores """
+
+# 0 -> +1 -> 0 -> -1 -> 0 V in 0.1 V steps, 41 samples
+LOOP = np.round(np.concatenate((np.linspace(0, 1, 11), np.linspace(0.9, 0, 10), np.linspace(-0.1, -1, 10),
+                                np.linspace(-0.9, 0, 10))), 2)
+
+
+def current(v):
+    """ Current of a device with a lower resistance while the voltage goes up, so every metric is non zero """
+    return 1e-6 * v * np.where(np.gradient(v) > 0, 1.5, 1.0)
+
+
+def joined(n, shared):
+    """ n copies of LOOP, joined on a single 0 V sample when shared, else with the 0 V sample repeated """
+    return np.concatenate([LOOP] + [LOOP[1:] if shared else LOOP] * (n - 1))
+
+
+def single_loop_metrics():
+    i = current(LOOP)
+    return np.array(area_under_curves(LOOP, i) + on_off_values(LOOP, i))
+
+
+def test_single_loop():
+    assert check_for_loops(LOOP).tolist() == [[0, LOOP.size]]
+
+
+@pytest.mark.parametrize('shared', [False, True], ids=['repeated', 'shared'])
+def test_loop_bounds(shared):
+    bounds = check_for_loops(joined(3, shared))
+    # every loop runs from 0 V back to 0 V, a shared 0 V sample belongs to both loops it joins
+    expected = [[0, 41], [40, 81], [80, 121]] if shared else [[0, 41], [41, 82], [82, 123]]
+    assert bounds.tolist() == expected
+
+
+@pytest.mark.parametrize('shared', [False, True], ids=['repeated', 'shared'])
+def test_loop_metrics_match_single_loop(shared):
+    v = joined(3, shared)
+    split_v, split_c = split_loops(v, current(v), check_for_loops(v))
+    per_loop = np.column_stack(calculate_metrics_for_loops(split_v, split_c))
+    for metrics in per_loop:
+        np.testing.assert_allclose(metrics, single_loop_metrics(), rtol=1e-12)
+
+    df_file_stats, _ = file_analysis(pd.DataFrame({'voltage': v, 'current': current(v)}), False, False, None, False,
+                                     None, None)
+    stats = df_file_stats.iloc[0]
+    np.testing.assert_allclose(
+        stats[['ps_area_avg', 'ng_area_avg', 'areas_avg', 'normalized_areas_avg', 'resistance_on_value',
+               'resistance_off_value', 'voltage_on_value', 'voltage_off_value']].to_numpy(dtype=float),
+        single_loop_metrics(), rtol=1e-12)
@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from metrics_calculation import on_off_values, split_data_in_sect, area_under_curves, calculate_metrics_for_loops
+
+""" Regression tests of the array based metrics against the loop implementations they replaced """
+
+
+# Reference implementations, as they were before vectorization
+
+def ref_on_off_values(voltage_data, current_data):
+    voltage_data = np.asarray(voltage_data)
+    current_data = np.asarray(current_data)
+    voltage_on_value = 0
+    voltage_off_value = 0
+
+    max_voltage = round(max(voltage_data), 1)
+    if max_voltage == 0:
+        max_voltage = abs(round(min(voltage_data), 1))
+    threshold = round(0.2 * max_voltage, 2)
+
+    filtered_voltage = []
+    filtered_current = []
+    for index in range(len(voltage_data)):
+        if -threshold < voltage_data[index] < threshold:
+            filtered_voltage.append(voltage_data[index])
+            filtered_current.append(current_data[index])
+
+    resistance_magnitudes = []
+    for idx in range(len(filtered_voltage)):
+        if filtered_voltage[idx] != 0 and filtered_current[idx] != 0:
+            resistance_magnitudes.append(abs(filtered_voltage[idx] / filtered_current[idx]))
+    if not resistance_magnitudes:
+        return 0, 0, 0, 0
+
+    resistance_off_value = min(resistance_magnitudes)
+    resistance_on_value = max(resistance_magnitudes)
+
+    gradients = []
+    for idx in range(len(voltage_data)):
+        if idx != len(voltage_data) - 1:
+            if voltage_data[idx + 1] - voltage_data[idx] != 0:
+                gradients.append(
+                    (current_data[idx + 1] - current_data[idx]) / (voltage_data[idx + 1] - voltage_data[idx]))
+
+    max_gradient = max(gradients[:(int(len(gradients) / 2))])
+    min_gradient = min(gradients)
+    for idx in range(len(gradients)):
+        if gradients[idx] == max_gradient:
+            voltage_off_value = voltage_data[idx]
+        if gradients[idx] == min_gradient:
+            voltage_on_value = voltage_data[idx]
+    return resistance_on_value, resistance_off_value, voltage_on_value, voltage_off_value
+
+
+def ref_split_data_in_sect(voltage, current, v_max, v_min):
+    zipped_data = list(zip(voltage, current))
+    positive = [(v, c) for v, c in zipped_data if 0 <= v <= v_max]
+    negative = [(v, c) for v, c in zipped_data if v_min <= v <= 0]
+
+    max_len = max(len(positive), len(negative))
+    positive1 = positive[:max_len // 2]
+    positive2 = positive[max_len // 2:]
+    negative3 = negative[:max_len // 2]
+    negative4 = negative[max_len // 2:]
+
+    max_len = max(len(positive1), len(positive2), len(negative3), len(negative4))
+    last_positive1 = positive1[-1] if positive1 else (0, 0)
+    last_positive2 = positive2[-1] if positive2 else (0, 0)
+    last_negative3 = negative3[-1] if negative3 else (0, 0)
+    last_negative4 = negative4[-1] if negative4 else (0, 0)
+    positive1 += [last_positive1] * (max_len - len(positive1))
+    positive2 += [last_positive2] * (max_len - len(positive2))
+    negative3 += [last_negative3] * (max_len - len(negative3))
+    negative4 += [last_negative4] * (max_len - len(negative4))
+
+    return pd.DataFrame({
+        'voltage_ps_sect1': [v for v, _ in positive1],
+        'current_ps_sect1': [c for _, c in positive1],
+        'voltage_ps_sect2': [v for v, _ in positive2],
+        'current_ps_sect2': [c for _, c in positive2],
+        'voltage_ng_sect1': [v for v, _ in negative3],
+        'current_ng_sect1': [c for _, c in negative3],
+        'voltage_ng_sect2': [v for v, _ in negative4],
+        'current_ng_sect2': [c for _, c in negative4],
+    })
+
+
+def loop(points=200, v_max=1.0, v_min=-1.0, seed=0):
+    """ 0 -> v_max -> v_min -> 0 V sweep with a hysteretic current """
+    rng = np.random.default_rng(seed)
+    quarter = points // 4
+    v = np.concatenate((np.linspace(0, v_max, quarter), np.linspace(v_max, v_min, 2 * quarter),
+                        np.linspace(v_min, 0, points - 3 * quarter)))
+    c = 1e-6 * v * (1 + 0.5 * np.sign(np.gradient(v))) + rng.normal(scale=1e-9, size=v.size)
+    return np.round(v, 4), c
+
+
+CASES = {
+    'loop': loop(),
+    'asymmetric loop': loop(points=157, v_max=2.0, v_min=-0.5, seed=1),
+    # exactly equal gradients (binary fractions): the last matching gradient picks the voltage
+    'ties on equal maxima': (np.array([0, 1, 2, 4, 8, 4, 2, 1, 0, -1, -2, -4, -8, -4, -2, -1, 0]) / 16,
+                             np.array([0, 1, 2, 4, 8, 4, 2, 1, 0, -1, -2, -4, -8, -4, -2, -1, 0]) * 2 ** -20),
+    'ties with flat steps': (np.array([0, 1, 1, 2, 4, 8, 8, 4, 2, 1, 0, -1, -8, -8, -1, 0]) / 16,
+                             np.array([0, 1, 1, 2, 4, 8, 9, 5, 3, 2, 1, 0, -7, -6, 1, 2]) * 2 ** -20),
+    'negative only sweep': (np.array([0.0, -0.1, -0.2, -0.5, -1.0, -0.5, -0.2, -0.1, 0.0]),
+                            np.array([0.0, -1.0, -2.5, -5.0, -9.0, -4.0, -1.5, -0.5, 0.0]) * 1e-6),
+    # only 0 V or zero current points below the threshold
+    'empty window below threshold': (np.array([0.0, 0.5, 1.0, 0.5, 0.0, -0.5, -1.0, -0.5, 0.0]),
+                                     np.array([1e-6, 2.0, 3.0, 2.5, 0.0, -2.0, -3.0, -1.0, 0.0]) * 1e-6),
+}
+
+
+@pytest.fixture(params=list(CASES))
+def data(request):
+    return CASES[request.param]
+
+
+def test_on_off_values(data):
+    expected = ref_on_off_values(*data)
+    actual = on_off_values(pd.Series(data[0]), pd.Series(data[1]))
+    assert [float(value) for value in actual] == [float(value) for value in expected]
+
+
+def test_split_data_in_sect(data):
+    v, c = data
+    v_max, v_min = np.max(v), np.min(v)
+    expected = ref_split_data_in_sect(v, c, v_max, v_min)
+    actual = split_data_in_sect(v, c, v_max, v_min)
+    assert list(actual) == list(expected)
+    for name, values in actual.items():
+        np.testing.assert_array_equal(values, expected[name].to_numpy(dtype=np.float64))
+
+
+def test_area_under_curves(data):
+    v, c = data
+    v_max, v_min = np.max(v), np.min(v)
+    sections = ref_split_data_in_sect(v, c, v_max, v_min)
+    sect_areas = [abs(np.trapz(sections[f'current_{name}'], sections[f'voltage_{name}']))
+                  for name in ('ps_sect1', 'ps_sect2', 'ng_sect1', 'ng_sect2')]
+    ps_area = sect_areas[0] - sect_areas[1]
+    ng_area = sect_areas[3] - sect_areas[2]
+    norm_area = (ps_area + ng_area) / (abs(v_max) + abs(v_min))
+    np.testing.assert_allclose(area_under_curves(v, c), [ps_area, ng_area, ps_area + ng_area, norm_area],
+                               rtol=1e-12, atol=1e-24)
+
+
+def test_calculate_metrics_for_loops():
+    loops = [CASES[name] for name in CASES]
+    metrics = calculate_metrics_for_loops([v for v, _ in loops], [c for _, c in loops])
+    for i, (v, c) in enumerate(loops):
+        on_off = ref_on_off_values(v, c)
+        np.testing.assert_array_equal([values[i] for values in metrics[4:]], np.asarray(on_off, dtype=np.float64))
+        np.testing.assert_allclose([values[i] for values in metrics[:4]], area_under_curves(v, c),
+                                   rtol=1e-12, atol=1e-24)
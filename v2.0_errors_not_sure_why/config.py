@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
 import json
 
 
@@ -13,6 +13,8 @@ class ProcessingConfig:
     print_interval: int = 10
     debugging: bool = False
     plot_graphs: bool = False
+    # Mean resistance from 0 V up to each voltage is saved per file in the store's summary table
+    summary_voltages: Tuple[float, ...] = (0.1,)
 
     # File names
     output_file: str = "skipped_files.txt"
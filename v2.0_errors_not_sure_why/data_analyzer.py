@@ -7,6 +7,8 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from scipy import stats
 
+from file_processing import load_summary
+
 class DataAnalyzer:
     """Class for analyzing processed data from HDF5 files"""
 
@@ -15,48 +17,28 @@ class DataAnalyzer:
 
     def get_summary_statistics(self, material: str = None,
                              sample: str = None) -> pd.DataFrame:
-        """Get summary statistics for specified material/sample"""
+        """Get summary statistics for specified material/sample, from the store's summary table"""
         data = []
 
-        with h5py.File(self.hdf5_path, 'r') as f:
-            for mat_key in f.keys():
-                if material and mat_key != material:
-                    continue
-
-                for sample_key in f[mat_key].keys():
-                    if sample and sample_key != sample:
-                        continue
-
-                    if '_info' in sample_key or '_yield' in sample_key:
-                        continue
+        summary = load_summary(self.hdf5_path)
+        for (mat_key, sample_key), sample_summary in summary.groupby(['material', 'sample'], sort=True):
+            if material and mat_key != material:
+                continue
+            if sample and sample_key != sample:
+                continue
 
-                    # Process each device
-                    sample_data = self._analyze_sample(f[mat_key][sample_key])
-                    sample_data['material'] = mat_key
-                    sample_data['sample'] = sample_key
-                    data.append(sample_data)
+            sample_data = self._analyze_sample(sample_summary)
+            sample_data['material'] = mat_key
+            sample_data['sample'] = sample_key
+            data.append(sample_data)
 
         return pd.DataFrame(data)
 
-    def _analyze_sample(self, sample_group: h5py.Group) -> Dict:
-        """Analyze a single sample"""
-        on_off_ratios = []
-        resistances_on = []
-        resistances_off = []
-
-        for section_key in sample_group.keys():
-            for device_key in sample_group[section_key].keys():
-                for dataset_key in sample_group[section_key][device_key].keys():
-                    if '_info' in dataset_key:
-                        data = sample_group[section_key][device_key][dataset_key][()]
-                        df = pd.DataFrame(data)
-
-                        if 'ON_OFF_Ratio' in df.columns:
-                            on_off_ratios.append(df['ON_OFF_Ratio'].iloc[0])
-                        if 'resistance_on_value' in df.columns:
-                            resistances_on.append(df['resistance_on_value'].iloc[0])
-                        if 'resistance_off_value' in df.columns:
-                            resistances_off.append(df['resistance_off_value'].iloc[0])
+    def _analyze_sample(self, sample_summary: pd.DataFrame) -> Dict:
+        """Analyze a single sample from its rows of the summary table"""
+        on_off_ratios = self._metric_values(sample_summary, 'ON_OFF_Ratio')
+        resistances_on = self._metric_values(sample_summary, 'resistance_on_value')
+        resistances_off = self._metric_values(sample_summary, 'resistance_off_value')
 
         return {
             'num_devices': len(on_off_ratios),
@@ -73,17 +55,11 @@ class DataAnalyzer:
         values = []
         labels = []
 
-        with h5py.File(self.hdf5_path, 'r') as f:
-            for mat_key in f.keys():
-                for sample_key in f[mat_key].keys():
-                    if '_info' in sample_key or '_yield' in sample_key:
-                        continue
-
-                    sample_values = self._extract_metric_values(
-                        f[mat_key][sample_key], metric
-                    )
-                    values.extend(sample_values)
-                    labels.extend([f"{mat_key}-{sample_key}"] * len(sample_values))
+        summary = load_summary(self.hdf5_path)
+        for (mat_key, sample_key), sample_summary in summary.groupby(['material', 'sample'], sort=True):
+            sample_values = self._metric_values(sample_summary, metric)
+            values.extend(sample_values)
+            labels.extend([f"{mat_key}-{sample_key}"] * len(sample_values))
 
         # Create plot
         fig, ax = plt.subplots(figsize=(10, 6))
@@ -103,22 +79,9 @@ class DataAnalyzer:
         plt.tight_layout()
         return fig
 
-    def _extract_metric_values(self, sample_group: h5py.Group,
-                              metric: str) -> List[float]:
-        """Extract values for a specific metric from sample"""
-        values = []
-
-        for section_key in sample_group.keys():
-            for device_key in sample_group[section_key].keys():
-                for dataset_key in sample_group[section_key][device_key].keys():
-                    if '_info' in dataset_key:
-                        data = sample_group[section_key][device_key][dataset_key][()]
-                        df = pd.DataFrame(data)
-
-                        if metric in df.columns:
-                            values.append(df[metric].iloc[0])
-
-        return values
-
-
-
+    @staticmethod
+    def _metric_values(sample_summary: pd.DataFrame, metric: str) -> List[float]:
+        """Values of a file_stats metric in rows of the summary table, files without it left out"""
+        if metric not in sample_summary.columns:
+            return []
+        return sample_summary[metric].dropna().tolist()
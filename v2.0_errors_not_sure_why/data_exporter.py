@@ -7,6 +7,8 @@ import openpyxl
 from openpyxl.styles import Font, PatternFill, Alignment
 from openpyxl.utils.dataframe import dataframe_to_rows
 
+from file_processing import load_summary, SUMMARY_COLUMNS
+
 
 class DataExporter:
     """Export processed data to various formats"""
@@ -58,23 +60,19 @@ class DataExporter:
 
         # Add data
         row_num = 2
-        with h5py.File(self.hdf5_path, 'r') as f:
-            for material in f.keys():
-                for sample in f[material].keys():
-                    if '_' in sample:  # Skip special keys
-                        continue
-
-                    stats = self._calculate_sample_stats(f[material][sample])
+        summary = load_summary(self.hdf5_path)
+        for (material, sample), sample_summary in summary.groupby(['material', 'sample'], sort=True):
+            stats = self._calculate_sample_stats(sample_summary)
 
-                    ws.cell(row=row_num, column=1, value=material)
-                    ws.cell(row=row_num, column=2, value=sample)
-                    ws.cell(row=row_num, column=3, value=stats['total_devices'])
-                    ws.cell(row=row_num, column=4, value=stats['working_devices'])
-                    ws.cell(row=row_num, column=5, value=f"{stats['yield']:.1f}")
-                    ws.cell(row=row_num, column=6, value=f"{stats['avg_on_off']:.2f}")
-                    ws.cell(row=row_num, column=7, value=f"{stats['std_on_off']:.2f}")
+            ws.cell(row=row_num, column=1, value=material)
+            ws.cell(row=row_num, column=2, value=sample)
+            ws.cell(row=row_num, column=3, value=stats['total_devices'])
+            ws.cell(row=row_num, column=4, value=stats['working_devices'])
+            ws.cell(row=row_num, column=5, value=f"{stats['yield']:.1f}")
+            ws.cell(row=row_num, column=6, value=f"{stats['avg_on_off']:.2f}")
+            ws.cell(row=row_num, column=7, value=f"{stats['std_on_off']:.2f}")
 
-                    row_num += 1
+            row_num += 1
 
         # Auto-fit columns
         for column in ws.columns:
@@ -89,27 +87,13 @@ class DataExporter:
             adjusted_width = min(max_length + 2, 50)
             ws.column_dimensions[column_letter].width = adjusted_width
 
-    def _calculate_sample_stats(self, sample_group: h5py.Group) -> Dict:
-        """Calculate statistics for a sample"""
-        total_devices = 0
-        working_devices = 0
+    def _calculate_sample_stats(self, sample_summary: pd.DataFrame) -> Dict:
+        """Calculate statistics for a sample from its rows of the summary table"""
+        total_devices = sample_summary.groupby(['section', 'device']).ngroups
         on_off_ratios = []
-
-        for section in sample_group.keys():
-            for device in sample_group[section].keys():
-                total_devices += 1
-
-                # Check if device is working
-                for dataset in sample_group[section][device].keys():
-                    if '_info' in dataset:
-                        data = sample_group[section][device][dataset][()]
-                        df = pd.DataFrame(data)
-
-                        if 'ON_OFF_Ratio' in df.columns:
-                            ratio = df['ON_OFF_Ratio'].iloc[0]
-                            on_off_ratios.append(ratio)
-                            if ratio > 10:  # Threshold for "working"
-                                working_devices += 1
+        if 'ON_OFF_Ratio' in sample_summary.columns:
+            on_off_ratios = sample_summary['ON_OFF_Ratio'].dropna().tolist()
+        working_devices = len([ratio for ratio in on_off_ratios if ratio > 10])  # Threshold for "working"
 
         return {
             'total_devices': total_devices,
@@ -123,25 +107,17 @@ class DataExporter:
         """Export individual device cards as separate files"""
         output_dir.mkdir(exist_ok=True)
 
-        with h5py.File(self.hdf5_path, 'r') as f:
-            for material in f.keys():
-                for sample in f[material].keys():
-                    if '_' in sample:
-                        continue
-
-                    for section in f[material][sample].keys():
-                        for device in f[material][sample][section].keys():
-                            # Create device card
-                            device_data = self._create_device_card(
-                                f[material][sample][section][device],
-                                material, sample, section, device
-                            )
-
-                            # Save as CSV
-                            filename = f"{material}_{sample}_{section}_{device}.csv"
-                            device_data.to_csv(output_dir / filename, index=False)
-
-    def _create_device_card(self, device_group: h5py.Group,
+        summary = load_summary(self.hdf5_path)
+        for (material, sample, section, device), device_summary in summary.groupby(
+                ['material', 'sample', 'section', 'device'], sort=True):
+            # Create device card
+            device_data = self._create_device_card(device_summary, material, sample, section, device)
+
+            # Save as CSV
+            filename = f"{material}_{sample}_{section}_{device}.csv"
+            device_data.to_csv(output_dir / filename, index=False)
+
+    def _create_device_card(self, device_summary: pd.DataFrame,
                             material: str, sample: str,
                             section: str, device: str) -> pd.DataFrame:
         """Create a device card with all relevant information"""
@@ -152,16 +128,11 @@ class DataExporter:
             'Device': device,
         }
 
-        # Extract metrics
-        for dataset_key in device_group.keys():
-            if '_info' in dataset_key:
-                data = device_group[dataset_key][()]
-                df = pd.DataFrame(data)
-
-                # Add metrics to device info
-                for col in df.columns:
-                    if col not in ['Material', 'Sample', 'Section', 'Device', 'Filename']:
-                        device_info[col] = df[col].iloc[0]
+        # Add the metrics of the device's last file, as saved in the summary table
+        metrics = device_summary.iloc[-1]
+        for col in device_summary.columns:
+            if col not in SUMMARY_COLUMNS:
+                device_info[col] = metrics[col]
 
         return pd.DataFrame([device_info])
 
@@ -13,7 +13,12 @@ from metrics_calculation import (calculate_metrics_for_loops, area_under_curves,
 from plotting import plot_loop_data, plot_single_sweep_data
 from helpers import (check_for_loops, extract_folder_names,
                      check_if_folder_exists, split_iv_sweep,
-                     dataframe_to_structured_array)
+                     dataframe_to_structured_array, hdf5_key_metadata,
+                     sweep_number, decode_classification, METADATA_COLUMNS)
+
+# One row per sweep file: its key parts, sweep number, classification, low bias resistances and file_stats
+SUMMARY_KEY = '/_summary'
+SUMMARY_COLUMNS = ('key', 'material', 'sample', 'section', 'device', 'filename', 'sweep', 'classification')
 
 
 class FileAnalyzer:
@@ -241,17 +246,8 @@ def read_file_to_dataframe(file: Path) -> Optional[pd.DataFrame]:
 
 def add_metadata(df: pd.DataFrame, material: str, sample: str,
                  section: str, device: str, filename: str) -> None:
-    """Add metadata columns to DataFrame"""
-    metadata = {
-        'Material': material,
-        'Sample': sample,
-        'Section': section,
-        'Device': device,
-        'Filename': filename
-    }
-
-    for key, value in metadata.items():
-        df[key] = value
+    """Record the file metadata in df.attrs, once instead of as a string column per row"""
+    df.attrs.update(zip(METADATA_COLUMNS, (material, sample, section, device, filename)))
 
 
 def analyze_file(sweep_type: str, analysis_params: Dict[str, Any]) -> Tuple[pd.DataFrame, pd.DataFrame]:
@@ -272,7 +268,7 @@ def analyze_file(sweep_type: str, analysis_params: Dict[str, Any]) -> Tuple[pd.D
 
 def save_to_hdf5(store: h5py.File, key_file_stats: str, key_raw_data: str,
                  df_file_stats: pd.DataFrame, df_raw_data: pd.DataFrame) -> None:
-    """Save DataFrames to HDF5 file"""
+    """Save DataFrames to HDF5 file, with the file metadata as attributes of the device group"""
 
     # Convert DataFrames to structured arrays
     structured_raw_data = dataframe_to_structured_array(df_raw_data)
@@ -293,18 +289,105 @@ def save_to_hdf5(store: h5py.File, key_file_stats: str, key_raw_data: str,
             dtype=data.dtype
         )
 
-
-def load_from_hdf5(store_path: Path, key: str) -> Optional[pd.DataFrame]:
-    """Load data_analyzer.py from HDF5 file"""
+    device_group = store[key_raw_data].parent
+    if 'Device' not in device_group.attrs:
+        metadata = hdf5_key_metadata(key_raw_data)
+        del metadata['Filename']
+        device_group.attrs.update(metadata)
+
+
+def summary_row(key_raw_data: str, df_file_stats: pd.DataFrame, df_raw_data: pd.DataFrame,
+                voltages: Tuple[float, ...] = (0.1,)) -> Dict[str, Any]:
+    """Summary table row of one file: key parts, sweep number, classification, mean resistance from 0 V up to
+    each voltage (column resistance_<v>V) and the file_stats columns"""
+    metadata = hdf5_key_metadata(key_raw_data)
+    row = {'key': key_raw_data, **{name.lower(): value for name, value in metadata.items()},
+           'sweep': sweep_number(metadata['Filename'])}
+    has_classification = df_raw_data is not None and 'classification' in df_raw_data.columns and len(df_raw_data)
+    row['classification'] = df_raw_data['classification'].iloc[0] if has_classification else None
+
+    for voltage in voltages:
+        resistance_data = None
+        if df_raw_data is not None and {'voltage', 'resistance'} <= set(df_raw_data.columns):
+            low_bias = (df_raw_data['voltage'] >= 0) & (df_raw_data['voltage'] <= voltage)
+            resistance_data = df_raw_data.loc[low_bias, 'resistance']
+        row[f'resistance_{voltage:g}V'] = resistance_data.mean() if resistance_data is not None else np.nan
+
+    if df_file_stats is not None and len(df_file_stats):
+        for col in df_file_stats.columns:
+            if col not in METADATA_COLUMNS and col not in row:
+                row[col] = df_file_stats[col].iloc[0]
+    return row
+
+
+def _read_summary(store: h5py.File) -> Optional[pd.DataFrame]:
+    """Summary table of an open store as a DataFrame, None when it has none"""
+    if SUMMARY_KEY not in store:
+        return None
+    data = store[SUMMARY_KEY][()]
+    df = pd.DataFrame({name: data[name] for name in data.dtype.names})
+    for col in df.columns:
+        if col == 'classification':
+            df[col] = decode_classification(df[col])
+        elif data.dtype[col].kind in 'SO':
+            df[col] = [value.decode('utf-8') if isinstance(value, bytes) else value for value in df[col]]
+    return df
+
+
+def save_summary(store: h5py.File, rows: Dict[str, Dict[str, Any]]) -> None:
+    """Merge summary rows, keyed by raw data key, into the summary table of an open store"""
+    if not rows:
+        return
+    summary = pd.DataFrame(list(rows.values()))
+    existing = _read_summary(store)
+    if existing is not None:
+        summary = pd.concat([existing[~existing['key'].isin(rows)], summary], ignore_index=True)
+    structured = dataframe_to_structured_array(summary.sort_values('key', ignore_index=True))
+    if SUMMARY_KEY in store:
+        del store[SUMMARY_KEY]
+    store.create_dataset(SUMMARY_KEY, data=structured, compression="gzip", dtype=structured.dtype)
+
+
+def load_summary(store_path: Path, voltages: Tuple[float, ...] = (0.1,)) -> pd.DataFrame:
+    """Summary table of a store, one row per file (see summary_row).
+
+    Stores written before the table existed are summarised from their datasets instead, which reads every one
+    of them: process the files again to add the table.
+    """
+    with h5py.File(store_path, 'r') as f:
+        summary = _read_summary(f)
+        if summary is not None:
+            return summary
+
+        keys = []
+        f.visititems(lambda name, obj: keys.append('/' + name)
+                     if isinstance(obj, h5py.Dataset) and name.endswith('_raw_data') else None)
+    rows = []
+    for key_raw_data in sorted(keys):
+        key_file_stats = key_raw_data[:-len('_raw_data')] + '_file_stats'
+        df_raw_data = load_from_hdf5(store_path, key_raw_data, metadata=False)
+        if df_raw_data is not None and 'classification' in df_raw_data.columns:
+            df_raw_data['classification'] = decode_classification(df_raw_data['classification'])
+        rows.append(summary_row(key_raw_data, load_from_hdf5(store_path, key_file_stats, metadata=False),
+                                df_raw_data, voltages))
+    return pd.DataFrame(rows) if rows else pd.DataFrame(columns=list(SUMMARY_COLUMNS))
+
+
+def load_from_hdf5(store_path: Path, key: str, metadata: bool = True) -> Optional[pd.DataFrame]:
+    """Load data_analyzer.py from HDF5 file, re-attaching the file metadata columns unless metadata is False"""
     try:
         with h5py.File(store_path, 'r') as f:
             if key in f:
                 data = f[key][()]
                 # Convert structured array back to DataFrame
-                if hasattr(data, 'dtype') and data.dtype.names:
-                    return pd.DataFrame(data)
-                else:
-                    return pd.DataFrame(data)
+                df = pd.DataFrame(data)
+                if metadata:
+                    attrs = f[key].parent.attrs
+                    df.attrs.update(hdf5_key_metadata(key))
+                    df.attrs.update((name, attrs[name]) for name in METADATA_COLUMNS if name in attrs)
+                    for name, value in df.attrs.items():
+                        df[name] = value
+                return df
             else:
                 return None
     except Exception as e:
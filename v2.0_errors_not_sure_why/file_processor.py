@@ -13,12 +13,102 @@ from helpers import (generate_analysis_params, extract_file_info,
                      check_if_file_exists, check_for_nan, generate_hdf5_keys,
                      check_sweep_type, dataframe_to_structured_array)
 from file_processing import (read_file_to_dataframe, add_metadata,
-                             analyze_file, save_to_hdf5)
+                             analyze_file, save_to_hdf5, summary_row, save_summary)
 from excell import (save_info_from_solution_devices_excell,
                     save_info_from_device_into_excell, device_clasification)
 
 logger = logging.getLogger(__name__)
 
+# Parallel raw processing submits files in chunks of roughly equal size in bytes, about CHUNKS_PER_WORKER chunks
+# per worker so a slow chunk doesn't leave the other workers idle at the end
+CHUNKS_PER_WORKER = 8
+MIN_CHUNK_BYTES = 256 * 1024
+MAX_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Set once in each worker process by _init_worker, so tasks only carry file paths
+_worker_config: Optional[ProcessingConfig] = None
+_worker_classifications: Dict[str, Optional[Dict[str, pd.DataFrame]]] = {}
+
+
+def _init_worker(config: ProcessingConfig,
+                 classifications: Dict[str, Optional[Dict[str, pd.DataFrame]]]) -> None:
+    """Pool initializer: keeps the config and the preloaded per-sample Excel sheets for every task in this worker"""
+    global _worker_config, _worker_classifications
+    _worker_config = config
+    _worker_classifications = classifications
+
+
+def _process_raw_file_chunk(files: List[Path]) -> List[Tuple[Path, Optional[Dict], Optional[str]]]:
+    """Worker task: processes a chunk of raw files, returning (file, result, error) for each"""
+    results = []
+    for file in files:
+        try:
+            result = analyse_raw_file(file, _worker_config, _worker_classifications)
+            results.append((file, result, None))
+        except Exception as e:
+            results.append((file, None, str(e)))
+    return results
+
+
+def analyse_raw_file(file: Path, config: ProcessingConfig,
+                     classifications: Dict[str, Optional[Dict[str, pd.DataFrame]]]) -> Optional[Dict]:
+    """Process a single raw file for parallel processing, classification comes from the preloaded Excel sheets"""
+    relative_path = file.relative_to(config.base_dir)
+
+    # Extract file information
+    if len(relative_path.parts) != 6:
+        return None
+    nano_particles, material, sample, section, device, filename = relative_path.parts
+
+    # Skip combined plots
+    if device == 'plots_combined':
+        return None
+
+    # Check sweep type
+    sweep_type = check_sweep_type(file, config.output_file)
+    if not sweep_type:
+        return None
+
+    # Read and validate data_analyzer.py
+    df = read_file_to_dataframe(file)
+    if df is None or check_for_nan(df):
+        return None
+
+    # Process the file
+    add_metadata(df, material, sample, section, device, filename)
+    analysis_params = generate_analysis_params(df, filename, config.base_dir, device)
+    # Respect plotting flag
+    analysis_params['plot_graph'] = config.plot_graphs
+
+    df_file_stats, df_raw_data = analyze_file(sweep_type, analysis_params)
+
+    if df_raw_data is not None:
+        # Add classification
+        sample_location = config.base_dir / nano_particles / material / sample
+        try:
+            classification = device_clasification(
+                classifications.get(str(sample_location)), device, section, sample_location
+            )
+        except Exception as e:
+            logger.warning(f"Could not get classification: {str(e)}")
+            classification = "unknown"
+        df_raw_data['classification'] = classification
+
+    # Generate keys
+    key_file_stats, key_raw_data = generate_hdf5_keys(
+        material, sample, section, device, filename
+    )
+
+    return {
+        'key_file_stats': key_file_stats,
+        'key_raw_data': key_raw_data,
+        'df_file_stats': df_file_stats,
+        'df_raw_data': df_raw_data,
+        'device_key': (material, sample, section, device),
+        'material': material,
+        'sample': sample
+    }
+
 
 @dataclass
 class ProcessingStats:
@@ -62,6 +152,7 @@ class FileProcessor:
         self.setup_logging()
         self.current_sample_cache = {}  # Cache for sample information
         self._fabrication_written = set()  # Track (material, sample) written
+        self._summary_rows: Dict[str, Dict] = {}  # raw data key -> summary row, saved when the store is closed
 
     def setup_logging(self):
         """Setup logging configuration"""
@@ -125,6 +216,7 @@ class FileProcessor:
                 except Exception as e:
                     logger.error(f"Error processing curated file {file}: {str(e)}")
                     stats.add_error(file, str(e))
+            self._save_summary(store)
 
         self._save_processing_summary(stats, self.config.output_file_curated)
         logger.info(stats.get_summary())
@@ -140,110 +232,112 @@ class FileProcessor:
                 except Exception as e:
                     logger.error(f"Error processing file {file}: {str(e)}")
                     stats.add_error(file, str(e))
+            self._save_summary(store)
 
     def _process_raw_files_parallel(self, txt_files: List[Path],
                                     hdf5_path: Path, stats: ProcessingStats,
                                     max_workers: int = None):
-        """Process files in parallel"""
+        """Process files in parallel
+
+        One pool lives for the whole run. Each worker gets the config and the Excel sheets once, through the
+        pool initializer, and is then sent chunks of file paths; results are written as they complete
+        through a single open HDF5 file.
+        """
         if max_workers is None:
-            max_workers = multiprocessing.cpu_count() - 1
-
-        # Process files in batches to avoid HDF5 conflicts
-        batch_size = 100
-        for i in range(0, len(txt_files), batch_size):
-            batch = txt_files[i:i + batch_size]
-
-            with ProcessPoolExecutor(max_workers=max_workers) as executor:
-                futures = {
-                    executor.submit(self._process_file_batch, file): file
-                    for file in batch
-                }
-
-                for future in tqdm(as_completed(futures), total=len(batch),
-                                   desc=f"Processing batch {i // batch_size + 1}"):
-                    file = futures[future]
-                    try:
-                        result = future.result()
-                        if result:
-                            # Save to HDF5
-                            self._save_batch_results(hdf5_path, result)
-                            stats.add_processed_file()
-                    except Exception as e:
-                        logger.error(f"Error processing file {file}: {str(e)}")
-                        stats.add_error(file, str(e))
-
-    def _process_file_batch(self, file: Path) -> Optional[Dict]:
-        """Process a single file for batch processing"""
-        try:
-            relative_path = file.relative_to(self.config.base_dir)
-
-            # Extract file information
-            file_info = self._extract_file_info(relative_path)
-            if not file_info:
-                return None
-
-            filename, device, section, sample, material, nano_particles = file_info
-
-            # Skip combined plots
-            if device == 'plots_combined':
-                return None
-
-            # Check sweep type
-            sweep_type = check_sweep_type(file, self.config.output_file)
-            if not sweep_type:
-                return None
-
-            # Read and validate data_analyzer.py
-            df = read_file_to_dataframe(file)
-            if df is None or check_for_nan(df):
-                return None
-
-            # Process the file
-            add_metadata(df, material, sample, section, device, filename)
-            analysis_params = generate_analysis_params(df, filename, self.config.base_dir, device)
-            # Respect plotting flag
-            analysis_params['plot_graph'] = self.config.plot_graphs
-
-            df_file_stats, df_raw_data = analyze_file(sweep_type, analysis_params)
-
-            if df_raw_data is not None:
-                # Add classification
-                classification = self._get_device_classification(
-                    sample, section, device, material, nano_particles
-                )
-                df_raw_data['classification'] = classification
-
-            # Generate keys
-            key_file_stats, key_raw_data = generate_hdf5_keys(
-                material, sample, section, device, filename
-            )
+            max_workers = max(1, multiprocessing.cpu_count() - 1)
+
+        classifications = self._load_sample_classifications(txt_files)
+        chunks = self._chunk_files_by_size(txt_files, max_workers)
+        logger.info(f"Processing {len(txt_files)} files in {len(chunks)} chunks on {max_workers} workers")
+
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(self.config, classifications)) as executor, \
+                h5py.File(hdf5_path, 'a') as store, \
+                tqdm(total=len(txt_files), desc="Processing raw files") as progress:
+            futures = [executor.submit(_process_raw_file_chunk, chunk) for chunk in chunks]
+
+            for future in as_completed(futures):
+                results = future.result()
+                for file, result, error in results:
+                    if error is not None:
+                        logger.error(f"Error processing file {file}: {error}")
+                        stats.add_error(file, error)
+                    elif result:
+                        self._save_result(store, result)
+                        stats.update_device_count(result['device_key'])
+                        stats.add_processed_file()
+                progress.update(len(results))
+            self._save_summary(store)
+
+    def _load_sample_classifications(self, txt_files: List[Path]) -> Dict[str, Optional[Dict[str, pd.DataFrame]]]:
+        """Read the classification workbook of every sample once, keyed by the sample folder"""
+        classifications = {}
+        for file in txt_files:
+            parts = file.relative_to(self.config.base_dir).parts
+            if len(parts) != 6:
+                continue
+            sample_location = self.config.base_dir / parts[0] / parts[1] / parts[2]
+            if str(sample_location) in classifications:
+                continue
+            try:
+                classifications[str(sample_location)] = save_info_from_device_into_excell(parts[2], sample_location)
+            except Exception as e:
+                logger.warning(f"Could not read classifications for {sample_location}: {str(e)}")
+                classifications[str(sample_location)] = None
+        return classifications
+
+    @staticmethod
+    def _chunk_files_by_size(txt_files: List[Path], workers: int) -> List[List[Path]]:
+        """Split files into chunks of about equal total size, between MIN_CHUNK_BYTES and MAX_CHUNK_BYTES"""
+        sizes = []
+        for file in txt_files:
+            try:
+                sizes.append(file.stat().st_size)
+            except OSError:
+                sizes.append(0)
+
+        target = sum(sizes) // max(1, workers * CHUNKS_PER_WORKER)
+        target = min(MAX_CHUNK_BYTES, max(MIN_CHUNK_BYTES, target))
+
+        chunks, chunk, chunk_bytes = [], [], 0
+        for file, size in zip(txt_files, sizes):
+            chunk.append(file)
+            chunk_bytes += size
+            if chunk_bytes >= target:
+                chunks.append(chunk)
+                chunk, chunk_bytes = [], 0
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def _save_result(self, store: h5py.File, result: Dict):
+        """Save one parallel processing result to the open HDF5 file"""
+        # Write fabrication metadata once per (material, sample)
+        self._maybe_write_fabrication(store, result['material'], result['sample'])
+        self._save(
+            store,
+            result['key_file_stats'],
+            result['key_raw_data'],
+            result['df_file_stats'],
+            result['df_raw_data']
+        )
 
-            return {
-                'key_file_stats': key_file_stats,
-                'key_raw_data': key_raw_data,
-                'df_file_stats': df_file_stats,
-                'df_raw_data': df_raw_data,
-                'device_key': (material, sample, section, device),
-                'material': material,
-                'sample': sample
-            }
+    def _save(self, store: h5py.File, key_file_stats: str, key_raw_data: str,
+              df_file_stats: pd.DataFrame, df_raw_data: pd.DataFrame):
+        """Save one file's DataFrames and keep its summary row"""
+        save_to_hdf5(store, key_file_stats, key_raw_data, df_file_stats, df_raw_data)
+        if df_raw_data is not None and df_file_stats is not None:
+            self._summary_rows[key_raw_data] = summary_row(key_raw_data, df_file_stats, df_raw_data,
+                                                           tuple(self.config.summary_voltages))
 
+    def _save_summary(self, store: h5py.File):
+        """Merge the summary rows of the files saved in this run into the store's summary table"""
+        try:
+            save_summary(store, self._summary_rows)
         except Exception as e:
-            logger.error(f"Error in batch processing: {str(e)}")
-            return None
-
-    def _save_batch_results(self, hdf5_path: Path, result: Dict):
-        """Save batch processing results to HDF5"""
-        with h5py.File(hdf5_path, 'a') as store:
-            # Write fabrication metadata once per (material, sample)
-            self._maybe_write_fabrication(store, result['material'], result['sample'])
-            save_to_hdf5(
-                store,
-                result['key_file_stats'],
-                result['key_raw_data'],
-                result['df_file_stats'],
-                result['df_raw_data']
-            )
+            logger.warning(f"Could not write the summary table: {e}")
+        finally:
+            self._summary_rows = {}
 
     def _process_single_raw_file(self, file: Path, store: h5py.File,
                                  stats: ProcessingStats) -> Optional[bool]:
@@ -302,7 +396,7 @@ class FileProcessor:
         self._maybe_write_fabrication(store, material, sample)
 
         # Save to HDF5
-        save_to_hdf5(store, key_file_stats, key_raw_data, df_file_stats, df_raw_data)
+        self._save(store, key_file_stats, key_raw_data, df_file_stats, df_raw_data)
 
         # Update statistics
         device_key = (material, sample, section, device)
@@ -351,7 +445,7 @@ class FileProcessor:
         df_file_stats, df_raw_data = analyze_file(sweep_type, analysis_params)
 
         # Save to HDF5
-        save_to_hdf5(store, key_file_stats, key_raw_data, df_file_stats, df_raw_data)
+        self._save(store, key_file_stats, key_raw_data, df_file_stats, df_raw_data)
 
         device_key = (material, sample, section, device)
         stats.update_device_count(device_key)
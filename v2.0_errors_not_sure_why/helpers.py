@@ -175,6 +175,23 @@ def generate_hdf5_keys(material, sample, section, device, filename):
     return key_info, key_metrics
 
 
+# File metadata, kept in df.attrs by add_metadata and saved as attributes of the device group, not per row
+METADATA_COLUMNS = ('Material', 'Sample', 'Section', 'Device', 'Filename')
+
+
+def hdf5_key_metadata(key):
+    """ METADATA_COLUMNS values encoded in a key from generate_hdf5_keys """
+    material, sample, section, device, name = key.strip('/').split('/')
+    filename = name.rsplit('_', 2)[0]
+    return dict(zip(METADATA_COLUMNS, (material, sample, section, device, filename)))
+
+
+def sweep_number(filename):
+    """ Sweep number from the leading '<n>-' of a filename ('3-FS-1v...txt' -> 3), -1 when it has none """
+    number = filename.split('-', 1)[0]
+    return int(number) if number.isdigit() else -1
+
+
 # def dataframe_to_structured_array(df):
 #     """Convert a Pandas DataFrame to a structured NumPy array with HDF5-compatible dtypes."""
 #     # Define HDF5-compatible string dtype
@@ -188,48 +205,79 @@ def generate_hdf5_keys(material, sample, section, device, filename):
 #     # Convert DataFrame to structured NumPy array
 #     return np.array(df.to_records(index=False))
 
+# The classification and string encoding below, down to encode_strings, is a copy of the one in the v1 helpers.py
+# (v2 runs as its own top level modules and cannot import it). Change both, tests/test_hdf5_store.py checks that
+# they match
+# Device classifications in the order of their stored codes, anything else is saved as UNKNOWN_CLASSIFICATION
+CLASSIFICATIONS = ('Memristive', 'Capacitive', 'Conductive', 'Intermittent', 'Mem-Capacitance', 'Ohmic', 'Non-Conductive')
+UNKNOWN_CLASSIFICATION = -1
+# HDF5 enum type of the classification column, the code -> name table is saved once as part of the type
+CLASSIFICATION_DTYPE = h5py.enum_dtype(
+    {'unknown': UNKNOWN_CLASSIFICATION, **{name: code for code, name in enumerate(CLASSIFICATIONS)}}, basetype='i1')
+FIXED_STRING_MAX_BYTES = 256  # longer text columns are saved as variable length strings
+
+
+def encode_classification(values):
+    """ int8 codes of classification labels, UNKNOWN_CLASSIFICATION for None and unknown labels """
+    return pd.Categorical(values, categories=CLASSIFICATIONS).codes.astype(np.int8)
+
+
+def classification_codes(values):
+    """ int8 codes of a classification column of labels or of numeric codes.
+    NaN (a blank classification cell), non integer and out of range codes become UNKNOWN_CLASSIFICATION """
+    if not pd.api.types.is_numeric_dtype(values):
+        return encode_classification(values)
+    codes = np.asarray(values, dtype=np.float64)
+    valid = (codes >= 0) & (codes < len(CLASSIFICATIONS)) & (codes == np.floor(codes))
+    return np.where(valid, codes, UNKNOWN_CLASSIFICATION).astype(np.int8)
+
+
+def decode_classification(codes):
+    """ Categorical of the labels of classification codes, NaN for unknown """
+    return pd.Categorical.from_codes(np.asarray(codes, dtype=np.int8), categories=CLASSIFICATIONS)
+
+
 def map_classification_to_numbers(df):
-    # Only apply the mapping if the 'classification' column exists in the dataframe
-    if 'classification' in df.columns:
-        classification_map = {
-            'Memristive': 0,
-            'Capacitive': 1,
-            'Conductive': 2,
-            'Intermittent': 3,
-            'Mem-Capacitance': 4,
-            'Ohmic': 5,
-            'Non-Conductive': 6
-        }
-        df['classification'] = df['classification'].map(classification_map)
+    # Only apply the mapping if the 'classification' column holds labels
+    if 'classification' in df.columns and not pd.api.types.is_numeric_dtype(df['classification']):
+        df['classification'] = encode_classification(df['classification'])
     return df
 
+
+def encode_strings(series):
+    """ UTF-8 fixed width bytes of a text column, variable length strings if the longest is over FIXED_STRING_MAX_BYTES """
+    encoded = np.char.encode(series.astype(str).to_numpy(dtype=str), 'utf-8')
+    if encoded.dtype.itemsize <= FIXED_STRING_MAX_BYTES:
+        return encoded
+    return encoded.astype(object).astype(h5py.string_dtype(encoding='utf-8'))
+
+
 def dataframe_to_structured_array(df: pd.DataFrame):
     """Convert a Pandas DataFrame to an HDF5-friendly structured NumPy array.
 
-    Creates a compound dtype with UTF-8 variable-length strings for text columns
-    and preserves numeric columns. Returns a NumPy structured array suitable
-    for h5py.create_dataset(data=..., dtype=...).
+    Numeric columns keep their dtype, classification becomes CLASSIFICATION_DTYPE
+    codes and other text columns UTF-8 fixed width strings (see encode_strings).
+    Every column is converted whole, never row by row. Returns a NumPy structured
+    array suitable for h5py.create_dataset(data=..., dtype=...).
+    METADATA_COLUMNS are left out, they are saved once as attributes instead.
     """
     if df is None or df.empty:
         return None
 
-    df = map_classification_to_numbers(df.copy())
-
-    string_dt = h5py.string_dtype(encoding='utf-8')
-    dtype_fields = []
+    columns = {}
     for col in df.columns:
+        if col in METADATA_COLUMNS:
+            continue
         series = df[col]
-        if series.dtype == object:
-            dtype_fields.append((col, string_dt))
+        if col == 'classification':
+            columns[col] = classification_codes(series).view(CLASSIFICATION_DTYPE)
+        elif pd.api.types.is_numeric_dtype(series):
+            columns[col] = series.to_numpy()
         else:
-            dtype_fields.append((col, series.dtype))
+            columns[col] = encode_strings(series)
 
-    structured = np.empty(len(df), dtype=dtype_fields)
-    for col in df.columns:
-        series = df[col]
-        if series.dtype == object:
-            structured[col] = np.asarray(series.astype(str))
-        else:
-            structured[col] = np.asarray(series)
+    structured = np.empty(len(df), dtype=[(col, values.dtype) for col, values in columns.items()])
+    for col, values in columns.items():
+        structured[col] = values
 
-    return structured
\ No newline at end of file
+    return structured